@@ -2,10 +2,64 @@ import arcgisscripting
 import arcpy
 from arcpy.conversion import AddRasterToGeoPackage
 from arcpy.management import AddSpatialIndex
+import instrumentation
+import itertools
+import shapefile_writer
 import utils
 import os
 
+POINT_BATCH_SIZE = 100000
 
+
+def get_dbf_fields(fc):
+    """DBF fields of the shapefile writer matching the attribute fields of the feature class"""
+    fields = []
+    for field in arcpy.ListFields(fc):
+        if field.type == "String":
+            size = min(max(field.length, 1), shapefile_writer.MAX_TEXT_SIZE)
+            fields.append(shapefile_writer.Field(field.name, shapefile_writer.FIELD_TEXT, size))
+        elif field.type in ("SmallInteger", "Integer"):
+            fields.append(shapefile_writer.Field(field.name, shapefile_writer.FIELD_NUMBER, max(field.precision, 10)))
+        elif field.type in ("Single", "Double"):
+            fields.append(shapefile_writer.Field(field.name, shapefile_writer.FIELD_NUMBER, 19, 11))
+        elif field.type == "Date":
+            fields.append(shapefile_writer.Field(field.name, shapefile_writer.FIELD_DATE))
+    return fields
+
+@instrumentation.trace()
+def write_points_shapefile(fcs, out_path):
+    """
+    Merges (multi)point feature classes into a single-part point shapefile.
+    Multipoints are exploded by the search cursor, the shapefile is written
+    in batches by shapefile_writer. Schema and coordinate system are taken
+    from the first feature class, as in Merge_management.
+    """
+    fields = get_dbf_fields(fcs[0])
+    spatial_ref = arcpy.Describe(fcs[0]).spatialReference
+    point_count = 0
+    with shapefile_writer.ShapefileWriter(
+            out_path, shapefile_writer.SHAPE_POINT, fields, spatial_ref.exportToString()) as writer:
+        for fc in fcs:
+            fc_field_names = set(field.name for field in arcpy.ListFields(fc))
+            field_names = [field.name for field in fields if field.name in fc_field_names]
+            with arcpy.da.SearchCursor(
+                    fc,
+                    ["SHAPE@X", "SHAPE@Y"] + field_names,
+                    spatial_reference=spatial_ref,
+                    explode_to_points=True) as search_cursor:
+                while True:
+                    rows = [row for row in itertools.islice(search_cursor, POINT_BATCH_SIZE) if row[0] is not None]
+                    if not rows:
+                        break
+                    columns = list(zip(*rows))
+                    records = dict(zip(field_names, columns[2:]))
+                    writer.write_points(columns[0], columns[1], records=records)
+                    point_count += len(rows)
+    instrumentation.add_counts(inputs=len(fcs), features=point_count)
+    return point_count
+
+
+@instrumentation.trace()
 def bdot_manager(
     folder_in,
     recursive_search,
@@ -93,9 +147,10 @@ def bdot_manager(
     for i_bdot, bdot_class in enumerate(bdot_classes):
         arcpy.AddMessage(f"{i_bdot+1} / {len(bdot_classes)}: Loop 1 - BDOT class: {bdot_class}")
 
-        for geometry_type in geometry_types:
+        for geometry_type in instrumentation.iter_spans(geometry_types, "bdot_class"):
             arcpy.AddMessage(f"Loop 2 - geometry type: {geometry_type}")  
             class_name = bdot_class + "_" + geometry_type
+            instrumentation.add_counts(bdot_class=class_name)
 
             out_path = os.path.join(class_name + '_' + bdot_classes[bdot_class])
             if workspace_is_folder:
@@ -119,6 +174,29 @@ def bdot_manager(
                         arcpy.AddMessage(f"Loop 4 - File: {shp_path}")
                         shp_to_merge.append(shp_path)
 
+            # points written to a folder: exploded and merged by the shapefile writer.
+            # Lines and areas stay with PairwiseClip + Merge: their vertices can only
+            # be read through arcpy geometry objects point by point (slower than Merge)
+            # and clipping them cuts the geometry, which the writer does not do
+            if geometry_type == "P" and workspace_is_folder and len(shp_to_merge) > 0:
+                clipped_features = []
+                if clip_area_in:
+                    arcpy.AddMessage("In-memory clipping data...")
+                    for i_shp, shp in enumerate(shp_to_merge):
+                        clipped_fc = f"in_memory\\clipped_{i_shp}"
+                        clipped_features.append(clipped_fc)
+                        with instrumentation.span("PairwiseClip"):
+                            arcpy.PairwiseClip_analysis(shp, clip_area_in, clipped_fc)
+                    shp_to_merge = clipped_features
+
+                arcpy.AddMessage("Writing singlepart points...")
+                point_count = write_points_shapefile(shp_to_merge, os.path.join(workspace_out, out_path))
+
+                for fc in clipped_features:
+                    arcpy.Delete_management(fc)
+                arcpy.AddMessage(f"{out_path} created ({point_count} points).")
+                continue
+
             # Multipart to Singlepart for points
             if geometry_type == "P" and len(shp_to_merge) > 0:
                 arcpy.AddMessage("Converting points to singlepart...")
@@ -126,17 +204,20 @@ def bdot_manager(
                 for i_shp, shp in enumerate(shp_to_merge):
                     single_fc = f"in_memory\\single_{i_shp}"
                     single_features.append(single_fc)
-                    arcpy.MultipartToSinglepart_management(shp, single_fc)
+                    with instrumentation.span("MultipartToSinglepart"):
+                        arcpy.MultipartToSinglepart_management(shp, single_fc)
 
                 shp_to_merge = single_features
 
             if len(shp_to_merge) == 1:
                 if clip_area_in:
                     arcpy.AddMessage("Clipping data...")
-                    arcpy.PairwiseClip_analysis(shp_to_merge[0], clip_area_in, out_path)
+                    with instrumentation.span("PairwiseClip"):
+                        arcpy.PairwiseClip_analysis(shp_to_merge[0], clip_area_in, out_path)
                 else:
                     arcpy.AddMessage("Copying data...")
-                    arcpy.CopyFeatures_management(shp_to_merge[0], out_path)
+                    with instrumentation.span("CopyFeatures"):
+                        arcpy.CopyFeatures_management(shp_to_merge[0], out_path)
             elif len(shp_to_merge) > 1:
                 if clip_area_in:
                     arcpy.AddMessage("In-memory clipping data...")
@@ -146,9 +227,11 @@ def bdot_manager(
                     for i_shp, shp in enumerate(shp_to_merge):
                         clipped_fc = f"in_memory\\clipped_{i_shp}"
                         clipped_features.append(clipped_fc)
-                        arcpy.PairwiseClip_analysis(shp, clip_area_in, clipped_fc)
+                        with instrumentation.span("PairwiseClip"):
+                            arcpy.PairwiseClip_analysis(shp, clip_area_in, clipped_fc)
                         
-                    arcpy.Merge_management(clipped_features, out_path)
+                    with instrumentation.span("Merge", inputs=len(clipped_features)):
+                        arcpy.Merge_management(clipped_features, out_path)
                     
                     arcpy.AddMessage("Deleting in-memory datasets...")
                     for fc in clipped_features:
@@ -156,7 +239,8 @@ def bdot_manager(
                     
                 else:
                     arcpy.AddMessage("Merging data...")
-                    arcpy.Merge_management(shp_to_merge, out_path)
+                    with instrumentation.span("Merge", inputs=len(shp_to_merge)):
+                        arcpy.Merge_management(shp_to_merge, out_path)
             else:
                 arcpy.AddWarning("No data to process.")
                 continue
@@ -196,6 +280,9 @@ if __name__ == '__main__':
     if not continue_process:
         continue_process = False
 
+    # optional .json file with the stage trace (Chrome trace format)
+    trace_path = utils.get_optional_parameter(6, None, as_text=True)
+
     bdot_manager(
         folder_in,
         recursive_search,
@@ -203,4 +290,6 @@ if __name__ == '__main__':
         spatial_ref_out,
         clip_area_in,
         continue_process)
+
+    utils.report_instrumentation(trace_path)
         
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""
+Coordinate transformations without arcpy.
+
+Transverse Mercator (Krueger series, accurate to well below a millimetre
+within a few degrees of the central meridian) vectorized with NumPy, and
+transformers between the coordinate systems used with the Polish data:
+EPSG:4326/4258 (geographic), 2180 (PUWG-1992), 2176-2179 (PUWG-2000)
+and UTM. ETRS89 and WGS84 are treated as the same datum, as
+arcpy.Project_management does without a geographic transformation.
+If pyproj is installed, it is used instead.
+"""
+import functools
+import math
+
+import numpy as np
+
+try:
+    import pyproj
+except ImportError:
+    pyproj = None
+
+GRS80_A = 6378137.0
+GRS80_F = 1 / 298.257222101
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+# ESRI codes of the systems identical with the EPSG ones
+EPSG_ALIASES = {102173: 2180}
+GEOGRAPHIC_CODES = (4326, 4258)
+
+
+class TransverseMercator:
+    '''Transverse Mercator projection, coordinates in degrees and metres'''
+    def __init__(self, lon_0, k_0, false_easting, false_northing, a=GRS80_A, f=GRS80_F):
+        self.lon_0 = math.radians(lon_0)
+        self.k_0 = k_0
+        self.false_easting = false_easting
+        self.false_northing = false_northing
+
+        n = f / (2 - f)
+        self.e = math.sqrt(f * (2 - f))
+        # rectifying radius
+        self.r = a / (1 + n) * (1 + n ** 2 / 4 + n ** 4 / 64) * k_0
+        self.alpha = (
+            n / 2 - 2 * n ** 2 / 3 + 5 * n ** 3 / 16 + 41 * n ** 4 / 180,
+            13 * n ** 2 / 48 - 3 * n ** 3 / 5 + 557 * n ** 4 / 1440,
+            61 * n ** 3 / 240 - 103 * n ** 4 / 140,
+            49561 * n ** 4 / 161280)
+        self.beta = (
+            n / 2 - 2 * n ** 2 / 3 + 37 * n ** 3 / 96 - n ** 4 / 360,
+            n ** 2 / 48 + n ** 3 / 15 - 437 * n ** 4 / 1440,
+            17 * n ** 3 / 480 - 37 * n ** 4 / 840,
+            4397 * n ** 4 / 161280)
+        self.delta = (
+            2 * n - 2 * n ** 2 / 3 - 2 * n ** 3 + 116 * n ** 4 / 45,
+            7 * n ** 2 / 3 - 8 * n ** 3 / 5 - 227 * n ** 4 / 45,
+            56 * n ** 3 / 15 - 136 * n ** 4 / 35,
+            4279 * n ** 4 / 630)
+
+    def forward(self, lon, lat):
+        """Geographic (lon, lat) in degrees to projected (easting, northing), scalars or arrays."""
+        phi = np.radians(lat)
+        lam = np.radians(lon) - self.lon_0
+
+        # conformal latitude
+        sin_phi = np.sin(phi)
+        t = np.sinh(np.arctanh(sin_phi) - self.e * np.arctanh(self.e * sin_phi))
+        xi_prime = np.arctan2(t, np.cos(lam))
+        eta_prime = np.arctanh(np.sin(lam) / np.sqrt(1 + t * t))
+
+        xi = xi_prime
+        eta = eta_prime
+        for j, alpha in enumerate(self.alpha, 1):
+            xi = xi + alpha * np.sin(2 * j * xi_prime) * np.cosh(2 * j * eta_prime)
+            eta = eta + alpha * np.cos(2 * j * xi_prime) * np.sinh(2 * j * eta_prime)
+
+        return self.false_easting + self.r * eta, self.false_northing + self.r * xi
+
+    def inverse(self, easting, northing):
+        """Projected (easting, northing) to geographic (lon, lat) in degrees, scalars or arrays."""
+        xi = (np.asarray(northing, dtype=float) - self.false_northing) / self.r
+        eta = (np.asarray(easting, dtype=float) - self.false_easting) / self.r
+
+        xi_prime = xi
+        eta_prime = eta
+        for j, beta in enumerate(self.beta, 1):
+            xi_prime = xi_prime - beta * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+            eta_prime = eta_prime - beta * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+
+        # conformal latitude to geodetic latitude
+        chi = np.arcsin(np.sin(xi_prime) / np.cosh(eta_prime))
+        phi = chi
+        for j, delta in enumerate(self.delta, 1):
+            phi = phi + delta * np.sin(2 * j * chi)
+        lam = np.arctan2(np.sinh(eta_prime), np.cos(xi_prime))
+
+        return np.degrees(self.lon_0 + lam), np.degrees(phi)
+
+# PUWG-1992
+EPSG_2180 = TransverseMercator(19.0, 0.9993, 500000.0, -5300000.0)
+
+def get_projection(code):
+    """
+    TransverseMercator of the EPSG code, None for geographic coordinates.
+    Raises KeyError for unsupported codes.
+    """
+    code = EPSG_ALIASES.get(code, code)
+    if code in GEOGRAPHIC_CODES:
+        return None
+    if code == 2180:
+        return EPSG_2180
+    # PUWG-2000, zones 5-8
+    if 2176 <= code <= 2179:
+        zone = code - 2171
+        return TransverseMercator(zone * 3.0, 0.999923, zone * 1000000.0 + 500000.0, 0.0)
+    # ETRS89 / UTM
+    if 25828 <= code <= 25838:
+        return TransverseMercator((code - 25800) * 6.0 - 183.0, 0.9996, 500000.0, 0.0)
+    # WGS84 / UTM north and south
+    if 32601 <= code <= 32660:
+        return TransverseMercator((code - 32600) * 6.0 - 183.0, 0.9996, 500000.0, 0.0, WGS84_A, WGS84_F)
+    if 32701 <= code <= 32760:
+        return TransverseMercator((code - 32700) * 6.0 - 183.0, 0.9996, 500000.0, 10000000.0, WGS84_A, WGS84_F)
+    raise KeyError(code)
+
+class Transformer:
+    '''Transformation of x, y arrays from one coordinate system to another'''
+    def __init__(self, source_code, target_code):
+        self.source_code = EPSG_ALIASES.get(source_code, source_code)
+        self.target_code = EPSG_ALIASES.get(target_code, target_code)
+        self._pyproj_transformer = None
+        if pyproj is not None:
+            self._pyproj_transformer = pyproj.Transformer.from_crs(
+                self.source_code, self.target_code, always_xy=True)
+        else:
+            self._source = get_projection(self.source_code)
+            self._target = get_projection(self.target_code)
+
+    def transform(self, x, y):
+        """Returns transformed x, y arrays (x is the longitude in geographic coordinates)."""
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if self.source_code == self.target_code:
+            return x, y
+        if self._pyproj_transformer is not None:
+            return self._pyproj_transformer.transform(x, y)
+
+        if self._source is not None:
+            x, y = self._source.inverse(x, y)
+        if self._target is not None:
+            x, y = self._target.forward(x, y)
+        return x, y
+
+@functools.lru_cache(maxsize=None)
+def get_transformer(source_code, target_code):
+    """Transformer of the pair of codes, reused between calls, or None if the pair is not supported."""
+    try:
+        return Transformer(source_code, target_code)
+    except KeyError:
+        return None
+    except Exception as error:
+        if pyproj is not None and isinstance(error, pyproj.exceptions.CRSError):
+            return None
+        raise
@@ -0,0 +1,213 @@
+"""
+Instrumentation of the script stages (does not need arcpy).
+
+A span records the wall time, CPU time, resident memory (RSS) and
+optional counts (features, points...) of one stage. Spans can be nested
+and are collected by a tracer, which writes them as a Chrome trace (JSON)
+that can be opened in chrome://tracing, https://ui.perfetto.dev or
+speedscope as a flame graph.
+
+Example:
+    with instrumentation.span("Merge", inputs=len(fcs)) as stage:
+        arcpy.Merge_management(fcs, out_fc)
+        stage.counts["features"] = int(arcpy.GetCount_management(out_fc)[0])
+
+    @instrumentation.trace()
+    def remove_duplicate_points(point_store):
+        ...
+        instrumentation.add_counts(removed=removed_count)
+
+    instrumentation.write_chrome_trace("trace.json")
+"""
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+MB = 1024 * 1024
+
+
+def get_rss_mb():
+    """Current resident set size of the process in MB (None if unknown)."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / MB
+    if sys.platform.startswith("linux"):
+        with open("/proc/self/statm") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / MB
+    return None
+
+def get_peak_rss_mb():
+    """Peak resident set size of the process in MB (None if unknown)."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes on Linux
+        if sys.platform == "darwin":
+            return peak / MB
+        return peak / 1024
+    if psutil is not None:
+        return psutil.Process().memory_info().peak_wset / MB
+    return None
+
+class Span:
+    '''Measurements of one stage'''
+    def __init__(self, name, counts, depth):
+        self.name = name
+        self.counts = dict(counts)
+        self.depth = depth
+        self.pid = os.getpid()
+        self.tid = threading.get_ident()
+        # seconds from the start of the tracer
+        self.start = None
+        self.wall = None
+        self.cpu = None
+        self.rss_start_mb = None
+        self.rss_end_mb = None
+        self.peak_rss_mb = None
+
+    def get_args(self):
+        args = dict(self.counts)
+        args["cpu_s"] = round(self.cpu, 6)
+        if self.rss_end_mb is not None:
+            args["rss_mb"] = round(self.rss_end_mb, 1)
+            args["rss_delta_mb"] = round(self.rss_end_mb - self.rss_start_mb, 1)
+        if self.peak_rss_mb is not None:
+            args["peak_rss_mb"] = round(self.peak_rss_mb, 1)
+        return args
+
+class Tracer:
+    '''Collects the finished spans'''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._local = threading.local()
+
+    def _get_stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def span(self, name, **counts):
+        """Context manager measuring the block, counts can be added to span.counts inside."""
+        stack = self._get_stack()
+        span = Span(name, counts, len(stack))
+        stack.append(span)
+        span.rss_start_mb = get_rss_mb()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.wall = time.perf_counter() - wall_start
+            span.cpu = time.process_time() - cpu_start
+            span.start = wall_start - self.origin
+            span.rss_end_mb = get_rss_mb()
+            span.peak_rss_mb = get_peak_rss_mb()
+            stack.pop()
+            self.spans.append(span)
+
+    def add_counts(self, **counts):
+        """Adds counts to the innermost open span (of the current thread)."""
+        stack = self._get_stack()
+        if stack:
+            stack[-1].counts.update(counts)
+
+    def iter_spans(self, items, name):
+        """Yields the items, each in its own span covering the processing of the item by the caller."""
+        for item in items:
+            with self.span(name):
+                yield item
+
+    def trace(self, name=None):
+        """Decorator measuring every call of the function."""
+        def decorator(function):
+            span_name = name or function.__name__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def get_chrome_trace(self):
+        """Spans as Chrome trace "complete" events (times in microseconds)."""
+        events = [{
+            "name": "process_name",
+            "ph": "M",
+            "pid": os.getpid(),
+            "args": {"name": os.path.basename(sys.argv[0]) or "python"}}]
+        for span in sorted(self.spans, key=lambda span: (span.start, span.depth)):
+            events.append({
+                "name": span.name,
+                "cat": "stage",
+                "ph": "X",
+                "ts": round(span.start * 1e6, 3),
+                "dur": round(span.wall * 1e6, 3),
+                "pid": span.pid,
+                "tid": span.tid,
+                "args": span.get_args()})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as trace_file:
+            json.dump(self.get_chrome_trace(), trace_file)
+
+    def get_summary(self):
+        """Totals per span name: [(name, calls, wall, cpu, peak RSS)] sorted by the wall time."""
+        totals = {}
+        for span in self.spans:
+            calls, wall, cpu, peak = totals.get(span.name, (0, 0.0, 0.0, None))
+            if span.peak_rss_mb is not None:
+                peak = max(peak or 0.0, span.peak_rss_mb)
+            totals[span.name] = (calls + 1, wall + span.wall, cpu + span.cpu, peak)
+        summary = [(name, *values) for name, values in totals.items()]
+        return sorted(summary, key=lambda item: item[2], reverse=True)
+
+    def format_summary(self):
+        """Lines of the summary, e.g. for arcpy.AddMessage."""
+        lines = []
+        for name, calls, wall, cpu, peak in self.get_summary():
+            peak_text = f", peak RSS {peak:.0f} MB" if peak is not None else ""
+            lines.append(f"{name}: {wall:.2f} s wall, {cpu:.2f} s CPU, {calls}x{peak_text}")
+        return lines
+
+# tracer shared by the scripts
+TRACER = Tracer()
+
+def span(name, **counts):
+    return TRACER.span(name, **counts)
+
+def trace(name=None):
+    return TRACER.trace(name)
+
+def add_counts(**counts):
+    TRACER.add_counts(**counts)
+
+def iter_spans(items, name):
+    return TRACER.iter_spans(items, name)
+
+def write_chrome_trace(path):
+    TRACER.write_chrome_trace(path)
+
+def format_summary():
+    return TRACER.format_summary()
+
+def reset():
+    TRACER.reset()
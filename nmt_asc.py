@@ -0,0 +1,496 @@
+"""
+Bulk parsing of NMT ASCII TBD files.
+
+The module does not depend on arcpy, so it can be used (and timed)
+outside ArcGIS. NumPy is used when available, otherwise the functions
+fall back to pure Python lists.
+"""
+import functools
+import json
+import mmap
+import os
+import re
+import warnings
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+POINT_BATCH_SIZE = 100000
+
+# size of a chunk read at once from the memory-mapped file
+CHUNK_SIZE = 16 * 1024 * 1024
+
+LINE_START = b"Start"
+LINE_END = b"End"
+
+# malformed lines kept as examples per file, the rest is only counted
+MAX_ERROR_EXAMPLES = 10
+MAX_EXAMPLE_LENGTH = 200
+# text with malformed lines is split into parts down to this number of lines,
+# only these short segments are parsed line by line
+SPLIT_PARTS = 16
+MIN_SPLIT_LINES = 64
+
+
+class ParseErrors:
+    '''
+    Malformed lines of the parsed files: the count per file and only
+    the first max_examples (line_number, line) examples.
+    '''
+    def __init__(self, max_examples=MAX_ERROR_EXAMPLES):
+        self.max_examples = max_examples
+        # path -> number of malformed lines
+        self.counts = {}
+        # path -> [(line_number, line)]
+        self.examples = {}
+
+    def add(self, path, line_number, line):
+        self.counts[path] = self.counts.get(path, 0) + 1
+        examples = self.examples.setdefault(path, [])
+        if len(examples) < self.max_examples:
+            examples.append((line_number, line[:MAX_EXAMPLE_LENGTH]))
+
+    def add_file(self, path, count, examples):
+        """Adds already counted errors of the file (e.g. from the cache or another process)."""
+        if count <= 0:
+            return
+        self.counts[path] = self.counts.get(path, 0) + count
+        file_examples = self.examples.setdefault(path, [])
+        free = max(0, self.max_examples - len(file_examples))
+        file_examples.extend((line_number, line) for line_number, line in examples[:free])
+
+    def merge(self, other):
+        for path, count in other.counts.items():
+            self.add_file(path, count, other.examples.get(path, []))
+
+    def get_handler(self, path):
+        """on_error(line_number, line) callback of the parsing functions for the file."""
+        return functools.partial(self.add, path)
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def to_dict(self):
+        return {
+            "total": self.total(),
+            "files": [{
+                "path": path,
+                "count": count,
+                "examples": [
+                    {"line_number": line_number, "line": line}
+                    for line_number, line in self.examples.get(path, [])]}
+                for path, count in self.counts.items()]}
+
+    def write_report(self, path):
+        """Writes the errors as a JSON report."""
+        with open(path, "w", encoding="utf-8") as report_file:
+            json.dump(self.to_dict(), report_file, indent=1, ensure_ascii=False)
+
+
+def parse_xyz_line(line):
+    floats = [float(x) for x in line.split()]
+
+    # x/y are swapped in the ASCII files
+    x = floats[1]
+    y = floats[0]
+    z = floats[2]
+
+    return x, y, z
+
+def _parse_values_numpy(data):
+    """
+    Parses the whole text with NumPy.
+    Returns None if the text is not a clean 3-column table,
+    so the caller can use the line-by-line path.
+    """
+    data = data.strip()
+    if not data:
+        return np.empty((0, 3))
+
+    # blank lines in the middle break the row count check
+    if b"\n\n" in data or b"\n\r\n" in data:
+        return None
+    row_count = data.count(b"\n") + 1
+
+    with warnings.catch_warnings():
+        # NumPy < 2 only warns about unparsed data
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            values = np.fromstring(data, dtype=np.float64, sep=" ")
+        except (ValueError, DeprecationWarning):
+            return None
+
+    if values.size != 3 * row_count or not _has_three_columns(data, row_count):
+        return None
+
+    return values.reshape(row_count, 3)
+
+def _has_three_columns(data, row_count):
+    """True if every line of the text (already parsed as numbers) has exactly 3 tokens."""
+    text = np.frombuffer(data, dtype=np.uint8)
+    # only numbers and whitespace are left, anything up to the space is a separator
+    is_separator = text <= 32
+    token_starts = ~is_separator
+    token_starts[1:] &= is_separator[:-1]
+    del is_separator
+    token_positions = np.flatnonzero(token_starts)
+    del token_starts
+    line_ends = np.flatnonzero(text == 10)
+    tokens_per_line = np.diff(np.searchsorted(token_positions, line_ends), prepend=0, append=len(token_positions))
+    return len(tokens_per_line) == row_count and bool(np.all(tokens_per_line == 3))
+
+def _parse_points_python(data, on_error=None):
+    x = []
+    y = []
+    z = []
+    for i, line in enumerate(data.splitlines()):
+        if not line.strip():
+            continue
+        try:
+            x_i, y_i, z_i = parse_xyz_line(line)
+        except (ValueError, IndexError):
+            if on_error:
+                on_error(i + 1, line.decode(errors="replace"))
+            continue
+        x.append(x_i)
+        y.append(y_i)
+        z.append(z_i)
+
+    return x, y, z
+
+def _split_data(data, separator=b"\n", parts=SPLIT_PARTS):
+    """
+    Splits the text into about equal parts, each ending after a line
+    containing the separator. Returns the list of parts (one if the text
+    cannot be split).
+    """
+    positions = [0]
+    for i in range(1, parts):
+        separator_position = data.find(separator, max(positions[-1], len(data) * i // parts))
+        if separator_position < 0:
+            break
+        line_break = data.find(b"\n", separator_position)
+        if line_break < 0 or line_break + 1 >= len(data):
+            break
+        positions.append(line_break + 1)
+    positions.append(len(data))
+    return [data[start:end] for start, end in zip(positions[:-1], positions[1:])]
+
+def _parse_points_split(data, on_error=None, first_line=0):
+    """
+    Parses the text with NumPy. A text with malformed lines is split
+    into parts, so the clean parts are still parsed in bulk and only short
+    segments around the malformed lines are parsed line by line.
+    Returns a list of (x, y, z) chunks.
+    """
+    values = _parse_values_numpy(data)
+    if values is not None:
+        return [(values[:, 1], values[:, 0], values[:, 2])]
+
+    parts = _split_data(data) if data.count(b"\n") >= MIN_SPLIT_LINES else [data]
+    if len(parts) == 1:
+        x, y, z = _parse_points_python(data, _offset_on_error(on_error, first_line))
+        return [(
+            np.array(x, dtype=np.float64),
+            np.array(y, dtype=np.float64),
+            np.array(z, dtype=np.float64))]
+
+    chunks = []
+    for part in parts:
+        chunks.extend(_parse_points_split(part, on_error, first_line))
+        first_line += part.count(b"\n")
+    return chunks
+
+def parse_points(data, on_error=None):
+    """
+    Parses point records "y x z" into x, y, z arrays.
+
+    XY are swapped the same way as in parse_xyz_line.
+    Malformed lines are skipped and reported with on_error(line_number, line).
+    """
+    if isinstance(data, str):
+        data = data.encode()
+
+    if np is None:
+        return _parse_points_python(data, on_error)
+
+    chunks = _parse_points_split(data, on_error)
+    if len(chunks) > 1:
+        return concatenate_chunks(chunks)
+
+    return tuple(np.ascontiguousarray(values) for values in chunks[0])
+
+def read_point_file(path, on_error=None):
+    """Reads the whole point file (p, t, pz, k) into x, y, z arrays."""
+    with open(path, "rb") as asc_file:
+        data = asc_file.read()
+
+    return parse_points(data, on_error)
+
+def get_bounds(x, y):
+    """Returns (x_min, y_min, x_max, y_max) of the coordinates or None if empty."""
+    if len(x) == 0:
+        return None
+
+    if np is not None and isinstance(x, np.ndarray):
+        return float(x.min()), float(y.min()), float(x.max()), float(y.max())
+
+    return min(x), min(y), max(x), max(y)
+
+def to_list(values):
+    if isinstance(values, list):
+        return values
+    return values.tolist()
+
+def concatenate_chunks(chunks):
+    """Joins an iterable of (x, y, z) chunks into single x, y, z arrays."""
+    chunks = list(chunks)
+    if np is None:
+        return tuple([value for chunk in chunks for value in chunk[i]] for i in range(3))
+
+    if not chunks:
+        return np.empty(0), np.empty(0), np.empty(0)
+    return tuple(np.concatenate([chunk[i] for chunk in chunks]) for i in range(3))
+
+def iter_batches(arrays, batch_size=POINT_BATCH_SIZE):
+    """Yields tuples of aligned array slices with at most batch_size items."""
+    count = len(arrays[0])
+    for start in range(0, count, batch_size):
+        yield tuple(array[start:start + batch_size] for array in arrays)
+
+def iter_file_chunks(path, chunk_size=CHUNK_SIZE, end_marker=None):
+    """
+    Yields the memory-mapped file content in chunks of about chunk_size bytes.
+
+    Every chunk ends on a line break. If end_marker is given, a chunk ends
+    only after a line containing end_marker, so records spanning several
+    lines (e.g. Start/End blocks) are never split between chunks.
+    """
+    if os.path.getsize(path) == 0:
+        return
+
+    with open(path, "rb") as asc_file, \
+        mmap.mmap(asc_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        size = len(data)
+        start = 0
+        while start < size:
+            end = min(start + chunk_size, size)
+            if end < size and end_marker is not None:
+                marker = data.find(end_marker, end)
+                end = size if marker < 0 else marker
+            if end < size:
+                line_break = data.find(b"\n", end)
+                end = size if line_break < 0 else line_break + 1
+
+            yield data[start:end]
+
+            # release already parsed pages, so the resident memory stays flat
+            if hasattr(mmap, "MADV_DONTNEED"):
+                released = end - end % mmap.PAGESIZE
+                if released > 0:
+                    data.madvise(mmap.MADV_DONTNEED, 0, released)
+            start = end
+
+def _offset_on_error(on_error, line_offset):
+    if on_error is None:
+        return None
+    return lambda line_number, line: on_error(line_offset + line_number, line)
+
+def iter_point_chunks(path, chunk_size=CHUNK_SIZE, on_error=None):
+    """Yields x, y, z arrays parsed chunk by chunk from the point file."""
+    line_offset = 0
+    for chunk in iter_file_chunks(path, chunk_size):
+        yield parse_points(chunk, _offset_on_error(on_error, line_offset))
+        line_offset += chunk.count(b"\n")
+
+class LineData:
+    '''
+    Lines stored as a ragged array: vertices of the line i are
+    x/y/z[offsets[i]:offsets[i + 1]].
+    '''
+    def __init__(self, x, y, z, offsets, end_line_numbers):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.offsets = offsets
+        # numbers of the "End" lines in the ASC file (for messages)
+        self.end_line_numbers = end_line_numbers
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def vertex_count(self):
+        return len(self.x)
+
+def _line_data_from_lists(x, y, z, counts, end_line_numbers):
+    offsets = [0]
+    for count in counts:
+        offsets.append(offsets[-1] + count)
+
+    if np is None:
+        return LineData(x, y, z, offsets, end_line_numbers)
+
+    return LineData(
+        np.asarray(x, dtype=np.float64),
+        np.asarray(y, dtype=np.float64),
+        np.asarray(z, dtype=np.float64),
+        np.asarray(offsets, dtype=np.int64),
+        np.asarray(end_line_numbers, dtype=np.int64))
+
+def _parse_lines_python(data, on_error=None):
+    x = []
+    y = []
+    z = []
+    counts = []
+    end_line_numbers = []
+
+    vertices = []
+    for i, line in enumerate(data.splitlines()):
+        if LINE_START in line:
+            vertices = []
+        elif LINE_END in line:
+            # polyline needs more than 1 vertex
+            if len(vertices) > 1:
+                for x_i, y_i, z_i in vertices:
+                    x.append(x_i)
+                    y.append(y_i)
+                    z.append(z_i)
+                counts.append(len(vertices))
+                end_line_numbers.append(i + 1)
+            vertices = []
+        elif not line.strip():
+            continue
+        else:
+            try:
+                vertices.append(parse_xyz_line(line))
+            except (ValueError, IndexError):
+                if on_error:
+                    on_error(i + 1, line.decode(errors="replace"))
+
+    return _line_data_from_lists(x, y, z, counts, end_line_numbers)
+
+_LINE_MARKER = re.compile(rb"^[^\n]*?(Start|End)[^\n]*$", re.MULTILINE)
+
+def _parse_lines_numpy(data):
+    """
+    Parses the Start/End blocks in one NumPy call.
+    Returns None if any block is not a clean 3-column table.
+    """
+    blocks = []
+    counts = []
+    end_line_numbers = []
+
+    newline_count = 0
+    position = 0
+    block_start = None
+    for marker in _LINE_MARKER.finditer(data):
+        newline_count += data.count(b"\n", position, marker.start())
+        position = marker.start()
+
+        if marker.group(1) == LINE_START:
+            block_start = marker.end()
+        elif block_start is not None:
+            block = data[block_start:marker.start()].strip()
+            if b"\n\n" in block or b"\n\r\n" in block:
+                return None
+            count = block.count(b"\n") + 1 if block else 0
+            # polyline needs more than 1 vertex
+            if count > 1:
+                blocks.append(block)
+                counts.append(count)
+                end_line_numbers.append(newline_count + 1)
+            block_start = None
+
+    values = _parse_values_numpy(b"\n".join(blocks))
+    if values is None or len(values) != sum(counts):
+        return None
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return LineData(
+        np.ascontiguousarray(values[:, 1]),
+        np.ascontiguousarray(values[:, 0]),
+        np.ascontiguousarray(values[:, 2]),
+        offsets,
+        np.asarray(end_line_numbers, dtype=np.int64))
+
+def _parse_lines_split(data, on_error=None, first_line=0):
+    """
+    Parses the Start/End blocks with NumPy, splitting a text with malformed
+    lines into parts after "End" lines (see _parse_points_split).
+    Returns a list of LineData.
+    """
+    line_data = _parse_lines_numpy(data)
+    if line_data is None:
+        parts = _split_data(data, LINE_END) if data.count(b"\n") >= MIN_SPLIT_LINES else [data]
+        if len(parts) > 1:
+            line_data_list = []
+            for part in parts:
+                line_data_list.extend(_parse_lines_split(part, on_error, first_line))
+                first_line += part.count(b"\n")
+            return line_data_list
+        line_data = _parse_lines_python(data, _offset_on_error(on_error, first_line))
+
+    line_data.end_line_numbers += first_line
+    return [line_data]
+
+def parse_lines(data, on_error=None):
+    """
+    Parses Start/End delimited line records into LineData.
+
+    Blocks with less than 2 vertices are skipped.
+    Malformed lines are skipped and reported with on_error(line_number, line).
+    """
+    if isinstance(data, str):
+        data = data.encode()
+
+    if np is None:
+        return _parse_lines_python(data, on_error)
+
+    line_data_list = _parse_lines_split(data, on_error)
+    if len(line_data_list) > 1:
+        return concatenate_lines(line_data_list)
+    return line_data_list[0]
+
+def concatenate_lines(line_data_list):
+    """Joins a list of LineData into one LineData."""
+    x = []
+    y = []
+    z = []
+    counts = []
+    end_line_numbers = []
+    if np is None:
+        for line_data in line_data_list:
+            x.extend(line_data.x)
+            y.extend(line_data.y)
+            z.extend(line_data.z)
+            counts.extend(b - a for a, b in zip(line_data.offsets[:-1], line_data.offsets[1:]))
+            end_line_numbers.extend(line_data.end_line_numbers)
+        return _line_data_from_lists(x, y, z, counts, end_line_numbers)
+
+    if not line_data_list:
+        return _line_data_from_lists([], [], [], [], [])
+
+    vertex_offsets = np.cumsum([0] + [item.vertex_count() for item in line_data_list])
+    offsets = np.concatenate(
+        [[0]] + [item.offsets[1:] + vertex_offset for item, vertex_offset in zip(line_data_list, vertex_offsets)])
+    return LineData(
+        np.concatenate([item.x for item in line_data_list]),
+        np.concatenate([item.y for item in line_data_list]),
+        np.concatenate([item.z for item in line_data_list]),
+        offsets.astype(np.int64),
+        np.concatenate([item.end_line_numbers for item in line_data_list]))
+
+def iter_line_chunks(path, chunk_size=CHUNK_SIZE, on_error=None):
+    """Yields LineData parsed chunk by chunk from the line file."""
+    line_offset = 0
+    for chunk in iter_file_chunks(path, chunk_size, LINE_END):
+        line_data = parse_lines(chunk, _offset_on_error(on_error, line_offset))
+        if np is None:
+            line_data.end_line_numbers = [line_offset + number for number in line_data.end_line_numbers]
+        else:
+            line_data.end_line_numbers += line_offset
+        yield line_data
+        line_offset += chunk.count(b"\n")
@@ -0,0 +1,477 @@
+"""
+Benchmarks of the NMT pipeline (do not need arcpy).
+
+Read modes of one large point file:
+    python nmt_benchmark.py --size-mb 2048 --folder /tmp/nmt_benchmark
+
+Stage suite on synthetic sheet sets (point grids with overlapping borders,
+spot heights and Start/End breaklines, some of them along the seams),
+timing discover, parse, dedupe, seams, clip and write for every sheet count:
+    python nmt_benchmark.py --suite --sheets 1 4 16 --json results.json
+    python nmt_benchmark.py --suite --sheets 1 4 16 --compare results.json
+    python nmt_benchmark.py --suite --sheets 16 --max-workers 4 --quantize
+
+Output ordering: points of a sheet set in the file order and sorted by the
+Hilbert and Morton curves (nmt_order), each followed by window queries
+through a block index (bounding box of every block of consecutive records,
+like the pages of a spatial index):
+    python nmt_benchmark.py --order --sheets 16 --queries 1000 --window 50
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import instrumentation
+import nmt_asc
+import nmt_geometry
+import nmt_order
+import nmt_sheets
+import nmt_store
+import shapefile_writer
+
+# whole file at once, chunks of the reader, the sheet reader of the pipeline
+READ_MODES = ["whole", "stream", "sheet"]
+STAGES = ["discover", "parse", "dedupe", "seams", "clip", "write"]
+
+# the same values as in nmt_manager
+POINT_SIGNS = ["p", "k"]
+LINE_SIGNS = ["s"]
+EPSILON = 0.005
+ENVELOPE_EDGE_DISTANCE = 1.0
+
+# lower left corner of the synthetic sheet set (EPSG:2180)
+ORIGIN_X = 500000.0
+ORIGIN_Y = 300000.0
+
+# records per block of the block index of the order benchmark
+ORDER_BLOCK_SIZE = 4096
+
+
+def write_point_file(path, size_mb, x0=5600000.0, y0=400000.0, step=1.0):
+    """Writes a synthetic point grid file "y x z" of about size_mb megabytes."""
+    row = 0
+    columns = 2000
+    target_size = size_mb * 1024 * 1024
+    with open(path, "w") as asc_file:
+        while asc_file.tell() < target_size:
+            lines = []
+            for _ in range(100000):
+                x = x0 + (row % columns) * step
+                y = y0 + (row // columns) * step
+                lines.append(f"{x:.2f} {y:.2f} {100.0 + (row % 997) * 0.01:.2f}\n")
+                row += 1
+            asc_file.write("".join(lines))
+    return row
+
+def run_read(mode, path):
+    """Reads the file with the given mode, returns (seconds, point count)."""
+    start = time.perf_counter()
+    count = 0
+    if mode == "whole":
+        x, _, _ = nmt_asc.read_point_file(path)
+        count = len(x)
+    elif mode == "stream":
+        for x, _, _ in nmt_asc.iter_point_chunks(path):
+            count += len(x)
+    elif mode == "sheet":
+        sheet = nmt_sheets.read_sheet("benchmark", [("p", path)], [])
+        count = sum(len(x) for _, x, _, _ in sheet.points)
+    else:
+        raise ValueError(f"Unknown read mode: {mode}")
+    return time.perf_counter() - start, count
+
+def benchmark_read_modes(path, modes=READ_MODES):
+    """Runs every mode in a separate process, so the peak RSS is not shared."""
+    results = []
+    for mode in modes:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--read", mode, path],
+            check=True,
+            capture_output=True,
+            text=True).stdout
+        seconds, count, peak_rss_mb = output.split()
+        results.append({
+            "mode": mode,
+            "seconds": float(seconds),
+            "points": int(count),
+            "peak_rss_mb": float(peak_rss_mb)})
+    return results
+
+def get_terrain_z(x, y):
+    """Smooth synthetic terrain, the same for every sheet, so overlapping points are equal."""
+    return 100.0 + 10.0 * np.sin(x / 500.0) * np.cos(y / 700.0) + 0.002 * (x - ORIGIN_X)
+
+def write_xyz(asc_file, x, y, z):
+    # x/y are swapped in the ASCII files
+    np.savetxt(asc_file, np.column_stack((y, x, z)), fmt="%.2f")
+
+def write_line_file(path, lines):
+    """Writes Start/End blocks of (x, y) vertex arrays."""
+    with open(path, "w") as asc_file:
+        for x, y in lines:
+            asc_file.write("Start\n")
+            write_xyz(asc_file, x, y, get_terrain_z(x, y))
+            asc_file.write("End\n")
+
+def get_sheet_index(row, column):
+    return f"N-34-{100 + row:03d}-{100 + column:03d}"
+
+def get_sheet_layout(sheet_count):
+    """Rows and columns of a sheet set as square as possible."""
+    columns = int(math.ceil(math.sqrt(sheet_count)))
+    rows = int(math.ceil(sheet_count / columns))
+    return rows, columns
+
+def get_sheet_envelopes(sheet_count, sheet_size):
+    """Envelopes (x_min, y_min, x_max, y_max) of the sheets by index."""
+    _, columns = get_sheet_layout(sheet_count)
+    envelopes = {}
+    for i in range(sheet_count):
+        row, column = divmod(i, columns)
+        x_min = ORIGIN_X + column * sheet_size
+        y_min = ORIGIN_Y + row * sheet_size
+        envelopes[get_sheet_index(row, column)] = (x_min, y_min, x_min + sheet_size, y_min + sheet_size)
+    return envelopes
+
+def write_sheet_set(folder, sheet_count, sheet_size=500.0, step=1.0, overlap=2, line_count=100,
+        line_vertices=50, spot_heights=200, seed=0):
+    """
+    Writes a synthetic TBD sheet set: for every sheet a point grid (_p)
+    reaching overlap steps over the sheet edges (duplicates on the seams),
+    spot heights (_k) and breaklines (_s) with one line along the left and
+    the bottom edge of the sheet. Returns the number of points and lines.
+    """
+    random = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    point_total = 0
+    line_total = 0
+    for index, (x_min, y_min, x_max, y_max) in get_sheet_envelopes(sheet_count, sheet_size).items():
+        grid_x = np.arange(x_min - overlap * step, x_max + overlap * step + step / 2, step)
+        grid_y = np.arange(y_min - overlap * step, y_max + overlap * step + step / 2, step)
+        x, y = [values.ravel() for values in np.meshgrid(grid_x, grid_y)]
+        with open(os.path.join(folder, f"{index}_p.asc"), "w") as asc_file:
+            write_xyz(asc_file, x, y, get_terrain_z(x, y))
+
+        x = random.uniform(x_min, x_max, spot_heights)
+        y = random.uniform(y_min, y_max, spot_heights)
+        with open(os.path.join(folder, f"{index}_k.asc"), "w") as asc_file:
+            write_xyz(asc_file, x, y, get_terrain_z(x, y) + 0.5)
+
+        # random walks inside the sheet
+        lines = []
+        for _ in range(line_count):
+            start = random.uniform((x_min, y_min), (x_max, y_max))
+            walk = start + np.cumsum(random.normal(0.0, sheet_size / 100.0, (line_vertices, 2)), axis=0)
+            walk = np.clip(walk, (x_min + 2.0, y_min + 2.0), (x_max - 2.0, y_max - 2.0))
+            lines.append((walk[:, 0], walk[:, 1]))
+        # lines along the seams
+        edge = np.linspace(0.0, sheet_size, line_vertices)
+        lines.append((np.full(line_vertices, x_min), y_min + edge))
+        lines.append((x_min + edge, np.full(line_vertices, y_min)))
+        write_line_file(os.path.join(folder, f"{index}_s.asc"), lines)
+
+        point_total += len(grid_x) * len(grid_y) + spot_heights
+        line_total += len(lines)
+    return point_total, line_total
+
+def get_sheet_tasks(asc_files_dict, quantize=False):
+    """Tasks for nmt_sheets.iter_sheets from the discovered files."""
+    indexes = sorted(set(name.split("_")[0] for name in asc_files_dict))
+    tasks = []
+    for index in indexes:
+        point_files = [
+            (sign, asc_files_dict[f"{index}_{sign}"]) for sign in POINT_SIGNS if f"{index}_{sign}" in asc_files_dict]
+        line_files = [
+            (sign, asc_files_dict[f"{index}_{sign}"]) for sign in LINE_SIGNS if f"{index}_{sign}" in asc_files_dict]
+        tasks.append((index, point_files, line_files, None, quantize))
+    return tasks
+
+def select_lines(line_data, line_mask):
+    """LineData of the lines in the mask."""
+    vertex_mask = np.repeat(line_mask, np.diff(line_data.offsets))
+    offsets = np.zeros(np.count_nonzero(line_mask) + 1, dtype=np.int64)
+    np.cumsum(np.diff(line_data.offsets)[line_mask], out=offsets[1:])
+    return nmt_asc.LineData(
+        line_data.x[vertex_mask], line_data.y[vertex_mask], line_data.z[vertex_mask],
+        offsets, line_data.end_line_numbers[line_mask])
+
+def get_clip_polygon(bounds, vertex_count=64):
+    """Ellipse inscribed in the bounds, as the area of interest."""
+    x_min, y_min, x_max, y_max = bounds
+    angles = np.linspace(0.0, 2 * np.pi, vertex_count + 1)
+    ring = np.column_stack((
+        (x_min + x_max) / 2 + (x_max - x_min) / 2 * np.cos(angles),
+        (y_min + y_max) / 2 + (y_max - y_min) / 2 * np.sin(angles)))
+    return [ring]
+
+def run_stages(folder, out_folder, envelopes, max_workers=1, lookahead=nmt_sheets.PREFETCH_SHEETS, quantize=False):
+    """
+    Runs the arcpy-free pipeline on the sheet set, returns (seconds, counts) of the stages.
+    With quantize the sheets and the point store use int32 centimetres (nmt_quantize).
+    """
+    seconds = {}
+    counts = {}
+
+    start = time.perf_counter()
+    tasks = get_sheet_tasks(nmt_sheets.get_asc_files_dict(folder), quantize)
+    seconds["discover"] = time.perf_counter() - start
+    counts["sheets"] = len(tasks)
+
+    start = time.perf_counter()
+    point_store = nmt_store.PointStore(quantized=quantize)
+    line_data_list = []
+    line_signs = []
+    line_indexes = []
+    for sheet in nmt_sheets.iter_sheets(tasks, max_workers, lookahead):
+        for sign, x, y, z in sheet.points:
+            point_store.append(x, y, z, sign, sheet.index)
+        for sign, _, line_data in sheet.lines:
+            line_data_list.append(line_data)
+            line_signs += [sign] * len(line_data)
+            line_indexes += [sheet.index] * len(line_data)
+    lines = nmt_asc.concatenate_lines(line_data_list)
+    seconds["parse"] = time.perf_counter() - start
+    counts["points"] = len(point_store)
+    counts["store_mb"] = round(point_store.nbytes / 1024 / 1024, 1)
+    counts["lines"] = len(lines)
+
+    start = time.perf_counter()
+    point_store.compress(nmt_geometry.get_unique_points_mask(point_store.x, point_store.y, EPSILON))
+    seconds["dedupe"] = time.perf_counter() - start
+    counts["unique_points"] = len(point_store)
+
+    start = time.perf_counter()
+    keep_lines, segment_starts, _ = nmt_geometry.split_lines_on_seams(
+        lines.x, lines.y, lines.offsets, list(envelopes.values()), ENVELOPE_EDGE_DISTANCE, EPSILON)
+    kept = select_lines(lines, keep_lines)
+    line_signs = [sign for sign, keep in zip(line_signs, keep_lines.tolist()) if keep]
+    line_indexes = [index for index, keep in zip(line_indexes, keep_lines.tolist()) if keep]
+    seconds["seams"] = time.perf_counter() - start
+    counts["kept_lines"] = len(kept)
+    counts["seam_segments"] = len(segment_starts)
+
+    start = time.perf_counter()
+    envelope_array = np.array(list(envelopes.values()))
+    polygon = get_clip_polygon((*envelope_array[:, :2].min(axis=0), *envelope_array[:, 2:].max(axis=0)))
+    point_mask = nmt_geometry.get_points_in_polygons_mask(point_store.x, point_store.y, [polygon])
+    vertex_mask = nmt_geometry.get_points_in_polygons_mask(kept.x, kept.y, [polygon])
+    line_inside = np.zeros(len(kept), dtype=bool)
+    if len(kept):
+        line_inside = np.maximum.reduceat(vertex_mask, kept.offsets[:-1])
+    seconds["clip"] = time.perf_counter() - start
+    counts["clipped_points"] = int(np.count_nonzero(point_mask))
+    counts["clipped_lines"] = int(np.count_nonzero(line_inside))
+
+    start = time.perf_counter()
+    os.makedirs(out_folder, exist_ok=True)
+    point_fields = [
+        shapefile_writer.Field("WARSTWA", shapefile_writer.FIELD_TEXT, 2),
+        shapefile_writer.Field("GODLO", shapefile_writer.FIELD_TEXT, 15)]
+    with shapefile_writer.ShapefileWriter(
+            os.path.join(out_folder, "punkty.shp"), shapefile_writer.SHAPE_POINTZ, point_fields) as writer:
+        for x, y, z, signs, indexes in point_store.iter_batches(nmt_asc.POINT_BATCH_SIZE, point_mask):
+            writer.write_points(x, y, z, {"WARSTWA": signs, "GODLO": indexes})
+    clipped = select_lines(kept, line_inside)
+    with shapefile_writer.ShapefileWriter(
+            os.path.join(out_folder, "linie.shp"), shapefile_writer.SHAPE_POLYLINEZ, point_fields) as writer:
+        writer.write_lines(
+            clipped.x, clipped.y, clipped.z, clipped.offsets,
+            records={
+                "WARSTWA": [sign for sign, inside in zip(line_signs, line_inside.tolist()) if inside],
+                "GODLO": [index for index, inside in zip(line_indexes, line_inside.tolist()) if inside]})
+    seconds["write"] = time.perf_counter() - start
+
+    return seconds, counts
+
+def run_suite(
+        folder, sheet_counts, sheet_size, step, max_workers=1, lookahead=nmt_sheets.PREFETCH_SHEETS, quantize=False):
+    """Generates (once) and times the sheet sets of every size."""
+    runs = []
+    for sheet_count in sheet_counts:
+        set_folder = os.path.join(folder, f"suite_{sheet_count}_{sheet_size:g}m_{step:g}m")
+        if not os.path.isdir(set_folder):
+            print(f"Writing {set_folder}...")
+            write_sheet_set(set_folder, sheet_count, sheet_size, step)
+        size_mb = sum(
+            os.path.getsize(os.path.join(set_folder, name)) for name in os.listdir(set_folder)) / 1024 / 1024
+
+        out_folder = os.path.join(folder, "suite_output")
+        seconds, counts = run_stages(
+            set_folder, out_folder, get_sheet_envelopes(sheet_count, sheet_size), max_workers, lookahead, quantize)
+        shutil.rmtree(out_folder, ignore_errors=True)
+        runs.append({
+            "sheets": sheet_count,
+            "size_mb": size_mb,
+            "seconds": seconds,
+            "counts": counts,
+            "peak_rss_mb": instrumentation.get_peak_rss_mb()})
+        print(
+            f"{sheet_count:>5} sheets, {size_mb:8.1f} MB: "
+            + ", ".join(f"{stage} {seconds[stage]:.3f} s" for stage in STAGES)
+            + f", store {counts['store_mb']} MB")
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "sheet_size": sheet_size,
+        "step": step,
+        "max_workers": max_workers,
+        "lookahead": lookahead,
+        "quantize": quantize,
+        "runs": runs}
+
+def print_comparison(results, previous):
+    """Prints the ratio of the stage times to the previous results (> 1 means faster now)."""
+    previous_runs = {run["sheets"]: run for run in previous["runs"]}
+    print(f"Compared with {previous['created']} (previous / current):")
+    for run in results["runs"]:
+        previous_run = previous_runs.get(run["sheets"])
+        if previous_run is None:
+            continue
+        ratios = []
+        for stage in STAGES:
+            if run["seconds"].get(stage) and stage in previous_run["seconds"]:
+                ratios.append(f"{stage} {previous_run['seconds'][stage] / run['seconds'][stage]:.2f}x")
+        print(f"{run['sheets']:>5} sheets: " + ", ".join(ratios))
+
+def get_file_order_points(sheet_count, sheet_size, step):
+    """Point grid of a sheet set in the order of the ASC files: sheet by sheet, row by row."""
+    xs = []
+    ys = []
+    for x_min, y_min, x_max, y_max in get_sheet_envelopes(sheet_count, sheet_size).values():
+        grid_x, grid_y = np.meshgrid(np.arange(x_min, x_max, step), np.arange(y_min, y_max, step))
+        xs.append(grid_x.ravel())
+        ys.append(grid_y.ravel())
+    return np.concatenate(xs), np.concatenate(ys)
+
+def run_window_queries(x, y, windows, block_size=ORDER_BLOCK_SIZE):
+    """
+    Finds the points in every window through the bounding boxes of the blocks
+    of block_size consecutive points. Returns (seconds, blocks read, points found).
+    """
+    block_starts = np.arange(0, len(x), block_size)
+    block_bounds = np.column_stack(nmt_geometry.get_line_bounds(x, y, np.r_[block_starts, len(x)]))
+
+    start = time.perf_counter()
+    blocks_read = 0
+    found = 0
+    for window in windows:
+        blocks = np.flatnonzero(
+            (block_bounds[:, 0] <= window[2]) & (block_bounds[:, 2] >= window[0])
+            & (block_bounds[:, 1] <= window[3]) & (block_bounds[:, 3] >= window[1]))
+        blocks_read += len(blocks)
+        if len(blocks) == 0:
+            continue
+        indices = (block_starts[blocks, None] + np.arange(block_size)).ravel()
+        indices = indices[indices < len(x)]
+        found += int(np.count_nonzero(nmt_geometry.get_in_bounds_mask(x[indices], y[indices], window)))
+    return time.perf_counter() - start, blocks_read, found
+
+def run_order_benchmark(sheet_count, sheet_size, step, query_count, window_size, max_memory_mb):
+    """Times the curve orderings and the window queries over the ordered points."""
+    x, y = get_file_order_points(sheet_count, sheet_size, step)
+    bounds = nmt_order.get_bounds(x, y)
+    rng = np.random.default_rng(0)
+    corners = np.column_stack((
+        rng.uniform(bounds[0], bounds[2] - window_size, query_count),
+        rng.uniform(bounds[1], bounds[3] - window_size, query_count)))
+    windows = [(x_min, y_min, x_min + window_size, y_min + window_size) for x_min, y_min in corners.tolist()]
+
+    print(f"{len(x)} points, {query_count} windows of {window_size:g} m, blocks of {ORDER_BLOCK_SIZE} points")
+    results = []
+    for curve in [None] + nmt_order.CURVES:
+        start = time.perf_counter()
+        if curve is None:
+            ordered_x, ordered_y = x, y
+        else:
+            order = nmt_order.CurveOrder(x, y, curve, max_memory_mb=max_memory_mb)
+            ordered_x = x[np.asarray(order.indices)]
+            ordered_y = y[np.asarray(order.indices)]
+            order.close()
+        sort_seconds = time.perf_counter() - start
+        query_seconds, blocks_read, found = run_window_queries(ordered_x, ordered_y, windows)
+        results.append({
+            "order": curve or "FILE",
+            "sort_seconds": sort_seconds,
+            "query_seconds": query_seconds,
+            "blocks_read": blocks_read,
+            "points_found": found})
+        print(
+            f"{curve or 'FILE':>8}: sort {sort_seconds:.3f} s, queries {query_seconds:.3f} s, "
+            f"{blocks_read / query_count:.1f} blocks per window, {found} points found")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", default="nmt_benchmark", help="folder for the synthetic files")
+    parser.add_argument("--size-mb", type=int, default=2048, help="size of the synthetic point file")
+    parser.add_argument("--modes", nargs="+", default=READ_MODES, choices=READ_MODES)
+    parser.add_argument("--read", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    parser.add_argument("--suite", action="store_true", help="run the stage suite instead of the read modes")
+    parser.add_argument("--sheets", type=int, nargs="+", default=[1, 4, 16], help="sheet counts of the suite")
+    parser.add_argument("--sheet-size", type=float, default=500.0, help="sheet width and height in metres")
+    parser.add_argument("--step", type=float, default=1.0, help="point grid step in metres")
+    parser.add_argument("--max-workers", type=int, default=1, help="worker processes reading the sheets")
+    parser.add_argument(
+        "--lookahead", type=int, default=nmt_sheets.PREFETCH_SHEETS, help="sheets read ahead in the background")
+    parser.add_argument(
+        "--quantize", action="store_true", help="sheets and the point store of the suite as int32 centimetres")
+    parser.add_argument("--order", action="store_true", help="run the output ordering benchmark")
+    parser.add_argument("--queries", type=int, default=1000, help="window queries of the order benchmark")
+    parser.add_argument("--window", type=float, default=50.0, help="window size of the order benchmark in metres")
+    parser.add_argument(
+        "--sort-memory-mb", type=float, default=nmt_order.MAX_SORT_MEMORY_MB,
+        help="memory of the in-memory sort, more points use the external merge sort")
+    parser.add_argument("--json", help="file for the suite results")
+    parser.add_argument("--compare", help="suite results of a previous run to compare with")
+    args = parser.parse_args()
+
+    if args.read:
+        seconds, count = run_read(*args.read)
+        print(f"{seconds} {count} {instrumentation.get_peak_rss_mb()}")
+        return
+
+    if args.order:
+        results = run_order_benchmark(
+            args.sheets[-1], args.sheet_size, args.step, args.queries, args.window, args.sort_memory_mb)
+        if args.json:
+            with open(args.json, "w") as json_file:
+                json.dump(results, json_file, indent=2)
+        return
+
+    if args.suite:
+        results = run_suite(
+            args.folder, args.sheets, args.sheet_size, args.step, args.max_workers, args.lookahead, args.quantize)
+        if args.compare:
+            with open(args.compare) as json_file:
+                print_comparison(results, json.load(json_file))
+        if args.json:
+            with open(args.json, "w") as json_file:
+                json.dump(results, json_file, indent=2)
+        return
+
+    os.makedirs(args.folder, exist_ok=True)
+    path = os.path.join(args.folder, f"N-34-139-A-c-1-1_p_{args.size_mb}mb.asc")
+    if not os.path.exists(path):
+        print(f"Writing {path}...")
+        write_point_file(path, args.size_mb)
+
+    size_mb = os.path.getsize(path) / 1024 / 1024
+    print(f"File size: {size_mb:.0f} MB")
+    for result in benchmark_read_modes(path, args.modes):
+        print(
+            f"{result['mode']:>8}: {result['seconds']:8.2f} s, "
+            f"{result['points']} points, peak RSS {result['peak_rss_mb']:.0f} MB")
+
+if __name__ == "__main__":
+    main()
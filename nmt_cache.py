@@ -0,0 +1,306 @@
+"""
+On-disk cache of parsed NMT ASCII TBD files.
+
+Every parsed ASC file is stored as one binary columnar file: a small JSON
+header followed by the raw column arrays (x, y, z and for lines also
+offsets and "End" line numbers). Cached columns are loaded with zero-copy
+memory mapping. The cache entry is keyed by the file path, size,
+modification time and a hash of the file content, so a changed file
+is parsed again and the entry of its previous version is removed.
+
+Only the first and the last CONTENT_HASH_BLOCK bytes are hashed: a file
+edited in the middle without a change of its size and modification time
+(e.g. restored with the original timestamp) is not detected. Such files
+have to be removed from the cache with "invalidate".
+
+A quantizing cache stores x, y and z as int32 centimetres with their
+origin in the header (nmt_quantize), if they decode exactly; such
+columns are decoded to float64 on loading. Entries of both kinds are
+read by any cache.
+
+Usage:
+    python nmt_cache.py info <cache folder>
+    python nmt_cache.py invalidate <cache folder> [<asc file> ...]
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+import nmt_asc
+import nmt_quantize
+
+CACHE_EXTENSION = ".nmtc"
+CACHE_MAGIC = b"NMTC0001"
+CACHE_ALIGNMENT = 64
+
+# only the beginning and the end of the file are hashed,
+# the size and mtime are part of the key anyway
+CONTENT_HASH_BLOCK = 1024 * 1024
+
+POINT_COLUMNS = ["x", "y", "z"]
+LINE_COLUMNS = ["x", "y", "z", "offsets", "end_line_numbers"]
+
+
+def get_path_key(path):
+    return hashlib.sha1(os.path.normcase(os.path.abspath(path)).encode()).hexdigest()[:16]
+
+def get_content_hash(path, size):
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as asc_file:
+        content_hash.update(asc_file.read(CONTENT_HASH_BLOCK))
+        if size > CONTENT_HASH_BLOCK:
+            asc_file.seek(max(CONTENT_HASH_BLOCK, size - CONTENT_HASH_BLOCK))
+            content_hash.update(asc_file.read(CONTENT_HASH_BLOCK))
+    return content_hash.hexdigest()
+
+def get_fingerprint(path):
+    """Fingerprint of the ASC file: path, size, mtime and content hash."""
+    stat = os.stat(path)
+    fingerprint = hashlib.sha1()
+    fingerprint.update(os.path.normcase(os.path.abspath(path)).encode())
+    fingerprint.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    fingerprint.update(get_content_hash(path, stat.st_size).encode())
+    return fingerprint.hexdigest()[:16]
+
+def _get_data_start(header_size):
+    position = len(CACHE_MAGIC) + 8 + header_size
+    return position + -position % CACHE_ALIGNMENT
+
+def write_columns(path, columns, metadata=None):
+    """
+    Writes named arrays to a binary columnar file (atomically). A column
+    can also be a list of 1D chunks of one dtype, written one after another
+    without joining them in memory.
+    """
+    header = {"metadata": metadata or {}, "columns": []}
+    arrays = []
+    # column offsets are relative to the aligned start of the data
+    position = 0
+    for name, values in columns.items():
+        if isinstance(values, list):
+            chunks = [np.ascontiguousarray(chunk) for chunk in values] or [np.empty(0)]
+            shape = [sum(len(chunk) for chunk in chunks)]
+        else:
+            chunks = [np.ascontiguousarray(values)]
+            shape = list(chunks[0].shape)
+        dtype = chunks[0].dtype
+        position += -position % CACHE_ALIGNMENT
+        header["columns"].append({
+            "name": name,
+            "dtype": dtype.str,
+            "shape": shape,
+            "offset": position})
+        arrays.append([chunk.astype(dtype, copy=False) for chunk in chunks])
+        position += sum(chunk.nbytes for chunk in arrays[-1])
+
+    header_bytes = json.dumps(header).encode()
+    data_start = _get_data_start(len(header_bytes))
+
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False, suffix=".tmp") as cache_file:
+        cache_file.write(CACHE_MAGIC)
+        cache_file.write(len(header_bytes).to_bytes(8, "little"))
+        cache_file.write(header_bytes)
+        for chunks, column in zip(arrays, header["columns"]):
+            cache_file.write(b"\0" * (data_start + column["offset"] - cache_file.tell()))
+            for chunk in chunks:
+                cache_file.write(memoryview(chunk).cast("B"))
+    os.replace(cache_file.name, path)
+
+def read_columns(path):
+    """Reads a binary columnar file as memory-mapped arrays, returns (columns, metadata)."""
+    with open(path, "rb") as cache_file:
+        if cache_file.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            raise ValueError(f"Not a NMT cache file: {path}")
+        header_size = int.from_bytes(cache_file.read(8), "little")
+        header = json.loads(cache_file.read(header_size))
+
+    data_start = _get_data_start(header_size)
+    columns = {}
+    for column in header["columns"]:
+        shape = tuple(column["shape"])
+        if 0 in shape:
+            columns[column["name"]] = np.empty(shape, dtype=column["dtype"])
+        else:
+            columns[column["name"]] = np.memmap(
+                path, dtype=column["dtype"], mode="r", offset=data_start + column["offset"], shape=shape)
+    return columns, header["metadata"]
+
+class ParseCache:
+    '''Cache of parsed ASC files with a size cap and LRU eviction'''
+    def __init__(self, folder, max_size_mb=None, quantize=False):
+        self.folder = folder
+        self.max_size_mb = max_size_mb
+        self.quantize = quantize
+        os.makedirs(folder, exist_ok=True)
+
+    def get_entry_path(self, path):
+        return os.path.join(self.folder, f"{get_path_key(path)}_{get_fingerprint(path)}{CACHE_EXTENSION}")
+
+    def _read_entry(self, entry_path):
+        """Memory-mapped columns (quantized x, y, z decoded) and metadata of the entry."""
+        columns, metadata = read_columns(entry_path)
+        if "origin" in metadata:
+            quantized = nmt_quantize.QuantizedXYZ(metadata["origin"], columns["x"], columns["y"], columns["z"])
+            columns.update(zip(POINT_COLUMNS, quantized.decode()))
+        return columns, metadata
+
+    def _load(self, path, errors):
+        entry_path = self.get_entry_path(path)
+        if not os.path.exists(entry_path):
+            return entry_path, None
+
+        try:
+            columns, metadata = self._read_entry(entry_path)
+        except (OSError, ValueError):
+            return entry_path, None
+
+        # last access time for LRU eviction
+        os.utime(entry_path)
+        if errors is not None:
+            examples = metadata.get("errors", [])
+            errors.add_file(path, metadata.get("error_count", len(examples)), examples)
+        return entry_path, columns
+
+    def _store(self, entry_path, path, columns, file_errors):
+        """
+        Writes the columns (lists of the parsed chunks) and returns them
+        memory-mapped from the written entry.
+        """
+        # only the count and the first examples of the malformed lines
+        metadata = {
+            "path": os.path.abspath(path),
+            "error_count": file_errors.counts.get(path, 0),
+            "errors": file_errors.examples.get(path, [])}
+        if self.quantize:
+            encoded = [nmt_quantize.encode_chunks(columns[name]) for name in POINT_COLUMNS]
+            if all(encoded):
+                columns = dict(columns, **{name: codes for name, (_, codes) in zip(POINT_COLUMNS, encoded)})
+                metadata["origin"] = [origin for origin, _ in encoded]
+        write_columns(entry_path, columns, metadata)
+        self.remove_stale_entries(entry_path)
+        self.evict()
+        return self._read_entry(entry_path)[0]
+
+    def get_points(self, path, errors=None):
+        """
+        Returns x, y, z of the point file, parsed or from the cache.
+        Malformed lines are added to errors (nmt_asc.ParseErrors).
+        """
+        entry_path, columns = self._load(path, errors)
+        if columns is not None:
+            return tuple(columns[name] for name in POINT_COLUMNS)
+
+        # the chunks are written one after another, not joined in memory
+        file_errors = nmt_asc.ParseErrors()
+        on_error = file_errors.get_handler(path)
+        chunks = list(nmt_asc.iter_point_chunks(path, on_error=on_error))
+        columns = {name: [chunk[i] for chunk in chunks] for i, name in enumerate(POINT_COLUMNS)}
+        del chunks
+        columns = self._store(entry_path, path, columns, file_errors)
+        if errors is not None:
+            errors.merge(file_errors)
+        return tuple(columns[name] for name in POINT_COLUMNS)
+
+    def get_lines(self, path, errors=None):
+        """
+        Returns nmt_asc.LineData of the line file, parsed or from the cache.
+        Malformed lines are added to errors (nmt_asc.ParseErrors).
+        """
+        entry_path, columns = self._load(path, errors)
+        if columns is not None:
+            return nmt_asc.LineData(*(columns[name] for name in LINE_COLUMNS))
+
+        file_errors = nmt_asc.ParseErrors()
+        on_error = file_errors.get_handler(path)
+        chunks = list(nmt_asc.iter_line_chunks(path, on_error=on_error))
+        # offsets of the chunks moved to the joined vertex columns
+        vertex_starts = np.cumsum([0] + [chunk.vertex_count() for chunk in chunks])
+        columns = {name: [getattr(chunk, name) for chunk in chunks] for name in POINT_COLUMNS}
+        columns["offsets"] = [np.zeros(1, dtype=np.int64)] + [
+            chunk.offsets[1:] + start for chunk, start in zip(chunks, vertex_starts.tolist())]
+        columns["end_line_numbers"] = [np.empty(0, dtype=np.int64)] + [chunk.end_line_numbers for chunk in chunks]
+        del chunks
+        columns = self._store(entry_path, path, columns, file_errors)
+        if errors is not None:
+            errors.merge(file_errors)
+        return nmt_asc.LineData(*(columns[name] for name in LINE_COLUMNS))
+
+    def remove_stale_entries(self, entry_path):
+        """Removes the entries of older versions of the ASC file of the entry (other fingerprints)."""
+        entry_name = os.path.basename(entry_path)
+        prefix = entry_name.split("_")[0] + "_"
+        for file_name in os.listdir(self.folder):
+            if file_name.startswith(prefix) and file_name.endswith(CACHE_EXTENSION) and file_name != entry_name:
+                try:
+                    os.remove(os.path.join(self.folder, file_name))
+                except OSError:
+                    # used by another process (e.g. memory-mapped on Windows)
+                    continue
+
+    def list_entries(self):
+        """Returns (path, size, last access) of the cache files, the oldest first."""
+        entries = []
+        for file_name in os.listdir(self.folder):
+            if not file_name.endswith(CACHE_EXTENSION):
+                continue
+            entry_path = os.path.join(self.folder, file_name)
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append((entry_path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        """Removes the least recently used entries above the size cap."""
+        if not self.max_size_mb:
+            return
+
+        entries = self.list_entries()
+        total_size = sum(entry[1] for entry in entries)
+        max_size = self.max_size_mb * 1024 * 1024
+        for entry_path, size, _ in entries:
+            if total_size <= max_size:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                # used by another process (e.g. memory-mapped on Windows)
+                continue
+            total_size -= size
+
+    def invalidate(self, paths=None):
+        """Removes the entries of the given ASC files or the whole cache. Returns the number removed."""
+        prefixes = None
+        if paths:
+            prefixes = tuple(get_path_key(path) + "_" for path in paths)
+
+        removed = 0
+        for entry_path, _, _ in self.list_entries():
+            if prefixes and not os.path.basename(entry_path).startswith(prefixes):
+                continue
+            os.remove(entry_path)
+            removed += 1
+        return removed
+
+def main(args):
+    if len(args) < 2 or args[0] not in ("info", "invalidate"):
+        print(__doc__)
+        return 1
+
+    cache = ParseCache(args[1])
+    if args[0] == "info":
+        entries = cache.list_entries()
+        size_mb = sum(entry[1] for entry in entries) / 1024 / 1024
+        print(f"{cache.folder}: {len(entries)} entries, {size_mb:.1f} MB")
+    else:
+        removed = cache.invalidate(args[2:])
+        print(f"{cache.folder}: {removed} entries removed")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,247 @@
+"""
+Persistent catalog of NMT ASCII TBD files (does not need arcpy).
+
+Every ASC file is stored in a SQLite database with its path, sheet
+(godlo), layer sign, size, modification time and the bounding box of the
+sheet decoded from the godlo (EPSG:2180). The boxes are indexed with the
+SQLite R-tree module (or plain columns if the module is not available),
+so the files intersecting an area of interest are found in milliseconds.
+
+The catalog is updated incrementally: a directory is listed again only
+if its modification time changed (a file was added, removed or renamed),
+unchanged directories cost a single stat call. Files changed in place
+are still detected by the fingerprints of nmt_cache.
+
+Usage:
+    python nmt_catalog.py update <catalog file> <TBD folder>
+    python nmt_catalog.py info <catalog file>
+    python nmt_catalog.py query <catalog file> <TBD folder> <x_min> <y_min> <x_max> <y_max>
+"""
+import os
+import sqlite3
+import sys
+
+import nmt_godlo
+
+CATALOG_VERSION = 1
+ASC_EXTENSION = ".asc"
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS directories (
+        path TEXT PRIMARY KEY,
+        root TEXT NOT NULL,
+        parent TEXT,
+        mtime_ns INTEGER NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS directories_root ON directories (root)",
+    "CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent)",
+    """CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        directory TEXT NOT NULL,
+        name TEXT NOT NULL,
+        sheet TEXT NOT NULL,
+        sign TEXT,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        x_min REAL,
+        y_min REAL,
+        x_max REAL,
+        y_max REAL)""",
+    "CREATE INDEX IF NOT EXISTS files_directory ON files (directory)"]
+
+
+def split_file_name(file_name):
+    """(name, sheet, sign) of the ASC file name "<index>_<sign>.asc", as in get_asc_files_dict."""
+    name = file_name.split(".")[0]
+    sheet, _, sign = name.partition("_")
+    return name, sheet, sign or None
+
+def get_sheet_bounds(sheet, cache):
+    """Bounds of the sheet decoded from the godlo (None if not recognized), cached per sheet."""
+    if sheet not in cache:
+        try:
+            cache[sheet] = nmt_godlo.get_sheet_bounds(sheet)
+        except ValueError:
+            cache[sheet] = None
+    return cache[sheet]
+
+class Catalog:
+    '''SQLite catalog of the ASC files of TBD folders'''
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        for statement in _SCHEMA:
+            self.connection.execute(statement)
+        try:
+            self.connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS files_rtree USING rtree(id, x_min, x_max, y_min, y_max)")
+            self.has_rtree = True
+        except sqlite3.OperationalError:
+            # SQLite compiled without the R-tree module
+            self.has_rtree = False
+        self.connection.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+        self.connection.commit()
+        self._sheet_bounds = {}
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _delete_files(self, directory):
+        if self.has_rtree:
+            self.connection.execute(
+                "DELETE FROM files_rtree WHERE id IN (SELECT id FROM files WHERE directory = ?)", (directory,))
+        self.connection.execute("DELETE FROM files WHERE directory = ?", (directory,))
+
+    def _insert_file(self, entry, directory):
+        name, sheet, sign = split_file_name(entry.name)
+        stat = entry.stat()
+        bounds = get_sheet_bounds(sheet, self._sheet_bounds)
+        x_min, y_min, x_max, y_max = bounds if bounds else (None, None, None, None)
+        cursor = self.connection.execute(
+            "INSERT OR REPLACE INTO files "
+            "(path, directory, name, sheet, sign, size, mtime_ns, x_min, y_min, x_max, y_max) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (entry.path, directory, name, sheet, sign, stat.st_size, stat.st_mtime_ns, x_min, y_min, x_max, y_max))
+        if self.has_rtree and bounds:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files_rtree VALUES (?, ?, ?, ?, ?)",
+                (cursor.lastrowid, x_min, x_max, y_min, y_max))
+
+    def _scan_directory(self, directory, root, parent, mtime_ns):
+        """Lists the directory again, returns its subdirectories."""
+        subdirectories = []
+        self._delete_files(directory)
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirectories.append(entry.path)
+                elif entry.name.lower().endswith(ASC_EXTENSION):
+                    self._insert_file(entry, directory)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO directories (path, root, parent, mtime_ns) VALUES (?, ?, ?, ?)",
+            (directory, root, parent, mtime_ns))
+        return subdirectories
+
+    def update(self, root):
+        """
+        Brings the catalog of the folder tree up to date.
+        Returns (scanned, unchanged, removed) numbers of directories.
+        """
+        root = os.path.normpath(root)
+        stored = {}
+        children = {}
+        for path, parent, mtime_ns in self.connection.execute(
+                "SELECT path, parent, mtime_ns FROM directories WHERE root = ?", (root,)):
+            stored[path] = mtime_ns
+            children.setdefault(parent, []).append(path)
+
+        scanned = 0
+        unchanged = 0
+        seen = set()
+        stack = [(root, None)]
+        with self.connection:
+            while stack:
+                directory, parent = stack.pop()
+                try:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                except OSError:
+                    continue
+                seen.add(directory)
+
+                if stored.get(directory) == mtime_ns:
+                    subdirectories = children.get(directory, [])
+                    unchanged += 1
+                else:
+                    try:
+                        subdirectories = self._scan_directory(directory, root, parent, mtime_ns)
+                    except OSError:
+                        continue
+                    scanned += 1
+                stack.extend((subdirectory, directory) for subdirectory in subdirectories)
+
+            removed = [path for path in stored if path not in seen]
+            for directory in removed:
+                self._delete_files(directory)
+                self.connection.execute("DELETE FROM directories WHERE path = ?", (directory,))
+
+        return scanned, unchanged, len(removed)
+
+    def _select_files(self, root, columns, bounds=None):
+        root = os.path.normpath(root)
+        query = (
+            f"SELECT {columns} FROM files "
+            "JOIN directories ON files.directory = directories.path "
+            "WHERE directories.root = ?")
+        parameters = [root]
+        if bounds is not None:
+            x_min, y_min, x_max, y_max = bounds
+            # files of unrecognized sheets have no bounds and are always selected
+            if self.has_rtree:
+                query += (
+                    " AND (files.x_min IS NULL OR files.id IN ("
+                    "SELECT id FROM files_rtree WHERE x_min <= ? AND x_max >= ? AND y_min <= ? AND y_max >= ?))")
+                parameters += [x_max, x_min, y_max, y_min]
+            else:
+                query += (
+                    " AND (files.x_min IS NULL OR "
+                    "(files.x_min <= ? AND files.x_max >= ? AND files.y_min <= ? AND files.y_max >= ?))")
+                parameters += [x_max, x_min, y_max, y_min]
+        query += " ORDER BY files.path"
+        return self.connection.execute(query, parameters)
+
+    def get_asc_files_dict(self, root, bounds=None):
+        """
+        Paths of the ASC files of the folder tree by the file name without
+        extension, like nmt_sheets.get_asc_files_dict. With bounds
+        (x_min, y_min, x_max, y_max in EPSG:2180) only the files of the
+        sheets intersecting the bounds (and of unrecognized sheets).
+        """
+        return dict(self._select_files(root, "files.name, files.path", bounds))
+
+    def get_files(self, root, bounds=None):
+        """(path, sheet, sign, size, mtime_ns, bounds) of the ASC files, see get_asc_files_dict."""
+        files = []
+        for path, sheet, sign, size, mtime_ns, x_min, y_min, x_max, y_max in self._select_files(
+                root,
+                "files.path, files.sheet, files.sign, files.size, files.mtime_ns, "
+                "files.x_min, files.y_min, files.x_max, files.y_max",
+                bounds):
+            sheet_bounds = (x_min, y_min, x_max, y_max) if x_min is not None else None
+            files.append((path, sheet, sign, size, mtime_ns, sheet_bounds))
+        return files
+
+    def get_summary(self):
+        """[(root, directories, files, size)] of the catalogued folders."""
+        return self.connection.execute(
+            "SELECT directories.root, COUNT(DISTINCT directories.path), COUNT(files.id), "
+            "COALESCE(SUM(files.size), 0) "
+            "FROM directories LEFT JOIN files ON files.directory = directories.path "
+            "GROUP BY directories.root ORDER BY directories.root").fetchall()
+
+def main(args):
+    if len(args) < 2 or args[0] not in ("update", "info", "query") or \
+            (args[0] == "update" and len(args) != 3) or (args[0] == "query" and len(args) != 7):
+        print(__doc__)
+        return 1
+
+    with Catalog(args[1]) as catalog:
+        if args[0] == "update":
+            scanned, unchanged, removed = catalog.update(args[2])
+            print(f"{args[2]}: {scanned} directories scanned, {unchanged} unchanged, {removed} removed")
+        elif args[0] == "info":
+            for root, directory_count, file_count, size in catalog.get_summary():
+                print(f"{root}: {directory_count} directories, {file_count} files, {size / 1024 / 1024:.1f} MB")
+        else:
+            bounds = tuple(float(value) for value in args[3:7])
+            for path, sheet, sign, size, _, _ in catalog.get_files(args[2], bounds):
+                print(f"{sheet}\t{sign}\t{size}\t{path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
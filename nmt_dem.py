@@ -0,0 +1,144 @@
+"""
+Gridded DEM built directly from NMT points (does not need arcpy).
+
+Points are binned into the cells of a regular grid with vectorized
+accumulation (mean, min or max of Z in the cell). The accumulators are
+memory-mapped files, so a large area does not need the whole grid in RAM.
+The grid is written as ESRI ASCII GRID (.asc) or as a raw float32 array
+with an ESRI header (.flt + .hdr).
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+STAT_MEAN = "MEAN"
+STAT_MIN = "MIN"
+STAT_MAX = "MAX"
+STATISTICS = [STAT_MEAN, STAT_MIN, STAT_MAX]
+
+NODATA = -9999.0
+# rows written at once
+ROW_BLOCK_SIZE = 256
+
+
+class DemGrid:
+    '''Grid accumulating point heights, backed by memory-mapped files'''
+    def __init__(self, bounds, cell_size, statistic=STAT_MEAN, temp_folder=None):
+        statistic = statistic.upper()
+        if statistic not in STATISTICS:
+            raise ValueError(f"Unknown statistic: {statistic}")
+        if not cell_size > 0:
+            raise ValueError(f"Cell size must be positive: {cell_size}")
+
+        self.cell_size = cell_size
+        self.statistic = statistic
+        # grid snapped to the multiples of the cell size
+        self.x_min = np.floor(bounds[0] / cell_size) * cell_size
+        self.y_min = np.floor(bounds[1] / cell_size) * cell_size
+        self.columns = max(1, int(np.ceil((bounds[2] - self.x_min) / cell_size)))
+        self.rows = max(1, int(np.ceil((bounds[3] - self.y_min) / cell_size)))
+        self.y_max = self.y_min + self.rows * cell_size
+
+        self.temp_folder = tempfile.mkdtemp(prefix="nmt_dem_", dir=temp_folder)
+        shape = (self.rows, self.columns)
+        self.count = self._create_array("count", np.uint32, shape, 0)
+        if statistic == STAT_MEAN:
+            self.values = self._create_array("sum", np.float64, shape, 0.0)
+        elif statistic == STAT_MIN:
+            self.values = self._create_array("min", np.float32, shape, np.inf)
+        else:
+            self.values = self._create_array("max", np.float32, shape, -np.inf)
+
+    def _create_array(self, name, dtype, shape, fill_value):
+        array = np.memmap(os.path.join(self.temp_folder, f"{name}.dat"), dtype=dtype, mode="w+", shape=shape)
+        if fill_value:
+            for start in range(0, shape[0], ROW_BLOCK_SIZE):
+                array[start:start + ROW_BLOCK_SIZE] = fill_value
+        return array
+
+    def add_points(self, x, y, z):
+        """Adds the points inside the grid, returns the number of points added."""
+        x = np.asarray(x)
+        y = np.asarray(y)
+        z = np.asarray(z)
+        columns = np.floor((x - self.x_min) / self.cell_size).astype(np.int64)
+        # row 0 is the northern edge
+        rows = np.floor((self.y_max - y) / self.cell_size).astype(np.int64)
+        inside = (columns >= 0) & (columns < self.columns) & (rows >= 0) & (rows < self.rows)
+        if not inside.any():
+            return 0
+
+        cells = rows[inside] * self.columns + columns[inside]
+        z = z[inside]
+        # reduce the points per touched cell first, then update only those cells
+        order = np.argsort(cells, kind="stable")
+        cells = cells[order]
+        z = z[order]
+        starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+        unique_cells = cells[starts]
+
+        count = self.count.reshape(-1)
+        values = self.values.reshape(-1)
+        count[unique_cells] += np.diff(np.r_[starts, len(cells)]).astype(np.uint32)
+        if self.statistic == STAT_MEAN:
+            values[unique_cells] += np.add.reduceat(z, starts)
+        elif self.statistic == STAT_MIN:
+            values[unique_cells] = np.minimum(values[unique_cells], np.minimum.reduceat(z, starts))
+        else:
+            values[unique_cells] = np.maximum(values[unique_cells], np.maximum.reduceat(z, starts))
+        return len(cells)
+
+    def iter_row_blocks(self, nodata=NODATA):
+        """Yields float32 blocks of rows with the statistic, from the north."""
+        for start in range(0, self.rows, ROW_BLOCK_SIZE):
+            count = np.asarray(self.count[start:start + ROW_BLOCK_SIZE])
+            values = np.asarray(self.values[start:start + ROW_BLOCK_SIZE], dtype=np.float64)
+            if self.statistic == STAT_MEAN:
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    values = values / count
+            yield np.where(count > 0, values, nodata).astype(np.float32)
+
+    def get_header(self, nodata=NODATA):
+        return [
+            ("ncols", self.columns),
+            ("nrows", self.rows),
+            ("xllcorner", self.x_min),
+            ("yllcorner", self.y_min),
+            ("cellsize", self.cell_size),
+            ("NODATA_value", nodata)]
+
+    def write_ascii_grid(self, path, nodata=NODATA, decimals=2):
+        """Writes the grid as ESRI ASCII GRID."""
+        with open(path, "w") as asc_file:
+            for key, value in self.get_header(nodata):
+                asc_file.write(f"{key} {value}\n")
+            for block in self.iter_row_blocks(nodata):
+                np.savetxt(asc_file, block, fmt=f"%.{decimals}f", delimiter=" ")
+
+    def write_float_grid(self, path, nodata=NODATA):
+        """Writes the grid as raw little-endian float32 (.flt) with the .hdr header."""
+        with open(os.path.splitext(path)[0] + ".hdr", "w") as hdr_file:
+            for key, value in self.get_header(nodata):
+                hdr_file.write(f"{key} {value}\n")
+            hdr_file.write("byteorder LSBFIRST\n")
+        with open(path, "wb") as flt_file:
+            for block in self.iter_row_blocks(nodata):
+                flt_file.write(block.astype("<f4").tobytes())
+
+    def write(self, path, nodata=NODATA):
+        """Writes the grid in the format of the file extension (.asc or .flt)."""
+        extension = os.path.splitext(path)[1].lower()
+        if extension == ".asc":
+            self.write_ascii_grid(path, nodata)
+        elif extension == ".flt":
+            self.write_float_grid(path, nodata)
+        else:
+            raise ValueError(f"Unsupported DEM format: {extension}")
+
+    def close(self):
+        """Releases the memory-mapped accumulators and removes their files."""
+        del self.count
+        del self.values
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
@@ -0,0 +1,1098 @@
+"""
+Vectorized geometry operations on NMT point and line arrays.
+
+Lines are ragged arrays (see nmt_asc.LineData). The module does not depend
+on arcpy and needs NumPy, which is shipped with ArcGIS Pro.
+"""
+import hashlib
+
+import numpy as np
+
+LINE_TYPE_VERTICAL = "all_vertical"
+LINE_TYPE_HORIZONTAL = "all_horizontal"
+
+WKB_LINESTRING = 2
+WKB_MULTILINESTRING = 5
+WKB_LINESTRING_Z = 1002
+WKB_MULTILINESTRING_Z = 1005
+
+
+def get_line_bounds(x, y, offsets):
+    """Returns x_min, y_min, x_max, y_max arrays with the bounding box of every line."""
+    starts = np.asarray(offsets[:-1])
+    if len(starts) == 0:
+        empty = np.empty(0)
+        return empty, empty, empty, empty
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    return (
+        np.minimum.reduceat(x, starts),
+        np.minimum.reduceat(y, starts),
+        np.maximum.reduceat(x, starts),
+        np.maximum.reduceat(y, starts))
+
+def get_line_types(x, y, offsets, epsilon):
+    """
+    Flags lines lying along a vertical or a horizontal line
+    (the same rule as in nmt_manager.Extent.get_line_type).
+    Returns an array of LINE_TYPE_VERTICAL, LINE_TYPE_HORIZONTAL or "".
+    """
+    x_min, y_min, x_max, y_max = get_line_bounds(x, y, offsets)
+    line_types = np.full(len(x_min), "", dtype=object)
+    is_horizontal = np.abs(y_max - y_min) < epsilon
+    is_vertical = np.abs(x_max - x_min) < epsilon
+    line_types[is_horizontal] = LINE_TYPE_HORIZONTAL
+    line_types[is_vertical] = LINE_TYPE_VERTICAL
+    return line_types
+
+def get_line_ids(offsets):
+    """Returns the line number of every vertex."""
+    offsets = np.asarray(offsets)
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+def get_linestring_z_wkb(x, y, z, offsets):
+    """
+    Serializes all lines to ISO WKB LineString Z in one buffer.
+    Returns the buffer and the byte offsets of the lines in it.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    line_count = len(counts)
+
+    # 1 byte order + 4 type + 4 vertex count, then 3 doubles per vertex
+    header_size = 9
+    byte_offsets = header_size * np.arange(line_count + 1) + 24 * offsets
+    buffer = np.empty(byte_offsets[-1], dtype=np.uint8)
+
+    headers = np.empty(line_count, dtype=[("order", "u1"), ("type", "<u4"), ("count", "<u4")])
+    headers["order"] = 1
+    headers["type"] = WKB_LINESTRING_Z
+    headers["count"] = counts
+
+    xyz = np.empty((len(x), 3), dtype="<f8")
+    xyz[:, 0] = x
+    xyz[:, 1] = y
+    xyz[:, 2] = z
+
+    # headers and vertices are interleaved, the rest of the buffer
+    # after removing headers is the vertex array in order
+    is_header = np.zeros(len(buffer), dtype=bool)
+    is_header[byte_offsets[:-1, None] + np.arange(header_size)] = True
+    buffer[is_header] = headers.view(np.uint8)
+    buffer[~is_header] = xyz.view(np.uint8).ravel()
+
+    return buffer, byte_offsets
+
+def read_wkb_line_parts(wkb):
+    """
+    Reads ISO WKB (Multi)LineString (Z) into a list of (n, 3) vertex arrays,
+    one per part. Z is 0 for 2D geometries.
+    """
+    wkb = bytes(wkb)
+    parts = []
+
+    def read_linestring(position):
+        byte_order = "<" if wkb[position] == 1 else ">"
+        geometry_type = int(np.frombuffer(wkb, f"{byte_order}u4", 1, position + 1)[0])
+        count = int(np.frombuffer(wkb, f"{byte_order}u4", 1, position + 5)[0])
+        dimension = 3 if geometry_type == WKB_LINESTRING_Z else 2
+        coords = np.frombuffer(wkb, f"{byte_order}f8", count * dimension, position + 9).reshape(count, dimension)
+        vertices = np.zeros((count, 3))
+        vertices[:, :dimension] = coords
+        parts.append(vertices)
+        return position + 9 + 8 * count * dimension
+
+    byte_order = "<" if wkb[0] == 1 else ">"
+    geometry_type = int(np.frombuffer(wkb, f"{byte_order}u4", 1, 1)[0])
+    if geometry_type in (WKB_LINESTRING, WKB_LINESTRING_Z):
+        read_linestring(0)
+    elif geometry_type in (WKB_MULTILINESTRING, WKB_MULTILINESTRING_Z):
+        part_count = int(np.frombuffer(wkb, f"{byte_order}u4", 1, 5)[0])
+        position = 9
+        for _ in range(part_count):
+            position = read_linestring(position)
+    else:
+        raise ValueError(f"Unsupported WKB geometry type: {geometry_type}")
+
+    return parts
+
+def iter_linestring_z_wkb(x, y, z, offsets):
+    """Yields ISO WKB LineString Z bytes of every line."""
+    buffer, byte_offsets = get_linestring_z_wkb(x, y, z, offsets)
+    for start, end in zip(byte_offsets[:-1].tolist(), byte_offsets[1:].tolist()):
+        yield buffer[start:end].tobytes()
+
+def read_wkb_lines(wkb_lines):
+    """
+    Reads a sequence of WKB (Multi)LineStrings into ragged arrays of parts.
+    Returns x, y, z, offsets of the parts and the number of parts of every line.
+    """
+    parts = []
+    part_counts = []
+    for wkb in wkb_lines:
+        line_parts = read_wkb_line_parts(wkb)
+        parts.extend(line_parts)
+        part_counts.append(len(line_parts))
+
+    vertices = np.concatenate(parts) if parts else np.empty((0, 3))
+    offsets = np.cumsum([0] + [len(part) for part in parts])
+    return vertices[:, 0], vertices[:, 1], vertices[:, 2], offsets, np.asarray(part_counts, dtype=np.int64)
+
+def iter_multilinestring_z_wkb(x, y, z, offsets, part_counts):
+    """
+    Yields ISO WKB of every line made of part_counts consecutive parts:
+    LineString Z for single part lines, MultiLineString Z otherwise.
+    """
+    parts = iter_linestring_z_wkb(x, y, z, offsets)
+    for part_count in np.asarray(part_counts).tolist():
+        if part_count == 1:
+            yield next(parts)
+        else:
+            header = np.array([(1, WKB_MULTILINESTRING_Z, part_count)],
+                dtype=[("order", "u1"), ("type", "<u4"), ("count", "<u4")])
+            yield header.tobytes() + b"".join(next(parts) for _ in range(part_count))
+
+def _merge_seams(seams, tolerance):
+    """Merges collinear seams (c, lo, hi) which overlap or touch."""
+    if len(seams) == 0:
+        return np.empty((0, 3))
+
+    seams = np.asarray(seams, dtype=np.float64)
+    seams = seams[np.lexsort((seams[:, 1], np.round(seams[:, 0] / tolerance)))]
+
+    merged = [list(seams[0])]
+    for c, lo, hi in seams[1:].tolist():
+        last = merged[-1]
+        if abs(c - last[0]) < tolerance and lo <= last[2] + tolerance:
+            last[2] = max(last[2], hi)
+        else:
+            merged.append([c, lo, hi])
+    return np.array(merged)
+
+def find_sheet_seams(envelopes, tolerance):
+    """
+    Finds edges shared by neighbouring sheets.
+
+    envelopes is an (n, 4) array of x_min, y_min, x_max, y_max of sheets
+    which are axis-aligned rectangles (see is_rectangle); the bounding boxes
+    of other outlines overlap and their shared edges are not found.
+    Returns vertical seams (x, y_min, y_max) and horizontal seams
+    (y, x_min, x_max) as (k, 3) arrays, collinear seams are merged.
+    """
+    envelopes = np.asarray(envelopes, dtype=np.float64).reshape(-1, 4)
+
+    def find(min_col, max_col, lo_col, hi_col):
+        # sheets touching along the edge: max of one == min of another
+        by_min = {}
+        for i, key in enumerate(np.round(envelopes[:, min_col] / tolerance).astype(np.int64).tolist()):
+            by_min.setdefault(key, []).append(i)
+
+        seams = []
+        for i, key in enumerate(np.round(envelopes[:, max_col] / tolerance).astype(np.int64).tolist()):
+            for neighbour_key in (key - 1, key, key + 1):
+                for j in by_min.get(neighbour_key, []):
+                    if abs(envelopes[i, max_col] - envelopes[j, min_col]) >= tolerance:
+                        continue
+                    lo = max(envelopes[i, lo_col], envelopes[j, lo_col])
+                    hi = min(envelopes[i, hi_col], envelopes[j, hi_col])
+                    if hi - lo > tolerance:
+                        seams.append((envelopes[i, max_col], lo, hi))
+        return _merge_seams(seams, tolerance)
+
+    vertical = find(0, 2, 1, 3)
+    horizontal = find(1, 3, 0, 2)
+    return vertical, horizontal
+
+def _point_segment_distance(px, py, ax, ay, bx, by):
+    dx = bx - ax
+    dy = by - ay
+    length2 = dx * dx + dy * dy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.where(length2 > 0, ((px - ax) * dx + (py - ay) * dy) / length2, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+def _segments_distance(ax, ay, bx, by, cx, cy, dx, dy):
+    """Distance between segments AB (arrays) and CD (scalars or arrays)."""
+    def orientation(px, py, qx, qy, rx, ry):
+        return np.sign((qx - px) * (ry - py) - (qy - py) * (rx - px))
+
+    crossing = (
+        (orientation(ax, ay, bx, by, cx, cy) * orientation(ax, ay, bx, by, dx, dy) < 0)
+        & (orientation(cx, cy, dx, dy, ax, ay) * orientation(cx, cy, dx, dy, bx, by) < 0))
+
+    distance = np.minimum.reduce([
+        _point_segment_distance(ax, ay, cx, cy, dx, dy),
+        _point_segment_distance(bx, by, cx, cy, dx, dy),
+        _point_segment_distance(cx, cy, ax, ay, bx, by),
+        _point_segment_distance(dx, dy, ax, ay, bx, by)])
+    return np.where(crossing, 0.0, distance)
+
+def _get_seam_buffer_intervals(a0, b0, a1, b1, seam_array, distance):
+    """
+    Parameter intervals [t_start, t_end] of the segment (a0, b0) - (a1, b1)
+    (scalars) lying in the distance buffers of the seams (c, lo, hi) along the
+    a = c lines, empty intervals have t_start > t_end.
+    """
+    c, lo, hi = seam_array.T
+    da = a1 - a0
+    db = b1 - b0
+    inf = np.full(len(c), np.inf)
+
+    # rectangle |a - c| <= distance, lo <= b <= hi clipped per axis
+    t_start = -inf
+    t_end = inf.copy()
+    for p0, dp, low, high in ((a0, da, c - distance, c + distance), (b0, db, lo, hi)):
+        if dp == 0:
+            outside = (p0 < low) | (p0 > high)
+            t_start = np.where(outside, np.inf, t_start)
+            t_end = np.where(outside, -np.inf, t_end)
+        else:
+            t_low = (low - p0) / dp
+            t_high = (high - p0) / dp
+            t_start = np.maximum(t_start, np.minimum(t_low, t_high))
+            t_end = np.minimum(t_end, np.maximum(t_low, t_high))
+
+    # round caps, the buffer is convex, so the pieces form one interval
+    length2 = da * da + db * db
+    for end in (lo, hi):
+        half_b = (a0 - c) * da + (b0 - end) * db
+        offset2 = (a0 - c) ** 2 + (b0 - end) ** 2 - distance * distance
+        discriminant = half_b * half_b - length2 * offset2
+        hit = discriminant >= 0
+        root = np.sqrt(np.where(hit, discriminant, 0.0))
+        t_start = np.where(hit, np.minimum(t_start, (-half_b - root) / length2), t_start)
+        t_end = np.where(hit, np.maximum(t_end, (-half_b + root) / length2), t_end)
+    return t_start, t_end
+
+def _is_segment_covered(t_start, t_end):
+    """Tests if the intervals cover the whole [0, 1] range."""
+    is_used = (t_start <= t_end) & (t_end >= 0.0) & (t_start <= 1.0)
+    order = np.argsort(t_start[is_used], kind="stable")
+    covered = 0.0
+    for start, end in zip(t_start[is_used][order].tolist(), t_end[is_used][order].tolist()):
+        if start > covered:
+            return False
+        covered = max(covered, end)
+        if covered >= 1.0:
+            return True
+    return False
+
+def get_segment_starts(offsets):
+    """Returns the first vertex of every 2-vertex segment of the lines."""
+    offsets = np.asarray(offsets)
+    is_last = np.zeros(offsets[-1], dtype=bool)
+    is_last[offsets[1:] - 1] = True
+    return np.flatnonzero(~is_last)
+
+def classify_seam_segments(x, y, offsets, seams, distance):
+    """
+    Tests every segment of the lines against the seams.
+
+    Returns segment_starts (first vertex of every segment),
+    segment_near (segment is closer than distance to any seam) and
+    segment_within (segment lies in the dissolved distance buffer of the
+    seams, as Buffer_analysis with "ALL" dissolve).
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    segment_starts = get_segment_starts(offsets)
+    x0 = x[segment_starts]
+    y0 = y[segment_starts]
+    x1 = x[segment_starts + 1]
+    y1 = y[segment_starts + 1]
+
+    segment_near = np.zeros(len(segment_starts), dtype=bool)
+    segment_within = np.zeros(len(segment_starts), dtype=bool)
+    start_within = np.zeros(len(segment_starts), dtype=bool)
+    end_within = np.zeros(len(segment_starts), dtype=bool)
+
+    vertical, horizontal = seams
+    # horizontal seams are tested in swapped coordinates
+    for seam_array, (a0, b0, a1, b1) in ((vertical, (x0, y0, x1, y1)), (horizontal, (y0, x0, y1, x1))):
+        if len(seam_array) == 0:
+            continue
+
+        # candidates: segments crossing the band c +- distance,
+        # long segments are few, so they are tested against every seam
+        a_min = np.minimum(a0, a1)
+        a_max = np.maximum(a0, a1)
+        extent = a_max - a_min
+        long_limit = max(100.0 * distance, np.percentile(extent, 99) if len(extent) else 0.0)
+        is_short = extent <= long_limit
+        short_ids = np.flatnonzero(is_short)
+        short_ids = short_ids[np.argsort(a_min[short_ids], kind="stable")]
+        short_a_min = a_min[short_ids]
+        long_ids = np.flatnonzero(~is_short)
+
+        for c, lo, hi in seam_array.tolist():
+            first = np.searchsorted(short_a_min, c - distance - long_limit, side="left")
+            last = np.searchsorted(short_a_min, c + distance, side="right")
+            ids = np.concatenate([short_ids[first:last], long_ids])
+            ids = ids[(a_max[ids] >= c - distance) & (a_min[ids] <= c + distance)]
+            if len(ids) == 0:
+                continue
+
+            near = _segments_distance(a0[ids], b0[ids], a1[ids], b1[ids], c, lo, c, hi) <= distance
+            # the buffer of a seam is convex, so both ends inside mean the whole segment inside
+            start_in = _point_segment_distance(a0[ids], b0[ids], c, lo, c, hi) <= distance
+            end_in = _point_segment_distance(a1[ids], b1[ids], c, lo, c, hi) <= distance
+            segment_near[ids] |= near
+            segment_within[ids] |= start_in & end_in
+            start_within[ids] |= start_in
+            end_within[ids] |= end_in
+
+    # ends in the buffers of different seams (corners, T-junctions):
+    # the segment may still lie in the union of the buffers
+    for i in np.flatnonzero(start_within & end_within & ~segment_within).tolist():
+        intervals = [
+            _get_seam_buffer_intervals(*ends, seam_array, distance)
+            for seam_array, ends in (
+                (vertical, (x0[i], y0[i], x1[i], y1[i])), (horizontal, (y0[i], x0[i], y1[i], x1[i])))
+            if len(seam_array)]
+        segment_within[i] = _is_segment_covered(
+            np.concatenate([t_start for t_start, _ in intervals]),
+            np.concatenate([t_end for _, t_end in intervals]))
+
+    return segment_starts, segment_near, segment_within
+
+def split_lines_on_seams(x, y, offsets, envelopes, distance, tolerance, line_groups=None):
+    """
+    Analytic equivalent of the geoprocessing chain in
+    nmt_manager.delete_lines_on_envelopes.
+
+    Lines (or groups of lines, e.g. parts of one feature given by
+    line_groups) closer than distance to a seam between sheets are split into
+    2-vertex segments and the segments lying along the seam are dropped.
+
+    Returns keep_lines (mask of lines kept untouched), segment_starts
+    (first vertex of the kept 2-vertex segments of the other lines)
+    and segment_line_ids (source line of these segments).
+    """
+    offsets = np.asarray(offsets)
+    line_count = len(offsets) - 1
+    seams = find_sheet_seams(envelopes, tolerance)
+
+    segment_starts, segment_near, segment_within = classify_seam_segments(x, y, offsets, seams, distance)
+    vertex_line_ids = get_line_ids(offsets)
+    segment_line_ids = vertex_line_ids[segment_starts]
+
+    line_near = np.zeros(line_count, dtype=bool)
+    line_near[segment_line_ids[segment_near]] = True
+    if line_groups is not None:
+        line_groups = np.asarray(line_groups)
+        _, group_ids = np.unique(line_groups, return_inverse=True)
+        group_near = np.zeros(group_ids.max() + 1 if line_count else 0, dtype=bool)
+        group_near[group_ids[line_near]] = True
+        line_near = group_near[group_ids]
+
+    is_split = line_near[segment_line_ids] & ~segment_within
+    return ~line_near, segment_starts[is_split], segment_line_ids[is_split]
+
+def get_in_bounds_mask(x, y, bounds, tolerance=0.0):
+    """Mask of points inside the rectangle (x_min, y_min, x_max, y_max), boundary included."""
+    x_min, y_min, x_max, y_max = bounds
+    return (
+        (x >= x_min - tolerance) & (x <= x_max + tolerance)
+        & (y >= y_min - tolerance) & (y <= y_max + tolerance))
+
+def clip_lines_to_bounds(x, y, z, offsets, bounds, tolerance=0.0):
+    """
+    Clips all lines to the rectangle (x_min, y_min, x_max, y_max), boundary
+    included, with the Liang-Barsky algorithm applied to all segments at once.
+    Z of the cut points is interpolated along the segment. A line leaving and
+    entering the rectangle again is split into parts.
+    Returns x, y, z, offsets of the parts and the number of parts of every
+    line (0 for the lines outside the rectangle).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    line_count = len(offsets) - 1
+    x_min, y_min, x_max, y_max = bounds
+    x_min -= tolerance
+    y_min -= tolerance
+    x_max += tolerance
+    y_max += tolerance
+
+    segment_starts = get_segment_starts(offsets)
+    segment_line_ids = get_line_ids(offsets)[segment_starts]
+    x0 = x[segment_starts]
+    y0 = y[segment_starts]
+    z0 = z[segment_starts]
+    x1 = x[segment_starts + 1]
+    y1 = y[segment_starts + 1]
+    z1 = z[segment_starts + 1]
+    dx = x1 - x0
+    dy = y1 - y0
+
+    # entering (t0) and leaving (t1) parameters of every segment
+    t0 = np.zeros(len(segment_starts))
+    t1 = np.ones(len(segment_starts))
+    accepted = np.ones(len(segment_starts), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-dx, x0 - x_min), (dx, x_max - x0), (-dy, y0 - y_min), (dy, y_max - y0)):
+            # parallel to the edge and outside
+            accepted &= (p != 0) | (q >= 0)
+            ratio = q / p
+            t0 = np.where(p < 0, np.maximum(t0, ratio), t0)
+            t1 = np.where(p > 0, np.minimum(t1, ratio), t1)
+    # segments touching the rectangle in a single point are dropped
+    accepted &= (t0 < t1) | ((dx == 0) & (dy == 0))
+
+    # a part continues through a vertex inside the rectangle
+    previous_continues = np.zeros(len(segment_starts), dtype=bool)
+    previous_continues[1:] = (
+        accepted[:-1] & (t1[:-1] == 1.0)
+        & (segment_line_ids[1:] == segment_line_ids[:-1]))
+    starts_part = accepted & ~(previous_continues & (t0 == 0.0))
+
+    # original vertices are kept exactly, cut points are interpolated
+    # (and kept on the boundary despite the rounding)
+    start_x = np.where(t0 == 0.0, x0, np.clip(x0 + t0 * dx, x_min, x_max))
+    start_y = np.where(t0 == 0.0, y0, np.clip(y0 + t0 * dy, y_min, y_max))
+    start_z = np.where(t0 == 0.0, z0, z0 + t0 * (z1 - z0))
+    end_x = np.where(t1 == 1.0, x1, np.clip(x0 + t1 * dx, x_min, x_max))
+    end_y = np.where(t1 == 1.0, y1, np.clip(y0 + t1 * dy, y_min, y_max))
+    end_z = np.where(t1 == 1.0, z1, z0 + t1 * (z1 - z0))
+
+    # every accepted segment adds its end, a segment starting a part also its start
+    vertex_mask = np.column_stack((starts_part, accepted)).ravel()
+    clipped_x = np.column_stack((start_x, end_x)).ravel()[vertex_mask]
+    clipped_y = np.column_stack((start_y, end_y)).ravel()[vertex_mask]
+    clipped_z = np.column_stack((start_z, end_z)).ravel()[vertex_mask]
+    is_part_start = np.column_stack((starts_part, np.zeros(len(starts_part), dtype=bool))).ravel()[vertex_mask]
+    part_offsets = np.r_[np.flatnonzero(is_part_start), len(clipped_x)].astype(np.int64)
+    part_counts = np.bincount(segment_line_ids[starts_part], minlength=line_count).astype(np.int64)
+
+    return clipped_x, clipped_y, clipped_z, part_offsets, part_counts
+
+def bounds_intersect(bounds, other_bounds, tolerance=0.0):
+    """True if the rectangles (x_min, y_min, x_max, y_max) intersect, touching included."""
+    return (
+        bounds[0] <= other_bounds[2] + tolerance and other_bounds[0] <= bounds[2] + tolerance
+        and bounds[1] <= other_bounds[3] + tolerance and other_bounds[1] <= bounds[3] + tolerance)
+
+def _get_pairs_in_cells(x, y, keys, row_count, distance):
+    """
+    (first, second) indices (first < second) of the point pairs at most
+    distance apart, comparing the points of the same and neighbouring cells.
+    """
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    firsts = []
+    seconds = []
+    # every pair of neighbouring cells once: the cell itself and 4 of its 8 neighbours
+    for column_offset, row_offset in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        neighbour_keys = sorted_keys + (column_offset * row_count + row_offset)
+        ends = np.searchsorted(sorted_keys, neighbour_keys, "right")
+        if column_offset == 0 and row_offset == 0:
+            # the next points of the same cell
+            starts = np.arange(1, len(keys) + 1)
+        else:
+            starts = np.searchsorted(sorted_keys, neighbour_keys, "left")
+        counts = np.maximum(ends - starts, 0)
+        if not counts.any():
+            continue
+        positions = np.repeat(np.arange(len(keys)), counts)
+        neighbour_positions = np.arange(len(positions)) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+        a = order[positions]
+        b = order[neighbour_positions]
+        close = np.hypot(x[a] - x[b], y[a] - y[b]) <= distance
+        firsts.append(np.minimum(a[close], b[close]))
+        seconds.append(np.maximum(a[close], b[close]))
+
+    if not firsts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+def get_close_point_pairs(x, y, distance):
+    """
+    (first, second) indices (first < second) of all point pairs at most
+    distance apart. Points are bucketed in a grid of cells of the distance
+    size, so a close pair is always in the same or neighbouring cells;
+    only the points of cells with an occupied neighbourhood are compared.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    columns, rows = get_cell_indices(x, y, distance, (x.min(), y.min()))
+    # a spare row, so the row offsets -1/+1 never reach another column
+    row_count = int(rows.max()) + 2
+    keys = columns * row_count + rows
+    del columns, rows
+
+    # cells with more points or an occupied neighbour cell
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    is_cell_start = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    cell_keys = sorted_keys[is_cell_start]
+    cell_counts = np.diff(np.r_[np.flatnonzero(is_cell_start), len(keys)])
+    del sorted_keys, is_cell_start
+    candidate_cells = cell_counts > 1
+    # the next row of the column
+    has_next_row = cell_keys[1:] == cell_keys[:-1] + 1
+    candidate_cells[:-1] |= has_next_row
+    candidate_cells[1:] |= has_next_row
+    # up to 3 cells of the next column: keys from key + row_count - 1 to key + row_count + 1,
+    # marked in both cells of every found pair
+    next_column = np.searchsorted(cell_keys, cell_keys + (row_count - 1))
+    for step in range(3):
+        found = np.minimum(next_column + step, len(cell_keys) - 1)
+        is_neighbour = (next_column + step < len(cell_keys)) & (cell_keys[found] <= cell_keys + (row_count + 1))
+        candidate_cells |= is_neighbour
+        candidate_cells[found[is_neighbour]] = True
+    candidates = np.sort(order[np.repeat(candidate_cells, cell_counts)])
+    if len(candidates) < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    first, second = _get_pairs_in_cells(x[candidates], y[candidates], keys[candidates], row_count, distance)
+    return candidates[first], candidates[second]
+
+def get_unique_points_mask(x, y, tolerance):
+    """
+    Mask keeping the first point (in the input order) of the points lying
+    within the tolerance: a point is removed if an earlier kept point is at
+    most tolerance away. Exact, also for duplicates split by a cell border.
+    """
+    unique = np.ones(len(x), dtype=bool)
+    first, second = get_close_point_pairs(x, y, tolerance)
+    if len(first) == 0:
+        return unique
+
+    # the earlier point of a pair is surely kept if it is not the later point of any pair
+    is_second = np.zeros(len(x), dtype=bool)
+    is_second[second] = True
+    unique[second[~is_second[first]]] = False
+
+    # chains of 3 and more points: in the input order, as the kept points depend on the earlier ones
+    chained = is_second[first] & unique[second]
+    if np.any(chained):
+        pair_order = np.lexsort((first[chained], second[chained]))
+        for i, j in zip(first[chained][pair_order].tolist(), second[chained][pair_order].tolist()):
+            if unique[i] and unique[j]:
+                unique[j] = False
+    return unique
+
+def get_cell_indices(x, y, cell_size, origin):
+    """Column and row of the grid cell (floor of the cell size from the origin) of every point."""
+    return (
+        np.floor((np.asarray(x) - origin[0]) / cell_size).astype(np.int64),
+        np.floor((np.asarray(y) - origin[1]) / cell_size).astype(np.int64))
+
+def get_near_lines_mask(x, y, line_x, line_y, offsets, distance):
+    """
+    Mask of points lying in the grid cells (of the given size) crossed by
+    the lines or adjacent to them, i.e. at most about 2 * distance away.
+    Segments are sampled every distance / 2, so no crossed cell is missed.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    line_x = np.asarray(line_x)
+    line_y = np.asarray(line_y)
+    if len(x) == 0 or len(line_x) == 0:
+        return np.zeros(len(x), dtype=bool)
+
+    starts = get_segment_starts(offsets)
+    x0, y0 = line_x[starts], line_y[starts]
+    x1, y1 = line_x[starts + 1], line_y[starts + 1]
+    sample_counts = np.maximum(1, np.ceil(np.hypot(x1 - x0, y1 - y0) / (distance / 2))).astype(np.int64) + 1
+    segment_ids = np.repeat(np.arange(len(starts)), sample_counts)
+    first_samples = np.cumsum(sample_counts) - sample_counts
+    t = (np.arange(len(segment_ids)) - first_samples[segment_ids]) / (sample_counts[segment_ids] - 1)
+    sample_x = x0[segment_ids] + t * (x1 - x0)[segment_ids]
+    sample_y = y0[segment_ids] + t * (y1 - y0)[segment_ids]
+
+    # one cell margin around the points and lines for the neighbouring cells
+    origin = (min(x.min(), line_x.min()) - distance, min(y.min(), line_y.min()) - distance)
+    row_count = int((max(y.max(), line_y.max()) - origin[1]) // distance) + 3
+
+    columns, rows = get_cell_indices(sample_x, sample_y, distance, origin)
+    line_keys = np.unique(columns * row_count + rows)
+    neighbour_offsets = (np.arange(-1, 2)[:, None] * row_count + np.arange(-1, 2)[None, :]).ravel()
+    line_keys = np.unique((line_keys[:, None] + neighbour_offsets[None, :]).ravel())
+
+    columns, rows = get_cell_indices(x, y, distance, origin)
+    return np.isin(columns * row_count + rows, line_keys)
+
+def get_thinning_mask(x, y, z, cell_size, z_tolerance, keep=None):
+    """
+    Voxel-grid thinning as a sort-and-reduce over the points. Points are
+    sorted by their XY cell; in cells whose Z range does not exceed
+    z_tolerance only the point closest to the middle of the range is kept,
+    cells with a larger range keep all points. Points flagged in keep are
+    always kept.
+    Returns the mask of kept points and the maximum Z deviation of the
+    removed points from the kept point of their cell.
+    """
+    point_count = len(x)
+    if point_count == 0:
+        return np.zeros(0, dtype=bool), 0.0
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    z = np.asarray(z)
+    columns, rows = get_cell_indices(x, y, cell_size, (x.min(), y.min()))
+    keys = columns * (int(rows.max()) + 1) + rows
+
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    sorted_z = z[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    cell_ids = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, point_count]))
+
+    z_min = np.minimum.reduceat(sorted_z, starts)
+    z_max = np.maximum.reduceat(sorted_z, starts)
+    is_flat = (z_max - z_min) <= z_tolerance
+
+    # the point closest to the middle of the Z range represents the cell
+    middle_distance = np.abs(sorted_z - ((z_min + z_max) / 2)[cell_ids])
+    representatives = np.lexsort((middle_distance, cell_ids))[starts]
+
+    kept = ~is_flat[cell_ids]
+    kept[representatives] = True
+    mask = np.empty(point_count, dtype=bool)
+    mask[order] = kept
+    if keep is not None:
+        mask |= keep
+
+    deviation = np.abs(sorted_z - sorted_z[representatives][cell_ids])
+    removed = ~mask[order]
+    max_deviation = float(deviation[removed].max()) if removed.any() else 0.0
+    return mask, max_deviation
+
+def get_masked_offsets(offsets, mask):
+    """Offsets of the lines after removing the vertices not in the mask."""
+    return np.r_[0, np.cumsum(mask, dtype=np.int64)][np.asarray(offsets)]
+
+def _get_tolerance_ratio(deviation, tolerance):
+    if tolerance is None:
+        return np.zeros(len(deviation))
+    if tolerance <= 0:
+        return np.where(deviation > 0, np.inf, 0.0)
+    return deviation / tolerance
+
+def get_simplified_mask(x, y, z, offsets, xy_tolerance, z_tolerance=None):
+    """
+    Douglas-Peucker simplification of all lines at once. Every pass splits
+    all pending intervals of all lines at their farthest vertex, so the
+    number of passes is the depth of the recursion, not the vertex count.
+    A vertex is significant when its XY distance from the chord exceeds
+    xy_tolerance or its Z differs from the chord interpolated at its
+    position by more than z_tolerance (None disables the Z test).
+    A missing xy_tolerance is 0, so a Z-only simplification removes only
+    vertices lying on the chord in XY and keeps the XY shape of the lines.
+    First and last vertices of every line are always kept.
+    Returns the mask of kept vertices.
+    """
+    if xy_tolerance is None:
+        xy_tolerance = 0.0
+    has_zero_tolerance = xy_tolerance <= 0 or (z_tolerance is not None and z_tolerance <= 0)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    z = np.asarray(z, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+
+    keep = np.zeros(len(x), dtype=bool)
+    keep[offsets[:-1][counts > 0]] = True
+    keep[offsets[1:][counts > 0] - 1] = True
+
+    starts = offsets[:-1][counts > 2]
+    ends = offsets[1:][counts > 2] - 1
+    while len(starts):
+        # interior vertices of every interval
+        interior_counts = ends - starts - 1
+        interval_ids = np.repeat(np.arange(len(starts)), interior_counts)
+        first = np.cumsum(interior_counts) - interior_counts
+        vertices = starts[interval_ids] + 1 + np.arange(len(interval_ids)) - first[interval_ids]
+
+        ax, ay, az = x[starts][interval_ids], y[starts][interval_ids], z[starts][interval_ids]
+        dx = x[ends][interval_ids] - ax
+        dy = y[ends][interval_ids] - ay
+        dz = z[ends][interval_ids] - az
+        length_2 = dx * dx + dy * dy
+        px = x[vertices] - ax
+        py = y[vertices] - ay
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(length_2 > 0, (px * dx + py * dy) / length_2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        xy_deviation = np.hypot(px - t * dx, py - t * dy)
+        z_deviation = np.abs(z[vertices] - az - t * dz)
+        xy_error = _get_tolerance_ratio(xy_deviation, xy_tolerance)
+        z_error = _get_tolerance_ratio(z_deviation, z_tolerance)
+        error = np.maximum(xy_error, z_error)
+
+        # farthest vertex of every interval (the first one on ties)
+        max_error = np.maximum.reduceat(error, first)
+        is_farthest = error == max_error[interval_ids]
+        if has_zero_tolerance:
+            # every deviation over a zero tolerance is infinite, the largest one splits the interval
+            deviation = np.where(np.isinf(xy_error), xy_deviation, 0.0) + np.where(np.isinf(z_error), z_deviation, 0.0)
+            deviation = np.where(is_farthest, deviation, -1.0)
+            is_farthest &= deviation == np.maximum.reduceat(deviation, first)[interval_ids]
+        positions = np.arange(len(error))
+        farthest = np.minimum.reduceat(np.where(is_farthest, positions, len(error)), first)
+        is_split = error[farthest] > 1.0
+        split_vertices = vertices[farthest][is_split]
+        keep[split_vertices] = True
+
+        starts, ends = starts[is_split], ends[is_split]
+        starts, ends = np.r_[starts, split_vertices], np.r_[split_vertices, ends]
+        has_interior = ends - starts > 1
+        starts, ends = starts[has_interior], ends[has_interior]
+
+    return keep
+
+# cells of the polygon grid per edge, and the limits of the grid
+POLYGON_CELLS_PER_EDGE = 4
+MIN_POLYGON_CELLS = 256
+MAX_POLYGON_CELLS = 1024 * 1024
+# size of the point x edge matrices of the exact test
+MAX_CROSSING_TESTS = 4 * 1024 * 1024
+
+CELL_OUTSIDE = 0
+CELL_INSIDE = 1
+CELL_BOUNDARY = 2
+
+
+class PolygonGrid:
+    '''
+    Polygon (list of rings, even-odd rule) prepared for point-in-polygon
+    tests: edge arrays bucketed by grid rows and a coarse grid of cells
+    classified as inside, outside or crossed by the boundary. Points in
+    inside/outside cells are classified by the cell lookup, only points in
+    boundary cells are tested exactly by ray casting against the edges of
+    their grid row.
+    '''
+    def __init__(self, rings, max_cells=MAX_POLYGON_CELLS):
+        rings = [np.asarray(ring, dtype=np.float64) for ring in rings]
+        vertices = np.concatenate(rings)
+        self.bounds = (vertices[:, 0].min(), vertices[:, 1].min(), vertices[:, 0].max(), vertices[:, 1].max())
+
+        # edges of all rings, horizontal edges never cross the ray
+        ax = np.concatenate([ring[:, 0] for ring in rings])
+        ay = np.concatenate([ring[:, 1] for ring in rings])
+        bx = np.concatenate([np.roll(ring[:, 0], -1) for ring in rings])
+        by = np.concatenate([np.roll(ring[:, 1], -1) for ring in rings])
+        sloped = ay != by
+        self.ax, self.ay, self.bx, self.by = ax[sloped], ay[sloped], bx[sloped], by[sloped]
+
+        width = max(self.bounds[2] - self.bounds[0], 1e-9)
+        height = max(self.bounds[3] - self.bounds[1], 1e-9)
+        cell_count = min(max(POLYGON_CELLS_PER_EDGE * len(ax), MIN_POLYGON_CELLS), max_cells)
+        cell_size = np.sqrt(width * height / cell_count)
+        self.columns = int(min(max(1, np.ceil(width / cell_size)), max_cells))
+        self.rows = int(min(max(1, np.ceil(height / cell_size)), max(1, max_cells // self.columns)))
+        self.cell_width = width / self.columns
+        self.cell_height = height / self.rows
+
+        self._bucket_edges()
+        self.cells = self._classify_cells(ax, ay, bx, by)
+
+    def _get_columns(self, x):
+        return np.clip(np.floor((x - self.bounds[0]) / self.cell_width), 0, self.columns - 1).astype(np.int64)
+
+    def _get_rows(self, y):
+        return np.clip(np.floor((y - self.bounds[1]) / self.cell_height), 0, self.rows - 1).astype(np.int64)
+
+    def _bucket_edges(self):
+        """Edge indices sorted by the grid rows they span."""
+        first_rows = self._get_rows(np.minimum(self.ay, self.by))
+        last_rows = self._get_rows(np.maximum(self.ay, self.by))
+        spans = last_rows - first_rows + 1
+        edge_ids = np.repeat(np.arange(len(spans)), spans)
+        edge_rows = np.repeat(first_rows, spans) + np.arange(len(edge_ids)) - np.repeat(np.cumsum(spans) - spans, spans)
+        order = np.argsort(edge_rows, kind="stable")
+        self.row_edges = edge_ids[order]
+        self.row_offsets = np.searchsorted(edge_rows[order], np.arange(self.rows + 1))
+
+    def _classify_cells(self, ax, ay, bx, by):
+        """Grid of CELL_* states: boundary cells are all cells touched by an edge and their neighbours."""
+        # points along every edge at most half a cell apart
+        step = min(self.cell_width, self.cell_height) / 2
+        sample_counts = np.ceil(np.hypot(bx - ax, by - ay) / step).astype(np.int64) + 1
+        edge_ids = np.repeat(np.arange(len(ax)), sample_counts)
+        sample_ids = np.arange(len(edge_ids)) - np.repeat(np.cumsum(sample_counts) - sample_counts, sample_counts)
+        t = sample_ids / np.maximum(sample_counts[edge_ids] - 1, 1)
+        sample_x = ax[edge_ids] + t * (bx - ax)[edge_ids]
+        sample_y = ay[edge_ids] + t * (by - ay)[edge_ids]
+
+        touched = np.zeros((self.rows + 2, self.columns + 2), dtype=bool)
+        touched[self._get_rows(sample_y) + 1, self._get_columns(sample_x) + 1] = True
+        # cells crossed only at a corner are next to a touched cell
+        boundary = np.zeros((self.rows, self.columns), dtype=bool)
+        for row_shift in range(3):
+            for column_shift in range(3):
+                boundary |= touched[row_shift:row_shift + self.rows, column_shift:column_shift + self.columns]
+
+        cells = np.full((self.rows, self.columns), CELL_BOUNDARY, dtype=np.uint8)
+        rows, columns = np.nonzero(~boundary)
+        center_x = self.bounds[0] + (columns + 0.5) * self.cell_width
+        center_y = self.bounds[1] + (rows + 0.5) * self.cell_height
+        cells[rows, columns] = np.where(self._contains_exact(center_x, center_y), CELL_INSIDE, CELL_OUTSIDE)
+        return cells
+
+    def _contains_exact(self, x, y):
+        """Ray casting (even-odd) against the edges of the grid row of every point."""
+        inside = np.zeros(len(x), dtype=bool)
+        rows = self._get_rows(y)
+        order = np.argsort(rows, kind="stable")
+        row_starts = np.searchsorted(rows[order], np.arange(self.rows + 1))
+        for row in np.flatnonzero(np.diff(row_starts)).tolist():
+            edges = self.row_edges[self.row_offsets[row]:self.row_offsets[row + 1]]
+            if len(edges) == 0:
+                continue
+            ax, ay, bx, by = self.ax[edges], self.ay[edges], self.bx[edges], self.by[edges]
+            points = order[row_starts[row]:row_starts[row + 1]]
+            chunk_size = max(1, MAX_CROSSING_TESTS // len(edges))
+            for start in range(0, len(points), chunk_size):
+                chunk = points[start:start + chunk_size]
+                px = x[chunk, None]
+                py = y[chunk, None]
+                crosses = (ay > py) != (by > py)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    crosses &= px < (bx - ax) * (py - ay) / (by - ay) + ax
+                inside[chunk] = np.count_nonzero(crosses, axis=1) % 2 == 1
+        return inside
+
+    def contains(self, x, y):
+        """Mask of the points inside the polygon. Points exactly on the boundary may fall on either side."""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        mask = np.zeros(len(x), dtype=bool)
+        candidates = np.flatnonzero(get_in_bounds_mask(x, y, self.bounds))
+        if len(candidates) == 0:
+            return mask
+
+        px = x[candidates]
+        py = y[candidates]
+        states = self.cells[self._get_rows(py), self._get_columns(px)]
+        mask[candidates[states == CELL_INSIDE]] = True
+        on_boundary = np.flatnonzero(states == CELL_BOUNDARY)
+        mask[candidates[on_boundary]] = self._contains_exact(px[on_boundary], py[on_boundary])
+        return mask
+
+def get_points_in_polygons_mask(x, y, polygons):
+    """
+    Mask of points inside any of the polygons. A polygon is a list of rings,
+    (n, 2) arrays of vertices; holes and parts are handled by the even-odd
+    rule over all rings of the polygon (see PolygonGrid). Points exactly on
+    the boundary may fall on either side.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    mask = np.zeros(len(x), dtype=bool)
+    for rings in polygons:
+        polygon = PolygonGrid(rings)
+        candidates = np.flatnonzero(get_in_bounds_mask(x, y, polygon.bounds) & ~mask)
+        mask[candidates[polygon.contains(x[candidates], y[candidates])]] = True
+    return mask
+
+def get_ring_area(ring):
+    """Area of the ring ((n, 2) array of vertices, closed or not) by the shoelace formula."""
+    ring = np.asarray(ring, dtype=np.float64)
+    x = ring[:, 0] - ring[:, 0].mean()
+    y = ring[:, 1] - ring[:, 1].mean()
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+def is_rectangle(rings, tolerance):
+    """
+    True if the rings make a single axis-aligned rectangle: the area of the
+    ring differs from the area of its bounding box by at most a strip of
+    the tolerance width along the edges.
+    """
+    if len(rings) != 1:
+        return False
+    ring = np.asarray(rings[0], dtype=np.float64)
+    width = ring[:, 0].max() - ring[:, 0].min()
+    height = ring[:, 1].max() - ring[:, 1].min()
+    return abs(width * height - get_ring_area(ring)) <= 2 * tolerance * (width + height)
+
+def get_ring_edges(rings):
+    """(ax, ay, bx, by) arrays of the edges of all rings (closed or not), without zero-length edges."""
+    rings = [np.asarray(ring, dtype=np.float64) for ring in rings]
+    ax = np.concatenate([ring[:, 0] for ring in rings])
+    ay = np.concatenate([ring[:, 1] for ring in rings])
+    bx = np.concatenate([np.roll(ring[:, 0], -1) for ring in rings])
+    by = np.concatenate([np.roll(ring[:, 1], -1) for ring in rings])
+    has_length = (ax != bx) | (ay != by)
+    return ax[has_length], ay[has_length], bx[has_length], by[has_length]
+
+def get_near_rings_mask(x, y, rings, distance):
+    """Mask of points at most distance from an edge of the rings (exact point-segment distances)."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    ax, ay, bx, by = get_ring_edges(rings)
+    mask = np.zeros(len(x), dtype=bool)
+    if len(ax) == 0:
+        return mask
+    chunk_size = max(1, MAX_CROSSING_TESTS // len(ax))
+    for start in range(0, len(x), chunk_size):
+        px = x[start:start + chunk_size, None]
+        py = y[start:start + chunk_size, None]
+        distances = _point_segment_distance(px, py, ax, ay, bx, by)
+        mask[start:start + chunk_size] = np.any(distances <= distance, axis=1)
+    return mask
+
+def get_in_polygon_mask(x, y, rings, tolerance=0.0):
+    """Mask of points inside the polygon (even-odd rule over the rings) or at most tolerance from its edges."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    polygon = PolygonGrid(rings)
+    mask = np.zeros(len(x), dtype=bool)
+    candidates = np.flatnonzero(get_in_bounds_mask(x, y, polygon.bounds, tolerance))
+    inside = polygon.contains(x[candidates], y[candidates])
+    if tolerance > 0:
+        outside = np.flatnonzero(~inside)
+        inside[outside] = get_near_rings_mask(x[candidates[outside]], y[candidates[outside]], rings, tolerance)
+    mask[candidates[inside]] = True
+    return mask
+
+def clip_lines_to_polygon(x, y, z, offsets, rings, tolerance=0.0):
+    """
+    Clips all lines to the polygon (even-odd rule over the rings), the
+    equivalent of clip_lines_to_bounds for outlines which are not
+    rectangles. Every segment is cut at its crossings with the edges and
+    the pieces with the middle inside the polygon (or at most tolerance
+    from its edges) are kept. Z of the cut points is interpolated along the
+    segment, a line leaving and entering the polygon again is split into parts.
+    Returns x, y, z, offsets of the parts and the number of parts of every
+    line (0 for the lines outside the polygon).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    line_count = len(offsets) - 1
+
+    segment_starts = get_segment_starts(offsets)
+    segment_line_ids = get_line_ids(offsets)[segment_starts]
+    x0 = x[segment_starts]
+    y0 = y[segment_starts]
+    z0 = z[segment_starts]
+    x1 = x[segment_starts + 1]
+    y1 = y[segment_starts + 1]
+    z1 = z[segment_starts + 1]
+    dx = x1 - x0
+    dy = y1 - y0
+    segment_count = len(segment_starts)
+
+    # crossings (t along the segment) of the segments near the polygon with its edges
+    ax, ay, bx, by = get_ring_edges(rings)
+    ex = bx - ax
+    ey = by - ay
+    polygon_bounds = (
+        min(ax.min(), bx.min()), min(ay.min(), by.min()), max(ax.max(), bx.max()), max(ay.max(), by.max()))
+    near = (
+        (np.maximum(x0, x1) >= polygon_bounds[0] - tolerance)
+        & (np.minimum(x0, x1) <= polygon_bounds[2] + tolerance)
+        & (np.maximum(y0, y1) >= polygon_bounds[1] - tolerance)
+        & (np.minimum(y0, y1) <= polygon_bounds[3] + tolerance))
+    candidates = np.flatnonzero(near)
+    crossing_ids = [np.arange(segment_count), np.arange(segment_count)]
+    crossing_t = [np.zeros(segment_count), np.ones(segment_count)]
+    chunk_size = max(1, MAX_CROSSING_TESTS // max(len(ax), 1))
+    for start in range(0, len(candidates), chunk_size):
+        ids = candidates[start:start + chunk_size]
+        sx, sy = x0[ids, None], y0[ids, None]
+        sdx, sdy = dx[ids, None], dy[ids, None]
+        denominator = sdx * ey - sdy * ex
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = ((ax - sx) * ey - (ay - sy) * ex) / denominator
+            u = ((ax - sx) * sdy - (ay - sy) * sdx) / denominator
+        rows, columns = np.nonzero((denominator != 0) & (t > 0) & (t < 1) & (u >= 0) & (u <= 1))
+        crossing_ids.append(ids[rows])
+        crossing_t.append(t[rows, columns])
+    crossing_ids = np.concatenate(crossing_ids)
+    crossing_t = np.concatenate(crossing_t)
+    order = np.lexsort((crossing_t, crossing_ids))
+    crossing_ids = crossing_ids[order]
+    crossing_t = crossing_t[order]
+
+    # pieces between consecutive crossings of every segment
+    is_piece = crossing_ids[:-1] == crossing_ids[1:]
+    piece_ids = crossing_ids[:-1][is_piece]
+    piece_t0 = crossing_t[:-1][is_piece]
+    piece_t1 = crossing_t[1:][is_piece]
+    middle_t = (piece_t0 + piece_t1) / 2
+    kept = get_in_polygon_mask(
+        x0[piece_ids] + middle_t * dx[piece_ids], y0[piece_ids] + middle_t * dy[piece_ids], rings, tolerance)
+
+    # consecutive kept pieces of a segment make one piece
+    continues = np.zeros(len(kept), dtype=bool)
+    continues[1:] = kept[1:] & kept[:-1] & (piece_ids[1:] == piece_ids[:-1])
+    first = np.flatnonzero(kept & ~continues)
+    last = np.flatnonzero(kept & ~np.r_[continues[1:], False])
+    piece_ids = piece_ids[first]
+    piece_t0 = piece_t0[first]
+    piece_t1 = piece_t1[last]
+
+    # a part continues through a vertex inside the polygon
+    starts_part = np.ones(len(piece_ids), dtype=bool)
+    starts_part[1:] = ~(
+        (piece_ids[1:] == piece_ids[:-1] + 1)
+        & (segment_line_ids[piece_ids[1:]] == segment_line_ids[piece_ids[:-1]])
+        & (piece_t1[:-1] == 1.0) & (piece_t0[1:] == 0.0))
+
+    # original vertices are kept exactly, cut points are interpolated
+    def get_vertices(t):
+        vertices = []
+        for start, end in ((x0, x1), (y0, y1), (z0, z1)):
+            start, end = start[piece_ids], end[piece_ids]
+            vertices.append(np.where(t == 0.0, start, np.where(t == 1.0, end, start + t * (end - start))))
+        return vertices
+    start_x, start_y, start_z = get_vertices(piece_t0)
+    end_x, end_y, end_z = get_vertices(piece_t1)
+
+    # every piece adds its end, a piece starting a part also its start
+    vertex_mask = np.column_stack((starts_part, np.ones(len(starts_part), dtype=bool))).ravel()
+    clipped_x = np.column_stack((start_x, end_x)).ravel()[vertex_mask]
+    clipped_y = np.column_stack((start_y, end_y)).ravel()[vertex_mask]
+    clipped_z = np.column_stack((start_z, end_z)).ravel()[vertex_mask]
+    is_part_start = np.column_stack((starts_part, np.zeros(len(starts_part), dtype=bool))).ravel()[vertex_mask]
+    part_offsets = np.r_[np.flatnonzero(is_part_start), len(clipped_x)].astype(np.int64)
+    part_counts = np.bincount(segment_line_ids[piece_ids[starts_part]], minlength=line_count).astype(np.int64)
+
+    return clipped_x, clipped_y, clipped_z, part_offsets, part_counts
+
+class SheetOutline:
+    '''
+    Outline of a sheet from the sheet index: its bounding box and rings.
+    Sheets following the geographic grid are not rectangles in PUWG-1992,
+    their bounding boxes overlap the neighbouring sheets.
+    '''
+    def __init__(self, rings, tolerance=0.0):
+        self.rings = [np.asarray(ring, dtype=np.float64)[:, :2] for ring in rings]
+        vertices = np.concatenate(self.rings)
+        self.bounds = (
+            float(vertices[:, 0].min()), float(vertices[:, 1].min()),
+            float(vertices[:, 0].max()), float(vertices[:, 1].max()))
+        self.is_rectangle = is_rectangle(self.rings, tolerance)
+
+    def get_key(self):
+        """Text identifying the outline (e.g. for checkpoint fingerprints)."""
+        if self.is_rectangle:
+            return str(self.bounds)
+        digest = hashlib.sha1(b"".join(ring.tobytes() for ring in self.rings)).hexdigest()
+        return f"{self.bounds}|{digest}"
+
+    def get_points_mask(self, x, y, tolerance=0.0):
+        """
+        Mask of points inside the outline or at most tolerance from its edges.
+        Rectangles are tested by the bounds only, other outlines by the
+        polygon (PolygonGrid) and the distance from the edges.
+        """
+        if self.is_rectangle:
+            return get_in_bounds_mask(np.asarray(x), np.asarray(y), self.bounds, tolerance)
+        return get_in_polygon_mask(x, y, self.rings, tolerance)
+
+    def clip_lines(self, x, y, z, offsets, tolerance=0.0):
+        """Lines clipped to the outline, see clip_lines_to_bounds and clip_lines_to_polygon."""
+        if self.is_rectangle:
+            return clip_lines_to_bounds(x, y, z, offsets, self.bounds, tolerance)
+        return clip_lines_to_polygon(x, y, z, offsets, self.rings, tolerance)
@@ -0,0 +1,277 @@
+"""
+Decoder of the map sheet symbols (godla) of the PUWG-1992 nomenclature.
+
+Sheets are derived from the International Map of the World 1:1 000 000
+sheet (e.g. "N-34": row N = 52-56 N, zone 34 = 18-24 E):
+
+    1:500 000   N-34-A                  2 x 2 (A-D)
+    1:200 000   N-34-XII                6 x 6 (I-XXXVI)
+    1:100 000   N-34-139               12 x 12 (1-144)
+    1:50 000    N-34-139-A              2 x 2 (A-D)
+    1:25 000    N-34-139-A-c            2 x 2 (a-d)
+    1:10 000    N-34-139-A-c-1          2 x 2 (1-4)
+    1:5 000     N-34-139-A-c-1-1        2 x 2 (1-4)
+    1:2 000     N-34-139-A-c-1-1-1      3 x 3 (1-9)
+    1:1 000     N-34-139-A-c-1-1-1-1    2 x 2 (1-4)
+    1:500       N-34-139-A-c-1-1-1-1-1  2 x 2 (1-4)
+
+Parts are numbered row by row from the north-west corner. Symbols are
+accepted with dashes ("N-34-139-A-c-1-1"), unified ("n34139ac11") and
+with the "NMT-" prefix. Sheet outlines are projected to EPSG:2180.
+"""
+import re
+
+import crs_transform
+
+SCALE_1M = 1000000
+SCALE_500K = 500000
+SCALE_200K = 200000
+SCALE_100K = 100000
+SCALE_50K = 50000
+SCALE_25K = 25000
+SCALE_10K = 10000
+SCALE_5K = 5000
+SCALE_2K = 2000
+SCALE_1K = 1000
+SCALE_500 = 500
+
+ROW_LETTERS = "ABCDEFGHIJKLMNOPQRSTUV"
+ROW_HEIGHT = 4.0
+ZONE_WIDTH = 6.0
+
+# scales below 1:100 000: the sheet of the previous scale split into
+# split x split parts with the symbols
+DETAIL_SCALES = [
+    (SCALE_50K, 2, "ABCD"),
+    (SCALE_25K, 2, "abcd"),
+    (SCALE_10K, 2, "1234"),
+    (SCALE_5K, 2, "1234"),
+    (SCALE_2K, 3, "123456789"),
+    (SCALE_1K, 2, "1234"),
+    (SCALE_500, 2, "1234")]
+
+SCALES = [
+    SCALE_1M, SCALE_500K, SCALE_200K, SCALE_100K,
+    *(scale for scale, _, _ in DETAIL_SCALES)]
+
+ROMAN_NUMERALS = [
+    (10, "X"), (9, "IX"), (5, "V"), (4, "IV"), (1, "I")]
+
+_UNIFIED_SYMBOL = re.compile(
+    r"^([a-v])(\d{1,2})"
+    r"(?:([a-d])|([xvi]+)|(\d{1,3})"
+    r"(?:([a-d])(?:([a-d])(?:([1-4])(?:([1-4])(?:([1-9])(?:([1-4])([1-4])?)?)?)?)?)?)?)?$")
+
+
+def to_roman(number):
+    roman = ""
+    for value, numeral in ROMAN_NUMERALS:
+        while number >= value:
+            roman += numeral
+            number -= value
+    return roman
+
+def from_roman(roman):
+    values = {"I": 1, "V": 5, "X": 10}
+    number = 0
+    for i, numeral in enumerate(roman):
+        value = values[numeral]
+        if i + 1 < len(roman) and values[roman[i + 1]] > value:
+            number -= value
+        else:
+            number += value
+    if to_roman(number) != roman:
+        raise ValueError(f"Invalid roman numeral: {roman}")
+    return number
+
+def split_symbol(symbol):
+    """Splits the symbol into its parts, e.g. ["N", "34", "139", "A", "c", "1", "1"]."""
+    symbol = symbol.strip()
+    if symbol.lower().startswith("nmt"):
+        symbol = symbol[3:].lstrip("-_")
+
+    if "-" in symbol:
+        return symbol.split("-")
+
+    match = _UNIFIED_SYMBOL.match(symbol.lower())
+    if match is None:
+        raise ValueError(f"Invalid map sheet symbol: {symbol}")
+    parts = [part for part in match.groups() if part is not None]
+    # letters of the 1:1 000 000, 1:500 000 and 1:50 000 sheets are upper case
+    parts[0] = parts[0].upper()
+    if match.group(3) or match.group(4):
+        parts[2] = parts[2].upper()
+    if match.group(6):
+        parts[3] = parts[3].upper()
+    return parts
+
+def _split_cell(extent, rows, columns, number):
+    """Part number (from 1, row by row from the north-west) of the extent."""
+    lon_min, lat_min, lon_max, lat_max = extent
+    if not 1 <= number <= rows * columns:
+        raise ValueError(f"Invalid sheet number: {number}")
+    row, column = divmod(number - 1, columns)
+    height = (lat_max - lat_min) / rows
+    width = (lon_max - lon_min) / columns
+    return (
+        lon_min + column * width,
+        lat_max - (row + 1) * height,
+        lon_min + (column + 1) * width,
+        lat_max - row * height)
+
+def decode(symbol):
+    """Returns (scale, (lon_min, lat_min, lon_max, lat_max)) of the sheet in degrees."""
+    parts = split_symbol(symbol)
+    try:
+        row = ROW_LETTERS.index(parts[0].upper())
+        zone = int(parts[1])
+    except (ValueError, IndexError):
+        raise ValueError(f"Invalid map sheet symbol: {symbol}")
+    if not 1 <= zone <= 60:
+        raise ValueError(f"Invalid map sheet symbol: {symbol}")
+
+    lon_min = (zone - 31) * ZONE_WIDTH
+    lat_min = row * ROW_HEIGHT
+    extent = (lon_min, lat_min, lon_min + ZONE_WIDTH, lat_min + ROW_HEIGHT)
+    if len(parts) == 2:
+        return SCALE_1M, extent
+
+    part = parts[2]
+    if part in "ABCD" and len(part) == 1:
+        if len(parts) > 3:
+            raise ValueError(f"Invalid map sheet symbol: {symbol}")
+        return SCALE_500K, _split_cell(extent, 2, 2, "ABCD".index(part) + 1)
+    if part.isdigit():
+        extent = _split_cell(extent, 12, 12, int(part))
+        scale = SCALE_100K
+    else:
+        if len(parts) > 3:
+            raise ValueError(f"Invalid map sheet symbol: {symbol}")
+        try:
+            return SCALE_200K, _split_cell(extent, 6, 6, from_roman(part.upper()))
+        except KeyError:
+            raise ValueError(f"Invalid map sheet symbol: {symbol}")
+
+    if len(parts) - 3 > len(DETAIL_SCALES):
+        raise ValueError(f"Invalid map sheet symbol: {symbol}")
+    for part, (scale, split, part_symbols) in zip(parts[3:], DETAIL_SCALES):
+        if len(part) != 1 or part not in part_symbols:
+            raise ValueError(f"Invalid map sheet symbol: {symbol}")
+        extent = _split_cell(extent, split, split, part_symbols.index(part) + 1)
+
+    return scale, extent
+
+def encode(lon, lat, scale):
+    """Symbol of the sheet of the given scale containing the geographic point."""
+    if scale not in SCALES:
+        raise ValueError(f"Unsupported scale: {scale}")
+
+    def get_part(extent, rows, columns):
+        lon_min, lat_min, lon_max, lat_max = extent
+        row = min(int((lat_max - lat) / (lat_max - lat_min) * rows), rows - 1)
+        column = min(int((lon - lon_min) / (lon_max - lon_min) * columns), columns - 1)
+        number = row * columns + column + 1
+        return number, _split_cell(extent, rows, columns, number)
+
+    row = int(lat // ROW_HEIGHT)
+    zone = int(lon // ZONE_WIDTH) + 31
+    lon_min = (zone - 31) * ZONE_WIDTH
+    extent = (lon_min, row * ROW_HEIGHT, lon_min + ZONE_WIDTH, (row + 1) * ROW_HEIGHT)
+    parts = [ROW_LETTERS[row], f"{zone:02d}"]
+
+    if scale == SCALE_1M:
+        return "-".join(parts)
+    if scale == SCALE_500K:
+        number, _ = get_part(extent, 2, 2)
+        return "-".join(parts + ["ABCD"[number - 1]])
+    if scale == SCALE_200K:
+        number, _ = get_part(extent, 6, 6)
+        return "-".join(parts + [to_roman(number)])
+
+    number, extent = get_part(extent, 12, 12)
+    parts.append(str(number))
+    for part_scale, split, part_symbols in DETAIL_SCALES:
+        if scale > part_scale:
+            break
+        number, extent = get_part(extent, split, split)
+        parts.append(part_symbols[number - 1])
+    return "-".join(parts)
+
+def get_sheet_outline(symbol, edge_points=4, projection=crs_transform.EPSG_2180):
+    """
+    Outline of the sheet in the projected coordinates, clockwise from the
+    north-west corner. Edges are densified with edge_points points, since
+    parallels are curved after the projection.
+    """
+    _, (lon_min, lat_min, lon_max, lat_max) = decode(symbol)
+    geographic = []
+    for i in range(edge_points):
+        geographic.append((lon_min + (lon_max - lon_min) * i / edge_points, lat_max))
+    for i in range(edge_points):
+        geographic.append((lon_max, lat_max - (lat_max - lat_min) * i / edge_points))
+    for i in range(edge_points):
+        geographic.append((lon_max - (lon_max - lon_min) * i / edge_points, lat_min))
+    for i in range(edge_points):
+        geographic.append((lon_min, lat_min + (lat_max - lat_min) * i / edge_points))
+    return [tuple(map(float, projection.forward(lon, lat))) for lon, lat in geographic]
+
+def get_sheet_bounds(symbol, projection=crs_transform.EPSG_2180):
+    """(x_min, y_min, x_max, y_max) of the sheet in the projected coordinates."""
+    outline = get_sheet_outline(symbol, projection=projection)
+    xs = [x for x, _ in outline]
+    ys = [y for _, y in outline]
+    return min(xs), min(ys), max(xs), max(ys)
+
+def get_symbol_at(x, y, scale, projection=crs_transform.EPSG_2180):
+    """Symbol of the sheet of the given scale containing the projected point."""
+    return encode(*projection.inverse(x, y), scale)
+
+class SheetTable:
+    '''
+    Precomputed bounds of a set of sheets with a grid of buckets,
+    so a point or a rectangle is mapped to its sheets in O(1).
+    '''
+    def __init__(self, symbols, key=None, projection=crs_transform.EPSG_2180):
+        self.key = key or (lambda symbol: symbol)
+        self.bounds = {}
+        for symbol in symbols:
+            self.bounds[self.key(symbol)] = get_sheet_bounds(symbol, projection)
+
+        self.cell_size = 1.0
+        if self.bounds:
+            self.cell_size = max(max(b[2] - b[0], b[3] - b[1]) for b in self.bounds.values())
+        self.cells = {}
+        for sheet_key, bounds in self.bounds.items():
+            for cell in self._iter_cells(bounds):
+                self.cells.setdefault(cell, []).append(sheet_key)
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def __contains__(self, sheet_key):
+        return sheet_key in self.bounds
+
+    def get(self, sheet_key, default=None):
+        return self.bounds.get(sheet_key, default)
+
+    def _iter_cells(self, bounds):
+        column_min, row_min = int(bounds[0] // self.cell_size), int(bounds[1] // self.cell_size)
+        column_max, row_max = int(bounds[2] // self.cell_size), int(bounds[3] // self.cell_size)
+        for column in range(column_min, column_max + 1):
+            for row in range(row_min, row_max + 1):
+                yield column, row
+
+    def find_bounds(self, bounds):
+        """Keys of the sheets whose bounds intersect the rectangle (x_min, y_min, x_max, y_max)."""
+        found = set()
+        for cell in self._iter_cells(bounds):
+            for sheet_key in self.cells.get(cell, ()):
+                sheet_bounds = self.bounds[sheet_key]
+                if (sheet_bounds[0] <= bounds[2] and bounds[0] <= sheet_bounds[2]
+                        and sheet_bounds[1] <= bounds[3] and bounds[1] <= sheet_bounds[3]):
+                    found.add(sheet_key)
+        return found
+
+    def find_point(self, x, y):
+        """Keys of the sheets whose bounds contain the point."""
+        return self.find_bounds((x, y, x, y))
@@ -1,6 +1,25 @@
 import arcpy
+import itertools
 import math
+import multiprocessing
 import os
+import sys
+
+import numpy as np
+
+import crs_transform
+import instrumentation
+import nmt_asc
+import nmt_cache
+import nmt_catalog
+import nmt_dem
+import nmt_geometry
+import nmt_godlo
+import nmt_order
+import nmt_sheets
+import nmt_store
+import shapefile_writer
+import utils
 
 
 # exceptionally, in this script, the comments are in Polish
@@ -24,7 +43,6 @@ MEM_WORKSPACE = "in_memory"  # new "memory" workspace error
 MEM_NMT_POINTS_TEMP ="nmtPointsTemp"
 MEM_NMT_LINES_TEMP = "nmtLinesTemp"
 MEM_NMT_ENVELOPES_TEMP = "nmtEnvelopesTemp"
-MEM_NMT_LINES_TEMP_CLIP = "nmtLinesTempClip"
 MEM_NMT_POINTS = "nmtPoints"
 MEM_NMT_LINES = "nmtLines"
 MEM_NMT_ENVELOPES = "nmtEnvelopes"
@@ -32,9 +50,7 @@ MEM_NMT_INDEX_AREA = "nmtIndexArea"
 MEM_CLIP_AREA = "clipArea"
 
 # layer names
-LYR_NMT_POINTS_TEMP = "nmtPointsTempLyr"
 LYR_INDEX_AREA = "nmtIndexAreaLyr"
-LYR_NMT_POINTS = "nmtPointsLyr"
 LYR_NMT_LINES = "nmtLineslinesLyr"
 
 # fields
@@ -45,13 +61,34 @@ FLD_WARNINGS = "UWAGI"
 FLD_SHAPE_XY = "SHAPE@XY"
 FLD_SHAPE_Z = "SHAPE@Z"
 FLD_SHAPE = "SHAPE@"
+FLD_SHAPE_WKB = "SHAPE@WKB"
+# nazwa pola w DBF (max 10 znakow, jak skraca ArcGIS)
+FLD_INDEX_UNIFIED_DBF = "GODLO_UNIF"
+
+# pola shapefile zapisywanych bez arcpy (gdy katalog wyjsciowy jest folderem)
+SHP_POINT_FIELDS = [
+    shapefile_writer.Field(FLD_LAYER, shapefile_writer.FIELD_TEXT, 2),
+    shapefile_writer.Field(FLD_INDEX, shapefile_writer.FIELD_TEXT, 15)]
+SHP_LINE_FIELDS = SHP_POINT_FIELDS + [
+    shapefile_writer.Field(FLD_WARNINGS, shapefile_writer.FIELD_TEXT, 15)]
+SHP_ENVELOPE_FIELDS = [
+    shapefile_writer.Field(FLD_INDEX, shapefile_writer.FIELD_TEXT, 15),
+    shapefile_writer.Field(FLD_INDEX_UNIFIED_DBF, shapefile_writer.FIELD_TEXT, 15)]
 
 # PUWG92
 EPSG_102173 = 102173
 EPSG_2180 = 2180
 
 ENVELOPE_EDGE_BUFFER = "1 Meters"
+ENVELOPE_EDGE_DISTANCE = 1.0
 EPSILON = 0.005
+REPROJECT_BATCH_SIZE = 100000
+
+# przerzedzanie punktow: koty wysokosciowe zawsze zachowywane
+THINNING_Z_TOLERANCE = 0.1
+THINNING_KEEP_SIGNS = ['k']
+
+DEM_CELL_SIZE = 1.0
 SEPARATOR_LENGTH = 80
 SEPARATOR_SIGN = "="
 
@@ -86,18 +123,6 @@ def generate_separator(separator):
 def add_message_separator(separator):
     arcpy.AddMessage(generate_separator(separator))
 
-def get_asc_files_dict(tbd_folder):
-
-    # old version: ascFiles = [f for f in os.listdir(tbd_folder) if f.lower().endswith('.asc')]
-    
-    asc_files_dict = {}
-    for root, _, files in os.walk(tbd_folder):
-        for file in files:
-            if(file.lower().endswith(".asc")):
-                file_no_extension = file.split(".")[0]
-                asc_files_dict[file_no_extension] = os.path.join(root, file)
-    return asc_files_dict
-    
 class Extent:
     '''A class represent an object extent'''
     def __init__(self):
@@ -134,16 +159,13 @@ class Extent:
             if y > self.y_max:
                 self.y_max = y
 
-def parse_xyz_line(line):
-    floats = [float(x) for x in line.split()]
-    
-    # x/y w plikach ascii maja odwrocona kolejnosc
-    #? wyprowadzic jako parametr odwrocenie XY
-    x = floats[1]
-    y = floats[0]
-    z = floats[2]
-
-    return x, y, z
+    def update_bounds(self, bounds):
+        # bounds w postaci (x_min, y_min, x_max, y_max), np. z nmt_asc.get_bounds
+        if bounds is None:
+            return
+        x_min, y_min, x_max, y_max = bounds
+        self.update(x_min, y_min)
+        self.update(x_max, y_max)
 
 def set_arcpy_environment(workspace, spatial_ref):
     arcpy.env.overwriteOutput = True
@@ -200,13 +222,500 @@ def unify_index(index):
 def get_index_key (index, sign):
     return f"{index}_{sign}"
 
-def get_line_type(array):
-    extent = Extent()
-    [extent.update(point.X, point.Y) for point in array]
+def get_sheet_task(index, asc_files_dict, import_points, import_lines, cache=None, quantize=False):
+    """Zadanie dla nmt_sheets.read_sheet: (godlo, pliki punktow, pliki linii, cache, kwantyzacja)"""
+    def get_files(signs):
+        return [
+            (sign, asc_files_dict[get_index_key(index, sign)])
+            for sign in signs
+            if get_index_key(index, sign) in asc_files_dict]
+
+    point_files = get_files(POINT_SIGNS) if import_points else []
+    line_files = get_files(LINE_SIGNS) if import_lines else []
+
+    return index, point_files, line_files, cache, quantize
+
+def add_sheet_messages(sheet):
+    """Komunikaty z odczytu godla (rowniez z procesow roboczych)"""
+    # jedno podsumowanie blednych linii na godlo, z pierwszymi przykladami z kazdego pliku
+    error_count = sheet.errors.total()
+    if error_count:
+        summary = [f"godlo {sheet.index} - pominieto {error_count} blednych linii:"]
+        for path, count in sheet.errors.counts.items():
+            examples = "; ".join(
+                f"linia {line_number}: {asc_line}" for line_number, asc_line in sheet.errors.examples.get(path, []))
+            summary.append(f"{path} - {count} blednych linii, np. {examples}")
+        add_arcpy_message("\n".join(summary), type=MSG_ERROR)
+    for path in sheet.converted_files:
+        add_arcpy_message(f"{path} - przekonwertowano")
+    for path in sheet.missing_files:
+        add_arcpy_message(f"{path} - nie odnaleziono", type=MSG_WARNING)
+
+def set_multiprocessing_executable():
+    # w ArcGIS Pro sys.executable wskazuje na ArcGISPro.exe,
+    # procesy robocze musza byc uruchamiane przez python.exe
+    python_exe = os.path.join(sys.exec_prefix, "python.exe")
+    if os.path.exists(python_exe):
+        multiprocessing.set_executable(python_exe)
+
+def is_shapefile(out_fc_name):
+    return out_fc_name.lower().endswith(".shp")
+
+def create_shapefile_writer(workspace, out_fc_name, shape_type, fields, spatial_ref):
+    return shapefile_writer.ShapefileWriter(
+        os.path.join(workspace, out_fc_name), shape_type, fields, spatial_ref.exportToString())
+
+def insert_points(cursor, x, y, z, sign, index):
+    """Zapis tablic x, y, z do kursora partiami (lub calych tablic do shapefile)"""
+    if isinstance(cursor, shapefile_writer.ShapefileWriter):
+        cursor.write_points(x, y, z, {FLD_LAYER: sign, FLD_INDEX: index})
+        return
+    for x_batch, y_batch, z_batch in nmt_asc.iter_batches((x, y, z)):
+        for x_i, y_i, z_i in zip(
+            nmt_asc.to_list(x_batch),
+            nmt_asc.to_list(y_batch),
+            nmt_asc.to_list(z_batch)):
+            cursor.insertRow(((x_i, y_i), z_i, sign, index))
+
+def get_shape_rings(shape):
+    """Pierscienie poligonu arcpy jako lista tablic wierzcholkow (n, 2)"""
+    rings = []
+    for part in shape:
+        ring = []
+        # None rozdziela pierscienie wewnetrzne czesci poligonu
+        for point in list(part) + [None]:
+            if point:
+                ring.append((point.X, point.Y))
+            elif ring:
+                rings.append(np.array(ring))
+                ring = []
+    return rings
+
+def get_index_area_outlines(index_area_fc):
+    """
+    Slownik: ujednolicone godlo -> obrys ze skorowidza (nmt_geometry.SheetOutline).
+    Arkusze w siatce geograficznej nie sa w ukladzie 92 prostokatami - ich prostokaty
+    otaczajace zachodza na sasiednie godla, dlatego zachowywany jest caly obrys.
+    """
+    index_area_outlines = {}
+    with arcpy.da.SearchCursor(index_area_fc, [FLD_INDEX, FLD_SHAPE]) as search_cursor:
+        for index, shape in search_cursor:
+            if index is None or shape is None:
+                continue
+            rings = get_shape_rings(shape)
+            if rings:
+                index_area_outlines[unify_index(index)] = nmt_geometry.SheetOutline(rings, EPSILON)
+
+    return index_area_outlines
+
+def create_index_area_fc(index_area_fc, spatial_ref_92):
+    """Pusty skorowidz godel w pamieci (gdy nie podano pliku skorowidza)"""
+    arcpy.CreateFeatureclass_management(
+        MEM_WORKSPACE,
+        MEM_NMT_INDEX_AREA,
+        'POLYGON',
+        '#',
+        'DISABLED',
+        'DISABLED',
+        spatial_ref_92)
+    arcpy.AddField_management(index_area_fc, FLD_INDEX, 'TEXT', '#', '#', 30)
 
-    return extent.get_line_type()
+@instrumentation.trace()
+def add_decoded_index_areas(index_area_fc, indexes, spatial_ref_92):
+    """
+    Dodawanie do skorowidza obrysow godel, ktorych w nim brakuje.
+    Obrysy wyliczane sa z samego godla (nmt_godlo), bez zlaczenia przestrzennego.
+    """
+    index_area_outlines = get_index_area_outlines(index_area_fc)
+    added_count = 0
+    with arcpy.da.InsertCursor(index_area_fc, [FLD_SHAPE, FLD_INDEX]) as insert_cursor:
+        for index in sorted(indexes):
+            if unify_index(index) in index_area_outlines:
+                continue
+            try:
+                outline = nmt_godlo.get_sheet_outline(index)
+            except ValueError:
+                add_arcpy_message(f"{index} - nie rozpoznano godla, brak obrysu arkusza", type=MSG_WARNING)
+                continue
+            polygon = arcpy.Polygon(arcpy.Array([arcpy.Point(x, y) for x, y in outline]), spatial_ref_92)
+            insert_cursor.insertRow((polygon, index))
+            added_count += 1
+
+    if added_count:
+        add_arcpy_message(f"dodano {added_count} obrysow godel wyliczonych z godla")
+
+def get_extent_bounds(extent):
+    return extent.XMin, extent.YMin, extent.XMax, extent.YMax
+
+def get_clip_area_bounds(clip_area_fc, spatial_ref_92):
+    """(x_min, y_min, x_max, y_max) obszaru zainteresowania w ukladzie 92 lub None, gdy obszar jest pusty"""
+    with arcpy.da.SearchCursor(clip_area_fc, [FLD_SHAPE], spatial_reference=spatial_ref_92) as search_cursor:
+        extents = [get_extent_bounds(shape.extent) for shape, in search_cursor if shape is not None]
+    if not extents:
+        return None
+    return (
+        min(bounds[0] for bounds in extents),
+        min(bounds[1] for bounds in extents),
+        max(bounds[2] for bounds in extents),
+        max(bounds[3] for bounds in extents))
+
+@instrumentation.trace()
+def get_catalog_asc_files_dict(catalog_path, tbd_folder, clip_area_fc, spatial_ref_92):
+    """
+    Slownik plikow ASC z katalogu SQLite (nmt_catalog). Katalog aktualizowany jest
+    tylko w folderach ze zmieniona data modyfikacji, zwracane sa tylko pliki godel
+    przecinajacych zasieg obszaru zainteresowania (oraz nierozpoznanych godel).
+    """
+    with nmt_catalog.Catalog(catalog_path) as catalog:
+        scanned, unchanged, removed = catalog.update(tbd_folder)
+        add_arcpy_message(
+            f"katalog plikow {catalog_path}: przeszukano {scanned} folderow, "
+            f"bez zmian {unchanged}, usunieto {removed}")
+        asc_files_dict = catalog.get_asc_files_dict(tbd_folder, get_clip_area_bounds(clip_area_fc, spatial_ref_92))
+    instrumentation.add_counts(scanned=scanned, unchanged=unchanged, files=len(asc_files_dict))
+    return asc_files_dict
+
+@instrumentation.trace()
+def get_clip_area_indexes(index_area_fc, clip_area_fc, spatial_ref_92):
+    """
+    Ujednolicone godla ze skorowidza, ktorych obrysy przecinaja obszar zainteresowania.
+    Najpierw porownanie prostokatow (zasieg obszaru i obrysu), dopiero potem test geometrii.
+    """
+    with arcpy.da.SearchCursor(clip_area_fc, [FLD_SHAPE], spatial_reference=spatial_ref_92) as search_cursor:
+        clip_shapes = [
+            (get_extent_bounds(shape.extent), shape)
+            for shape, in search_cursor
+            if shape is not None]
+    if not clip_shapes:
+        return set()
+
+    clip_bounds = (
+        min(bounds[0] for bounds, _ in clip_shapes),
+        min(bounds[1] for bounds, _ in clip_shapes),
+        max(bounds[2] for bounds, _ in clip_shapes),
+        max(bounds[3] for bounds, _ in clip_shapes))
+
+    clip_area_indexes = set()
+    with arcpy.da.SearchCursor(index_area_fc, [FLD_INDEX, FLD_SHAPE]) as search_cursor:
+        for index, shape in search_cursor:
+            if index is None or shape is None:
+                continue
+            sheet_bounds = get_extent_bounds(shape.extent)
+            if not nmt_geometry.bounds_intersect(sheet_bounds, clip_bounds, EPSILON):
+                continue
+            for bounds, clip_shape in clip_shapes:
+                if nmt_geometry.bounds_intersect(sheet_bounds, bounds, EPSILON) and not clip_shape.disjoint(shape):
+                    clip_area_indexes.add(unify_index(index))
+                    break
+
+    return clip_area_indexes
+
+@instrumentation.trace()
+def read_breaklines(lines_fc):
+    """Wierzcholki linii ze zbioru jako tablice x, y oraz offsets czesci linii"""
+    with arcpy.da.SearchCursor(lines_fc, [FLD_SHAPE_WKB]) as search_cursor:
+        x, y, _, offsets, _ = nmt_geometry.read_wkb_lines(wkb for wkb, in search_cursor if wkb is not None)
+    return x, y, offsets
+
+@instrumentation.trace()
+def remove_duplicate_points(point_store):
+    """Usuwanie duplikatow punktow na stykach godel (w odleglosci do EPSILON, rowniez po obu stronach granicy oczka siatki)"""
+    add_arcpy_message("Usuwanie zduplikowanych punktów na stykach godeł...", True)
+    unique = nmt_geometry.get_unique_points_mask(point_store.x, point_store.y, EPSILON)
+    removed_count = len(unique) - np.count_nonzero(unique)
+    add_arcpy_message(f"usunieto {removed_count} z {len(unique)} punktow")
+    instrumentation.add_counts(points=len(unique), removed=int(removed_count))
+    point_store.compress(unique)
+
+@instrumentation.trace()
+def thin_points(point_store, cell_size, z_tolerance, breaklines):
+    """
+    Przerzedzanie punktow na siatce XY o oczku cell_size:
+    w oczkach o roznicy wysokosci do z_tolerance zostaje jeden punkt.
+    Zachowywane sa koty wysokosciowe oraz punkty w poblizu linii nieciaglosci.
+    """
+    add_arcpy_message(f"Przerzedzanie punktow (oczko {cell_size} m, tolerancja Z {z_tolerance} m)...", True)
+    keep = point_store.get_sign_mask(THINNING_KEEP_SIGNS)
+    # wspolrzedne dekodowane raz na caly etap
+    with point_store.decoded():
+        if breaklines is not None:
+            line_x, line_y, line_offsets = breaklines
+            keep |= nmt_geometry.get_near_lines_mask(
+                point_store.x, point_store.y, line_x, line_y, line_offsets, cell_size)
+
+        thinned, max_deviation = nmt_geometry.get_thinning_mask(
+            point_store.x, point_store.y, point_store.z, cell_size, z_tolerance, keep)
+
+    point_count = len(point_store)
+    thinned_count = np.count_nonzero(thinned)
+    reduction = 100.0 * (point_count - thinned_count) / point_count if point_count else 0.0
+    add_arcpy_message(
+        f"usunieto {point_count - thinned_count} z {point_count} punktow ({reduction:.1f}%), "
+        f"maksymalna odchylka Z: {max_deviation:.3f} m")
+    instrumentation.add_counts(points=point_count, removed=int(point_count - thinned_count))
+    point_store.compress(thinned)
+
+@instrumentation.trace()
+def read_clip_area_polygons(clip_area_fc, spatial_ref_92):
+    """Poligony obszaru zainteresowania w PUWG-1992 jako listy pierscieni (tablice wierzcholkow)"""
+    polygons = []
+    with arcpy.da.SearchCursor(clip_area_fc, [FLD_SHAPE], spatial_reference=spatial_ref_92) as search_cursor:
+        for shape, in search_cursor:
+            if shape is None:
+                continue
+            rings = get_shape_rings(shape)
+            if rings:
+                polygons.append(rings)
+    return polygons
+
+@instrumentation.trace()
+def write_points(
+        point_store, mask, workspace, out_fc_name, template_fc, spatial_ref, transformer=None, order=None):
+    """
+    Zapis punktow ze store (wybranych maska) do nowego zbioru, opcjonalnie z reprojekcja wsadowa
+    i w kolejnosci indeksow order (nmt_order.CurveOrder.indices).
+    Shapefile zapisywany jest bezposrednio z tablic, w bazie danych kursorem.
+    """
+    instrumentation.add_counts(points=int(np.count_nonzero(mask)))
+    batches = point_store.iter_batches(REPROJECT_BATCH_SIZE, mask, order)
+    if is_shapefile(out_fc_name):
+        with create_shapefile_writer(
+                workspace, out_fc_name, shapefile_writer.SHAPE_POINTZ, SHP_POINT_FIELDS, spatial_ref) as writer:
+            for x, y, z, signs, indexes in batches:
+                if transformer is not None:
+                    x, y = transformer.transform(x, y)
+                writer.write_points(x, y, z, {FLD_LAYER: signs, FLD_INDEX: indexes})
+        return
+
+    create_output_fc(workspace, out_fc_name, 'POINT', template_fc, spatial_ref)
+    out_fc = os.path.join(workspace, out_fc_name)
+    with arcpy.da.InsertCursor(out_fc, [FLD_SHAPE_XY, FLD_SHAPE_Z, FLD_LAYER, FLD_INDEX]) as insert_cursor:
+        for x, y, z, signs, indexes in batches:
+            if transformer is not None:
+                x, y = transformer.transform(x, y)
+            for x_i, y_i, z_i, sign, index in zip(x.tolist(), y.tolist(), z.tolist(), signs, indexes):
+                insert_cursor.insertRow(((x_i, y_i), z_i, sign, index))
+
+@instrumentation.trace()
+def get_point_order(point_store, mask, curve, workspace):
+    """
+    Kolejnosc zapisu punktow wg krzywej Hilberta lub Mortona (bliskie punkty blisko w pliku).
+    Przy duzej liczbie punktow sortowanie zewnetrzne w plikach tymczasowych.
+    """
+    temp_folder = workspace if utils.is_workspace_folder(workspace) else None
+    order = nmt_order.CurveOrder(point_store.x, point_store.y, curve, mask, temp_folder=temp_folder)
+    instrumentation.add_counts(points=len(order), external=order.is_external)
+    return order
+
+def sort_line_rows(rows, curve):
+    """Wiersze (wkb, ...) linii posortowane wg krzywej Hilberta lub Mortona dla srodkow ich zasiegow"""
+    x, y, _, offsets, part_counts = nmt_geometry.read_wkb_lines(row[0] for row in rows)
+    line_offsets = offsets[np.r_[0, np.cumsum(part_counts)]]
+    x_min, y_min, x_max, y_max = nmt_geometry.get_line_bounds(x, y, line_offsets)
+    order = nmt_order.CurveOrder((x_min + x_max) / 2, (y_min + y_max) / 2, curve, max_memory_mb=None)
+    return [rows[i] for i in order.indices.tolist()]
+
+@instrumentation.trace()
+def write_dem(dem_path, point_store, clip_area_fc, spatial_ref_92, cell_size, statistic):
+    """
+    Zapis NMT jako rastra (ESRI ASCII GRID .asc lub float32 .flt) w zasiegu obszaru zainteresowania.
+    Wartosc oczka to srednia/min/max wysokosci punktow, bez interpolacji ArcGIS.
+    """
+    add_arcpy_message(f"Zapisywanie rastra NMT (oczko {cell_size} m, {statistic}): {dem_path}...", True)
+    clip_extent = arcpy.Describe(clip_area_fc).extent.projectAs(spatial_ref_92)
+    dem = nmt_dem.DemGrid(get_extent_bounds(clip_extent), cell_size, statistic, os.path.dirname(dem_path) or None)
+    try:
+        point_count = dem.add_points(point_store.x, point_store.y, point_store.z)
+        dem.write(dem_path)
+    finally:
+        dem.close()
+
+    with open(os.path.splitext(dem_path)[0] + ".prj", "w") as prj_file:
+        prj_file.write(spatial_ref_92.exportToString())
+    add_arcpy_message(f"raster {dem.columns} x {dem.rows} oczek z {point_count} punktow")
+
+def insert_lines(cursor, line_data, sign, index):
+    """
+    Zapis linii z tablic (nmt_asc.LineData) do kursora z polem SHAPE@WKB
+    (lub do shapefile_writer.ShapefileWriter).
+    Geometrie tworzone sa dopiero przy zapisie, bez obiektow arcpy.Point.
+    Zwraca typy linii (pozioma/pionowa).
+    """
+    line_types = nmt_geometry.get_line_types(line_data.x, line_data.y, line_data.offsets, EPSILON)
+    if isinstance(cursor, shapefile_writer.ShapefileWriter):
+        cursor.write_lines(
+            line_data.x, line_data.y, line_data.z, line_data.offsets,
+            records={FLD_LAYER: sign, FLD_INDEX: index, FLD_WARNINGS: line_types})
+        return line_types
+
+    wkb_lines = nmt_geometry.iter_linestring_z_wkb(line_data.x, line_data.y, line_data.z, line_data.offsets)
+
+    for wkb, line_type in zip(wkb_lines, line_types):
+        cursor.insertRow((wkb, sign, index, line_type))
+
+    return line_types
+
+def simplify_line_data(line_data, xy_tolerance, z_tolerance):
+    """Upraszczanie linii (Douglas-Peucker 3D) na tablicach wierzcholkow wszystkich linii pliku"""
+    mask = nmt_geometry.get_simplified_mask(
+        line_data.x, line_data.y, line_data.z, line_data.offsets, xy_tolerance, z_tolerance)
+    return nmt_asc.LineData(
+        line_data.x[mask],
+        line_data.y[mask],
+        line_data.z[mask],
+        nmt_geometry.get_masked_offsets(line_data.offsets, mask),
+        line_data.end_line_numbers)
+
+def add_line_type_warnings(asc_file_path, line_data, line_types):
+    for line_type, end_line_number in zip(line_types, nmt_asc.to_list(line_data.end_line_numbers)):
+        if line_type:
+            add_arcpy_message(
+                f"{asc_file_path} - odnaleziona horyzontalna lub wertykalna linia (linia nr {end_line_number})",
+                type=MSG_WARNING
+            )
+
+def clip_lines(line_data, sign, line_types, outline):
+    """
+    Linie przyciete do obrysu godla (nmt_geometry.SheetOutline: prostokat albo poligon arkusza
+    w siatce geograficznej) jako lista (wkb, znak, uwagi).
+    Wysokosc w punktach przeciecia interpolowana, linia wychodzaca i wracajaca do godla
+    staje sie wieloczesciowa (jak w Clip_analysis). Bez obrysu linie nie sa przycinane.
+    """
+    if outline is None:
+        wkb_lines = nmt_geometry.iter_linestring_z_wkb(line_data.x, line_data.y, line_data.z, line_data.offsets)
+        return [(wkb, sign, line_type) for wkb, line_type in zip(wkb_lines, line_types)]
+
+    x, y, z, offsets, part_counts = outline.clip_lines(
+        line_data.x, line_data.y, line_data.z, line_data.offsets, EPSILON)
+    inside = part_counts > 0
+    wkb_lines = nmt_geometry.iter_multilinestring_z_wkb(x, y, z, offsets, part_counts[inside])
+    return [(wkb, sign, line_type) for wkb, line_type in zip(wkb_lines, line_types[inside])]
+
+def iter_row_batches(cursor, batch_size=REPROJECT_BATCH_SIZE):
+    while True:
+        rows = list(itertools.islice(cursor, batch_size))
+        if not rows:
+            return
+        yield rows
+
+def create_output_fc(workspace, out_fc_name, geometry_type, template_fc, spatial_ref):
+    arcpy.CreateFeatureclass_management(
+        workspace,
+        out_fc_name,
+        geometry_type,
+        template_fc,
+        'DISABLED',
+        'ENABLED',
+        spatial_ref)
 
-   
+@instrumentation.trace()
+def copy_lines(lines_lyr, workspace, out_fc_name, template_fc, spatial_ref, transformer=None, output_order=None):
+    """
+    Kopiowanie linii (wybranych w warstwie), opcjonalnie z reprojekcja wsadowa wierzcholkow
+    i w kolejnosci krzywej output_order (nmt_order.CURVES).
+    Shapefile zapisywany jest z tablic wierzcholkow (geometrie jako WKB), bez kursora wstawiania.
+    """
+    fields = [FLD_LAYER, FLD_INDEX, FLD_WARNINGS]
+    if not is_shapefile(out_fc_name) and transformer is None and not output_order:
+        arcpy.CopyFeatures_management(lines_lyr, out_fc_name)
+        return
+
+    if is_shapefile(out_fc_name):
+        output = create_shapefile_writer(
+            workspace, out_fc_name, shapefile_writer.SHAPE_POLYLINEZ, SHP_LINE_FIELDS, spatial_ref)
+    else:
+        create_output_fc(workspace, out_fc_name, 'POLYLINE', template_fc, spatial_ref)
+        output = arcpy.da.InsertCursor(out_fc_name, [FLD_SHAPE_WKB] + fields)
+
+    with arcpy.da.SearchCursor(lines_lyr, [FLD_SHAPE_WKB] + fields) as search_cursor, output:
+        source_rows = search_cursor
+        if output_order:
+            # linii jest znacznie mniej niz punktow, sortowane sa w pamieci
+            source_rows = iter(sort_line_rows([row for row in search_cursor if row[0] is not None], output_order))
+        for rows in iter_row_batches(source_rows):
+            rows = [row for row in rows if row[0] is not None]
+            if not rows:
+                continue
+            x, y, z, offsets, part_counts = nmt_geometry.read_wkb_lines(row[0] for row in rows)
+            if transformer is not None:
+                x, y = transformer.transform(x, y)
+            if isinstance(output, shapefile_writer.ShapefileWriter):
+                records = dict(zip(fields, zip(*(row[1:] for row in rows))))
+                output.write_lines(x, y, z, offsets, part_counts, records)
+                continue
+            wkb_lines = nmt_geometry.iter_multilinestring_z_wkb(x, y, z, offsets, part_counts)
+            for wkb, row in zip(wkb_lines, rows):
+                output.insertRow((wkb, *row[1:]))
+
+def write_polygons_shapefile(polygons_fc, workspace, out_fc_name, spatial_ref, transformer=None):
+    """Zapis obrysow do shapefile z tablic pierscieni (kazdy pierscien jako czesc)"""
+    fields = [FLD_INDEX, FLD_INDEX_UNIFIED]
+    x, y, z, offsets, part_counts = [], [], [], [0], []
+    records = {FLD_INDEX: [], FLD_INDEX_UNIFIED_DBF: []}
+    with arcpy.da.SearchCursor(polygons_fc, [FLD_SHAPE] + fields) as search_cursor:
+        for shape, index, index_unified in search_cursor:
+            if shape is None:
+                continue
+            # None rozdziela pierscienie wewnetrzne czesci poligonu
+            rings = []
+            for part in shape:
+                ring = []
+                for point in list(part) + [None]:
+                    if point:
+                        ring.append((point.X, point.Y, point.Z or 0.0))
+                    elif ring:
+                        if ring[0] != ring[-1]:
+                            ring.append(ring[0])
+                        rings.append(ring)
+                        ring = []
+            for ring in rings:
+                for point_x, point_y, point_z in ring:
+                    x.append(point_x)
+                    y.append(point_y)
+                    z.append(point_z)
+                offsets.append(len(x))
+            part_counts.append(len(rings))
+            records[FLD_INDEX].append(index)
+            records[FLD_INDEX_UNIFIED_DBF].append(index_unified)
+
+    if transformer is not None and x:
+        x, y = transformer.transform(x, y)
+    with create_shapefile_writer(
+            workspace, out_fc_name, shapefile_writer.SHAPE_POLYGONZ, SHP_ENVELOPE_FIELDS, spatial_ref) as writer:
+        writer.write_lines(x, y, z, offsets, part_counts, records)
+
+@instrumentation.trace()
+def copy_polygons(polygons_fc, workspace, out_fc_name, spatial_ref, transformer=None):
+    """Kopiowanie obrysow, opcjonalnie z reprojekcja wierzcholkow (kilka obiektow na godlo)"""
+    if is_shapefile(out_fc_name):
+        write_polygons_shapefile(polygons_fc, workspace, out_fc_name, spatial_ref, transformer)
+        return
+    if transformer is None:
+        arcpy.CopyFeatures_management(polygons_fc, out_fc_name)
+        return
+
+    create_output_fc(workspace, out_fc_name, 'POLYGON', polygons_fc, spatial_ref)
+    fields = [FLD_INDEX, FLD_INDEX_UNIFIED]
+    with arcpy.da.SearchCursor(polygons_fc, [FLD_SHAPE] + fields) as search_cursor, \
+            arcpy.da.InsertCursor(out_fc_name, [FLD_SHAPE] + fields) as insert_cursor:
+        for shape, *values in search_cursor:
+            if shape is None:
+                continue
+            # None rozdziela pierscienie wewnetrzne czesci poligonu
+            parts = [list(part) for part in shape]
+            points = [point for part in parts for point in part if point]
+            x, y = transformer.transform([point.X for point in points], [point.Y for point in points])
+            projected = iter(zip(x.tolist(), y.tolist(), [point.Z or 0.0 for point in points]))
+
+            polygon_parts = arcpy.Array()
+            for part in parts:
+                polygon_part = arcpy.Array()
+                for point in part:
+                    polygon_part.add(arcpy.Point(*next(projected)) if point else None)
+                polygon_parts.add(polygon_part)
+            insert_cursor.insertRow((arcpy.Polygon(polygon_parts, spatial_ref, True), *values))
+
+@instrumentation.trace()
 def delete_lines_on_envelopes(nmt_lines_fc, nmt_envelopes_fc, spatial_ref_92):
     """
     Usuwanie lini wzdluz krawedzi obrysow:
@@ -314,6 +823,87 @@ def delete_lines_on_envelopes(nmt_lines_fc, nmt_envelopes_fc, spatial_ref_92):
 
     return
 
+@instrumentation.trace()
+def delete_lines_on_envelopes_analytic(nmt_lines_fc, nmt_envelopes_fc, spatial_ref_92):
+    """
+    Usuwanie lini wzdluz krawedzi obrysow bez narzedzi geoprocessingu
+    (wynik jak w delete_lines_on_envelopes):
+    * linie podzialu wyznaczane bezposrednio ze wspolrzednych obrysow (prostokaty)
+    * wszystkie odcinki linii testowane wektorowo wzgledem linii podzialu
+    * linie blizej niz ENVELOPE_EDGE_DISTANCE od linii podzialu sa usuwane,
+      a ich odcinki spoza bufora wracaja do zbioru jako "splitted"
+    Obrysy arkuszy w siatce geograficznej nie sa w ukladzie 92 prostokatami - wtedy
+    linie podzialu wyznacza geoprocessing (delete_lines_on_envelopes).
+    """
+    envelopes = []
+    with arcpy.da.SearchCursor(nmt_envelopes_fc, [FLD_SHAPE]) as search_cursor:
+        for shape, in search_cursor:
+            rings = get_shape_rings(shape) if shape is not None else []
+            if not rings:
+                continue
+            outline = nmt_geometry.SheetOutline(rings, EPSILON)
+            if not outline.is_rectangle:
+                add_arcpy_message(
+                    "obrysy godel nie sa prostokatami - linie wzdluz krawedzi usuwane geoprocessingiem",
+                    type=MSG_WARNING)
+                delete_lines_on_envelopes(nmt_lines_fc, nmt_envelopes_fc, spatial_ref_92)
+                return
+            envelopes.append(outline.bounds)
+
+    add_arcpy_message("Usuwanie linii wzdłuż krawędzi skorowidzów...", True)
+
+    # wszystkie czesci linii jako jedna tablica wierzcholkow
+    line_oids = []
+    line_parts = []
+    attributes = {}
+    with arcpy.da.SearchCursor(nmt_lines_fc, ["OID@", FLD_SHAPE_WKB, FLD_LAYER, FLD_INDEX]) as search_cursor:
+        for oid, wkb, sign, index in search_cursor:
+            if wkb is None:
+                continue
+            attributes[oid] = (sign, index)
+            for part in nmt_geometry.read_wkb_line_parts(wkb):
+                line_oids.append(oid)
+                line_parts.append(part)
+
+    if not line_parts or not envelopes:
+        return
+
+    vertices = np.concatenate(line_parts)
+    offsets = np.cumsum([0] + [len(part) for part in line_parts])
+    line_oids = np.array(line_oids)
+
+    keep_lines, segment_starts, segment_line_ids = nmt_geometry.split_lines_on_seams(
+        vertices[:, 0],
+        vertices[:, 1],
+        offsets,
+        envelopes,
+        ENVELOPE_EDGE_DISTANCE,
+        EPSILON,
+        line_groups=line_oids)
+
+    # usun linie przecinajace bufor
+    removed_oids = set(line_oids[~keep_lines].tolist())
+    with arcpy.da.UpdateCursor(nmt_lines_fc, ["OID@"]) as update_cursor:
+        for row in update_cursor:
+            if row[0] in removed_oids:
+                update_cursor.deleteRow()
+
+    # odcinki spoza bufora jako linie 2-wierzcholkowe
+    segment_vertices = vertices[np.column_stack((segment_starts, segment_starts + 1)).ravel()]
+    segment_offsets = np.arange(0, len(segment_vertices) + 1, 2)
+    segments_wkb = nmt_geometry.iter_linestring_z_wkb(
+        segment_vertices[:, 0], segment_vertices[:, 1], segment_vertices[:, 2], segment_offsets)
+
+    with arcpy.da.InsertCursor(
+        nmt_lines_fc,
+        [FLD_SHAPE_WKB, FLD_LAYER, FLD_INDEX, FLD_WARNINGS]) as insert_cursor:
+        for wkb, oid in zip(segments_wkb, line_oids[segment_line_ids].tolist()):
+            sign, index = attributes[oid]
+            insert_cursor.insertRow((wkb, sign, index, 'splitted'))
+
+    return
+
+@instrumentation.trace()
 def extract_shp_from_tbd(
     tbd_folder_in,
     workspace_out, 
@@ -323,7 +913,25 @@ def extract_shp_from_tbd(
     nmt_index_area_in,
     import_points, 
     import_lines,
-    export_raw_data):
+    export_raw_data,
+    max_workers=1,
+    analytic_seams=True,
+    cache_folder=None,
+    cache_max_size_mb=None,
+    checkpoint_folder=None,
+    thin_cell_size=None,
+    thin_z_tolerance=None,
+    simplify_xy_tolerance=None,
+    simplify_z_tolerance=None,
+    dem_path=None,
+    dem_cell_size=DEM_CELL_SIZE,
+    dem_statistic=nmt_dem.STAT_MEAN,
+    error_report_path=None,
+    prefetch_sheets=nmt_sheets.PREFETCH_SHEETS,
+    prefetch_max_memory_mb=None,
+    catalog_path=None,
+    output_order=None,
+    quantize_coordinates=False):
 
     # initialization
     set_arcpy_environment(workspace_out, spatial_ref_out)
@@ -337,7 +945,6 @@ def extract_shp_from_tbd(
     nmt_points_temp_fc = f"{MEM_WORKSPACE}\\{MEM_NMT_POINTS_TEMP}"
     nmt_lines_temp_fc = f"{MEM_WORKSPACE}\\{MEM_NMT_LINES_TEMP}"
     nmt_envelopes_temp_fc = f"{MEM_WORKSPACE}\\{MEM_NMT_ENVELOPES_TEMP}"
-    nmt_lines_temp_clip_fc = f"{MEM_WORKSPACE}\\{MEM_NMT_LINES_TEMP_CLIP}"
     # nmtBridgesTempFC = r'in_memory\nmtBridgesTemp'
 
     nmt_points_fc = f"{MEM_WORKSPACE}\\{MEM_NMT_POINTS}"
@@ -348,29 +955,35 @@ def extract_shp_from_tbd(
 
     # nmtPolylinesIntersectFC = r'in_memory\nmtLinesIntersect'
     
+    # słownik nazw plikow oraz ich sciezek
+    if catalog_path:
+        asc_files_dict = get_catalog_asc_files_dict(catalog_path, tbd_folder_in, clip_area_in, spatial_ref_92)
+    else:
+        asc_files_dict = nmt_sheets.get_asc_files_dict(tbd_folder_in)
+
+    # ze wszystkich plikow .ASC wybieramy tylko unikalne godla
+    indexes = get_indexes_set(asc_files_dict)
+
     # Przygotowywanie zbiorów w pamieci oraz odpowiadajacych im warstw
     # CLIP AREA
     arcpy.CopyFeatures_management(clip_area_in, clip_area_fc)
     
     # NMT INDEX AREA
-    arcpy.CopyFeatures_management(nmt_index_area_in, nmt_index_area_fc)
+    # skorowidz jest opcjonalny, brakujace obrysy wyliczane sa z godel
+    if nmt_index_area_in:
+        arcpy.CopyFeatures_management(nmt_index_area_in, nmt_index_area_fc)
+    else:
+        create_index_area_fc(nmt_index_area_fc, spatial_ref_92)
+    add_decoded_index_areas(nmt_index_area_fc, indexes, spatial_ref_92)
 
     # aby wyszkuiwac po godle nalezy stworzyc ujednolicony jego format:
     # * bez myslnikow
     # * male litery
     # * tylko indels godla, bez przedrostka "nmt"
     arcpy.AddField_management(nmt_index_area_fc, FLD_INDEX_UNIFIED, 'TEXT', '#', '#', 15)
-    code = """def unify_symbol(symbol):
-    symbol_unified = (("").join(symbol.split("-"))).lower()
-    if symbol_unified.startswith("nmt"):
-        symbol_unified = symbol_unified.split("nmt")
-    return symbol_unified"""
-    arcpy.CalculateField_management(
-        nmt_index_area_fc,
-        FLD_INDEX_UNIFIED,
-        f"unify_symbol(!{FLD_INDEX}!)",
-        "PYTHON3",
-        code)
+    with arcpy.da.UpdateCursor(nmt_index_area_fc, [FLD_INDEX, FLD_INDEX_UNIFIED]) as update_cursor:
+        for index, _ in update_cursor:
+            update_cursor.updateRow((index, unify_index(index) if index else None))
 
     # Tworzenie tymczasowych zbiorow w pamieci do przechowywania danych z aktualnie przetwarzanego godla
     # NMT POINTS TEMP
@@ -412,15 +1025,8 @@ def extract_shp_from_tbd(
 
     # Tworzenie zbiorow w pamieci do przwchowywania wszystkich danych
     # szablon z tymczasowych TEMP
-    # NMT POINTS 
-    arcpy.CreateFeatureclass_management(
-        MEM_WORKSPACE,
-        MEM_NMT_POINTS,
-        'POINT',
-        nmt_points_temp_fc,
-        'DISABLED', 
-        'ENABLED',
-        spatial_ref_92)
+    # punkty przechowywane sa w kolumnowym nmt_store.PointStore,
+    # zbior punktow tworzony jest dopiero przy zapisie wynikow
 
     # NMT LINES    
     arcpy.CreateFeatureclass_management(
@@ -443,7 +1049,8 @@ def extract_shp_from_tbd(
         spatial_ref_92)
 
     # RAW DATA
-    if export_raw_data:
+    # (shapefile zapisywane bezposrednio przez shapefile_writer)
+    if export_raw_data and not is_shapefile(out_fc_names[OUT_RAW_POINTS]):
         arcpy.CreateFeatureclass_management(
             workspace_out,
             out_fc_names[OUT_RAW_POINTS],
@@ -463,124 +1070,139 @@ def extract_shp_from_tbd(
 
     # Tworzenie warstw
     arcpy.MakeFeatureLayer_management(nmt_index_area_fc, LYR_INDEX_AREA)
-    arcpy.MakeFeatureLayer_management(nmt_points_fc, LYR_NMT_POINTS)
     arcpy.MakeFeatureLayer_management(nmt_lines_fc, LYR_NMT_LINES)
 
+    # obrysy godel do wyboru punktow i linii wewnatrz arkusza
+    sheet_outlines = get_index_area_outlines(nmt_index_area_fc)
+    polygon_outline_count = sum(not outline.is_rectangle for outline in sheet_outlines.values())
+    if polygon_outline_count:
+        add_arcpy_message(
+            f"{polygon_outline_count} obrysow godel nie jest prostokatami (arkusze w siatce geograficznej) - "
+            "punkty i linie przycinane do poligonow obrysow", type=MSG_WARNING)
+
     # Tworzenie kursorow do zbiorow tymczasowych
-    points_temp_cursor = arcpy.da.InsertCursor(
-        nmt_points_temp_fc,
-        [FLD_SHAPE_XY, FLD_SHAPE_Z, FLD_LAYER, FLD_INDEX])
-    lines_temp_cursor = arcpy.da.InsertCursor(
-        nmt_lines_temp_fc,
-        [FLD_SHAPE, FLD_LAYER, FLD_INDEX, FLD_WARNINGS])
+    raw_points_cursor = None
+    raw_lines_cursor = None
+    if export_raw_data and import_points:
+        if is_shapefile(out_fc_names[OUT_RAW_POINTS]):
+            raw_points_cursor = create_shapefile_writer(
+                workspace_out, out_fc_names[OUT_RAW_POINTS], shapefile_writer.SHAPE_POINTZ,
+                SHP_POINT_FIELDS, spatial_ref_92)
+        else:
+            raw_points_cursor = arcpy.da.InsertCursor(
+                out_fc_names[OUT_RAW_POINTS],
+                [FLD_SHAPE_XY, FLD_SHAPE_Z, FLD_LAYER, FLD_INDEX])
+    if export_raw_data and import_lines:
+        if is_shapefile(out_fc_names[OUT_RAW_LINES]):
+            raw_lines_cursor = create_shapefile_writer(
+                workspace_out, out_fc_names[OUT_RAW_LINES], shapefile_writer.SHAPE_POLYLINEZ,
+                SHP_LINE_FIELDS, spatial_ref_92)
+        else:
+            raw_lines_cursor = arcpy.da.InsertCursor(
+                out_fc_names[OUT_RAW_LINES],
+                [FLD_SHAPE_WKB, FLD_LAYER, FLD_INDEX, FLD_WARNINGS])
     # envelopeCursor = arcpy.da.InsertCursor(nmtEnvelopesTempFC, [FIELD_SHAPE, FIELD_INDEX])
 
-    # słownik nazw plikow oraz ich sciezek
-    asc_files_dict = get_asc_files_dict(tbd_folder_in)
 
-    # ze wszystkich plikow .ASC wybieramy tylko unikalne godla
-    indexes = get_indexes_set(asc_files_dict)
-
-    extent = Extent()
-    arcpy_array = arcpy.Array()
+    # plan: pomijanie godel poza obszarem zainteresowania jeszcze przed odczytem plikow,
+    # godla spoza skorowidza sa odczytywane (brak obrysu do porownania)
+    add_arcpy_message("Wybieranie godel przecinajacych obszar zainteresowania...", True)
+    clip_area_indexes = get_clip_area_indexes(nmt_index_area_fc, clip_area_fc, spatial_ref_92)
+    planned_indexes = set(
+        index for index in indexes
+        if unify_index(index) in clip_area_indexes or unify_index(index) not in sheet_outlines)
+    add_arcpy_message(
+        f"do odczytu {len(planned_indexes)} z {len(indexes)} godel, "
+        f"pominieto {len(indexes) - len(planned_indexes)} godel poza obszarem zainteresowania")
+    indexes = planned_indexes
+
+    # cache sparsowanych plikow ASC (binarny, mapowany w pamieci)
+    cache = None
+    if cache_folder:
+        cache = nmt_cache.ParseCache(cache_folder, cache_max_size_mb, quantize_coordinates)
+        add_arcpy_message(f"Cache sparsowanych plikow: {cache_folder}", True)
+
+    # zadania dla kolejnych godel w ustalonej kolejnosci,
+    # aby wynik nie zalezal od liczby procesow;
+    # przy kwantyzacji wspolrzedne godel przesylane sa jako int32 w centymetrach
+    tasks = [
+        get_sheet_task(index, asc_files_dict, import_points, import_lines, cache, quantize_coordinates)
+        for index in sorted(indexes)]
+
+    if max_workers > 1:
+        set_multiprocessing_executable()
+        add_arcpy_message(f"Odczyt godel w {max_workers} procesach...", True)
+
+    # punkty kontrolne: wyniki ukonczonych godel zapisywane na dysku,
+    # ponowne uruchomienie pomija godla bez zmian w plikach ASC
+    checkpoint = None
+    if checkpoint_folder:
+        checkpoint = nmt_sheets.SheetCheckpoint(checkpoint_folder)
+        add_arcpy_message(f"Punkty kontrolne: {checkpoint_folder}", True)
+
+    fingerprints = {}
+    if checkpoint:
+        for task in tasks:
+            sheet_outline = sheet_outlines.get(unify_index(task[0]))
+            outline_key = sheet_outline.get_key() if sheet_outline else None
+            fingerprints[task[0]] = checkpoint.get_fingerprint(
+                task, f"{outline_key}|{EPSILON}|{simplify_xy_tolerance}|{simplify_z_tolerance}")
+
+    # godla do odczytu: nieukonczone oraz wszystkie, gdy eksportowane sa dane surowe
+    read_tasks = [
+        task for task in tasks
+        if export_raw_data or not (checkpoint and checkpoint.is_complete(task[0], fingerprints[task[0]]))]
+    # odczyt kolejnych godel w tle, rownolegle z przetwarzaniem biezacego
+    sheets = nmt_sheets.iter_sheets(read_tasks, max_workers, prefetch_sheets, prefetch_max_memory_mb)
+    read_indexes = set(task[0] for task in read_tasks)
+
+    # punkty wewnatrz obrysow (przy kwantyzacji int32 w centymetrach od poczatku godla)
+    point_store = nmt_store.PointStore(quantized=quantize_coordinates)
+    # bledne linie ze wszystkich godel (do raportu)
+    parse_errors = nmt_asc.ParseErrors()
+    nmt_lines_cursor = arcpy.da.InsertCursor(nmt_lines_fc, [FLD_SHAPE_WKB, FLD_LAYER, FLD_INDEX, FLD_WARNINGS])
     index_count = len(indexes)
-    for i, index in enumerate(indexes):
+    for i, task in enumerate(instrumentation.iter_spans(tasks, "sheet")):
+        index = task[0]
         add_arcpy_message(f"Przetwarzanie godla {i+1} z {index_count}: {index}...", True)
 
         index_unified = unify_index(index)
-
-        extent.reset()
-        # ---------------------------------------------------------------------
-        # PUNKTY
-        # ---------------------------------------------------------------------
-        if import_points:
-            add_arcpy_message("Przetwarzanie punktów...", True)
-            for point_sign in POINT_SIGNS:
-                
-                index_key = get_index_key(index, point_sign)
-                if index_key not in asc_files_dict:
-                    continue
-
-                point_asc_file_path = asc_files_dict[index_key]
-                if os.path.exists(point_asc_file_path):
-                    point_asc_file = open(point_asc_file_path, "r")
-
-                    for asc_line in point_asc_file.readlines():
-                        try:  # try nie pogarsza wydajnosci
-                            x, y, z = parse_xyz_line(asc_line)
-                            points_temp_cursor.insertRow(((x, y), z, point_sign, index_unified))
-
-                            # okreslanie min/max do obrysu
-                            extent.update(x, y)
-                        except:
-                            exc_message = f"{point_asc_file_path} - napotkano na blad konwersji linii: {asc_line}"
-                            add_arcpy_message(exc_message, message=MSG_ERROR)
-
-                    add_arcpy_message(point_asc_file_path + ' - przekonwertowano')
-                else:
-                    add_arcpy_message(point_asc_file_path + ' - nie odnaleziono', message=MSG_WARNING)
-
-        # ---------------------------------------------------------------------
-        # POLILINIE i POLIGONY
-        # ---------------------------------------------------------------------
-        # poligony importowane jako polilinie ze wzgledu na poziome i pionowe linie oddzielajace arkusze
-        # linie poziome i pionowe oddzielane w celu poniejszego odfiltrowania
-
-        if import_lines:
-            add_arcpy_message("Przetwarzanie polilini...", separator=True)
-            for line_sign in LINE_SIGNS:
-
-                index_key = get_index_key(index, line_sign)
-                if index_key not in asc_files_dict:
-                    continue
-
-                line_asc_file_path = asc_files_dict[index_key]
-                if os.path.exists(line_asc_file_path):
-                    line_asc_file = open(line_asc_file_path, "r")
-
-                    for iLine, asc_line in enumerate(line_asc_file.readlines()):
-                        try:
-                            if "Start" in asc_line:
-                                # nowy obiekt liniowy
-                                arcpy_array.removeAll()
-                                # extent.reset()
-                            elif "End" in asc_line:
-                                # koniec obiektu
-                                # aby utworzyc polilinie potrzeba wiecej niz 1 wierzcholek
-                                if arcpy_array.count < 2:
-                                    continue
-
-                                # check if extent is horizontal, vertical or none 
-                                line_type = get_line_type(arcpy_array)
-
-                                if line_type:
-                                    add_arcpy_message(
-                                        f"{line_asc_file_path} - odnaleziona horyzontalna lub wertykalna linia (linia nr {iLine+1})",
-                                        type=MSG_WARNING
-                                    )
-
-                                lines_temp_cursor.insertRow(
-                                    (arcpy.Polyline(arcpy_array, spatial_ref_92, True),
-                                    line_sign,
-                                    index_unified,
-                                    line_type))
-                            elif '\n' == asc_line:  
-                                continue      
-                            else:
-                                x, y, z = parse_xyz_line(asc_line)
-                                arcpy_array.add(arcpy.Point(x, y, z))
-
-                                extent.update(x, y)
-                        except:
-                            exc_message = f"{line_asc_file_path} - napotkano na blad w linii {iLine+1}: {asc_line}"
-                            add_arcpy_message(exc_message, type=MSG_ERROR)
-
-                    add_arcpy_message(f"{line_asc_file_path} - przekonwertowano")
-                else:
-                    add_arcpy_message(f"{line_asc_file_path} - nie odnaleziono", message=MSG_WARNING)
+        sheet_outline = sheet_outlines.get(index_unified)
+
+        result = None
+        if checkpoint:
+            result = checkpoint.load(index, fingerprints[index])
+            if result:
+                add_arcpy_message("godlo wczytane z punktu kontrolnego")
+
+        with instrumentation.span("read_sheet", index=index) as stage:
+            sheet = next(sheets) if index in read_indexes else None
+            if result is None and sheet is None:
+                # uszkodzony punkt kontrolny godla pominietego przy odczycie
+                add_arcpy_message("nie mozna wczytac punktu kontrolnego - ponowny odczyt godla", type=MSG_WARNING)
+                sheet = nmt_sheets.read_sheet(*task)
+            if sheet:
+                stage.counts["points"] = sum(len(x) for _, x, _, _ in sheet.points)
+                stage.counts["lines"] = sum(len(line_data) for _, _, line_data in sheet.lines)
+        if sheet:
+            add_sheet_messages(sheet)
+            parse_errors.merge(sheet.errors)
+            # ---------------------------------------------------------------------
+            # DANE SUROWE
+            # ---------------------------------------------------------------------
+            if raw_points_cursor:
+                for point_sign, x, y, z in sheet.points:
+                    insert_points(raw_points_cursor, x, y, z, point_sign, index_unified)
+            if raw_lines_cursor:
+                for line_sign, _, line_data in sheet.lines:
+                    insert_lines(raw_lines_cursor, line_data, line_sign, index_unified)
 
         # sprawdzamy czy dla danego godla/pliku sa dane
-        if extent.is_empty():
+        if result is None and sheet.is_empty():
+            result = nmt_sheets.SheetResult(index)
+            if checkpoint:
+                checkpoint.save(result, fingerprints[index])
+        if result is not None and result.is_empty():
             continue
         
         # ------------------------------------------------------------------------------
@@ -592,28 +1214,72 @@ def extract_shp_from_tbd(
         arcpy.SelectLayerByAttribute_management(LYR_INDEX_AREA, "NEW_SELECTION", select_query)
         arcpy.Append_management([LYR_INDEX_AREA], nmt_envelopes_temp_fc, 'NO_TEST')
 
-        # usuwanie duplikatow ze zbioru
-        # wybieranie danych wewnatrz obrysu skorowidzu
-        if import_points:
-            add_arcpy_message('# punkty...', separator=False)
-            
-            arcpy.MakeFeatureLayer_management(nmt_points_temp_fc, LYR_NMT_POINTS_TEMP)
-            arcpy.SelectLayerByLocation_management( LYR_NMT_POINTS_TEMP, 'INTERSECT', LYR_INDEX_AREA)
-            arcpy.Append_management([LYR_NMT_POINTS_TEMP], nmt_points_fc)
-
-        if import_lines:
-            add_arcpy_message('# linie...', separator=False)
-            # usuwanie linii-duplikatow ze zbioru
-            arcpy.Clip_analysis(nmt_lines_temp_fc, LYR_INDEX_AREA, nmt_lines_temp_clip_fc)
-            arcpy.Append_management([nmt_lines_temp_clip_fc], nmt_lines_fc)
-
-        if export_raw_data:
-            if import_points: arcpy.Append_management([nmt_points_temp_fc], out_fc_names[OUT_RAW_POINTS])  
-            if import_lines: arcpy.Append_management([nmt_lines_temp_fc], out_fc_names[OUT_RAW_LINES])  
-            
-        # wyczyszczenie zbiorow tymczasowych do nastepnej kolejki
-        arcpy.DeleteFeatures_management(nmt_points_temp_fc)
-        arcpy.DeleteFeatures_management(nmt_lines_temp_fc)
+        if result is None:
+            result = nmt_sheets.SheetResult(index, sheet.bounds)
+
+            # usuwanie duplikatow ze zbioru
+            # wybieranie danych wewnatrz obrysu skorowidzu
+            if import_points:
+                add_arcpy_message('# punkty...', separator=False)
+
+                # test w obrysie: prostokat godla albo poligon obrysu (arkusz w siatce geograficznej)
+                if sheet_outline is None:
+                    add_arcpy_message(f"brak godla {index} w skorowidzu - punkty nie zostana przyciete", type=MSG_WARNING)
+
+                for point_sign, x, y, z in sheet.points:
+                    if sheet_outline is not None:
+                        inside = sheet_outline.get_points_mask(x, y, EPSILON)
+                        x, y, z = x[inside], y[inside], z[inside]
+                    result.points.append((point_sign, x, y, z))
+
+            # ---------------------------------------------------------------------
+            # POLILINIE i POLIGONY
+            # ---------------------------------------------------------------------
+            # poligony importowane jako polilinie ze wzgledu na poziome i pionowe linie oddzielajace arkusze
+            # linie poziome i pionowe oddzielane w celu poniejszego odfiltrowania
+            if import_lines:
+                add_arcpy_message('# linie...', separator=False)
+                if sheet_outline is None:
+                    add_arcpy_message(f"brak godla {index} w skorowidzu - linie nie zostana przyciete", type=MSG_WARNING)
+                is_simplified = simplify_xy_tolerance is not None or simplify_z_tolerance is not None
+                vertex_count = 0
+                simplified_vertex_count = 0
+                for line_sign, line_asc_file_path, line_data in sheet.lines:
+                    # uproszczenie linii, pierwszy i ostatni wierzcholek zostaja (ciaglosc miedzy godlami)
+                    if is_simplified:
+                        vertex_count += line_data.vertex_count()
+                        line_data = simplify_line_data(line_data, simplify_xy_tolerance, simplify_z_tolerance)
+                        simplified_vertex_count += line_data.vertex_count()
+                    line_types = nmt_geometry.get_line_types(line_data.x, line_data.y, line_data.offsets, EPSILON)
+                    add_line_type_warnings(line_asc_file_path, line_data, line_types)
+                    # usuwanie linii-duplikatow: przyciecie do obrysu godla
+                    with instrumentation.span("clip_sheet_lines", lines=len(line_data)):
+                        result.lines += clip_lines(line_data, line_sign, line_types, sheet_outline)
+
+                if is_simplified:
+                    add_arcpy_message(
+                        f"uproszczenie linii: pozostalo {simplified_vertex_count} z {vertex_count} wierzcholkow")
+
+            if checkpoint:
+                checkpoint.save(result, fingerprints[index])
+
+        quantized = point_store.quantized
+        for point_sign, x, y, z in result.points:
+            point_store.append(x, y, z, point_sign, index_unified)
+        if quantized and not point_store.quantized:
+            add_arcpy_message(
+                f"{point_store.dequantized_sheet} - wspolrzedne punktow nie sa zapisane w centymetrach, "
+                "punkty przechowywane jako float64 (bez kwantyzacji)", type=MSG_WARNING)
+        for wkb, line_sign, warnings in result.lines:
+            nmt_lines_cursor.insertRow((wkb, line_sign, index_unified, warnings))
+
+    del nmt_lines_cursor
+    if checkpoint:
+        checkpoint.write_manifest()
+
+    if error_report_path:
+        parse_errors.write_report(error_report_path)
+        add_arcpy_message(f"raport blednych linii ({parse_errors.total()}) zapisany: {error_report_path}")
 
     arcpy.Append_management([nmt_envelopes_temp_fc], nmt_envelopes_fc)
 
@@ -621,57 +1287,126 @@ def extract_shp_from_tbd(
     
     # zwalnianie zasobów
     add_arcpy_message("Zwalnianie tymczasowych zasobów...", True)
-    del points_temp_cursor
-    del lines_temp_cursor
-    arcpy.Delete_management(nmt_points_temp_fc)
+    for raw_cursor in (raw_points_cursor, raw_lines_cursor):
+        if isinstance(raw_cursor, shapefile_writer.ShapefileWriter):
+            raw_cursor.close()
+    del raw_points_cursor
+    del raw_lines_cursor
     arcpy.Delete_management(nmt_lines_temp_fc)
-    arcpy.Delete_management(nmt_lines_temp_clip_fc)
     arcpy.Delete_management(nmt_envelopes_temp_fc)
 
     if import_lines:
-        delete_lines_on_envelopes(nmt_lines_fc, nmt_envelopes_fc, spatial_ref_92)
+        if analytic_seams:
+            delete_lines_on_envelopes_analytic(nmt_lines_fc, nmt_envelopes_fc, spatial_ref_92)
+        else:
+            delete_lines_on_envelopes(nmt_lines_fc, nmt_envelopes_fc, spatial_ref_92)
+
+    # punkty po usunieciu linii na stykach, aby przerzedzanie uwzglednialo tylko wlasciwe linie
+    if import_points:
+        breaklines = read_breaklines(nmt_lines_fc) if (thin_cell_size and import_lines) else None
+        remove_duplicate_points(point_store)
+
+        # raster NMT z punktow (w ukladzie PUWG-1992), przed przerzedzeniem
+        if dem_path:
+            write_dem(dem_path, point_store, clip_area_fc, spatial_ref_92, dem_cell_size, dem_statistic)
+
+        if thin_cell_size:
+            thin_points(
+                point_store, thin_cell_size,
+                THINNING_Z_TOLERANCE if thin_z_tolerance is None else thin_z_tolerance, breaklines)
     
     # ostatki
     add_arcpy_message("Wybieranie danych wewnatrz obszaru zaineresowania...", separator=True)
 
     # CLIP AREA
     # PUNKTY
+    point_order = None
     if import_points:
         add_arcpy_message('# punkty...', separator=False)
-        arcpy.SelectLayerByLocation_management(LYR_NMT_POINTS, "INTERSECT", clip_area_fc)
+        clip_area_polygons = read_clip_area_polygons(clip_area_fc, spatial_ref_92)
+        # wspolrzedne dekodowane raz dla przyciecia i porzadkowania
+        with point_store.decoded():
+            with instrumentation.span("clip_points", points=len(point_store)):
+                clip_area_mask = nmt_geometry.get_points_in_polygons_mask(point_store.x, point_store.y, clip_area_polygons)
+            add_arcpy_message(f"{np.count_nonzero(clip_area_mask)} z {len(point_store)} punktow w obszarze")
+
+            # kolejnosc zapisu wg krzywej wypelniajacej przestrzen (lokalnosc dla indeksow przestrzennych i triangulacji)
+            if output_order:
+                add_arcpy_message(f"Porzadkowanie punktow wg krzywej {output_order}...", True)
+                point_order = get_point_order(point_store, clip_area_mask, output_order, workspace_out)
     # POLILINIE
     if import_lines:
         add_arcpy_message('# linie...', separator=False)
-        arcpy.SelectLayerByLocation_management(LYR_NMT_LINES, "INTERSECT", clip_area_fc)
-        # nie wybieraj obiektow
-        arcpy.SelectLayerByAttribute_management(LYR_NMT_LINES, "SUBSET_SELECTION", f""""{FLD_LAYER}" <> 'o'""")
-    
+        with instrumentation.span("clip_lines"):
+            arcpy.SelectLayerByLocation_management(LYR_NMT_LINES, "INTERSECT", clip_area_fc)
+            # nie wybieraj obiektow
+            arcpy.SelectLayerByAttribute_management(LYR_NMT_LINES, "SUBSET_SELECTION", f""""{FLD_LAYER}" <> 'o'""")
+
+    order_indices = point_order.indices if point_order else None
+
+    transformer = crs_transform.get_transformer(EPSG_2180, spatial_ref_out.factoryCode)
+
     # If in/out CS is the same, only copy data
     if spatial_ref_out.PCSCode == EPSG_2180 or spatial_ref_out.PCSCode == EPSG_102173:
         add_arcpy_message('Zapisywanie do katalogu docelowego...', separator=True)
         # kopiowanie do katalogu wyjsciowego
-        arcpy.CopyFeatures_management(nmt_envelopes_fc, out_fc_names[OUT_ENVELOPES])
+        # shapefile zapisywane z tablic, bez kursorow arcpy
+        copy_polygons(nmt_envelopes_fc, workspace_out, out_fc_names[OUT_ENVELOPES], spatial_ref_92)
         # PUNKTY
         if import_points:
             add_arcpy_message('# punkty...', separator=False)
-            arcpy.CopyFeatures_management(LYR_NMT_POINTS, out_fc_names[OUT_POINTS])
+            write_points(
+                point_store, clip_area_mask, workspace_out, out_fc_names[OUT_POINTS], nmt_points_temp_fc, spatial_ref_92,
+                order=order_indices)
         # POLILINIE
         if import_lines:
             add_arcpy_message('# linie...', separator=False)
-            arcpy.CopyFeatures_management(LYR_NMT_LINES, out_fc_names[OUT_LINES])
+            copy_lines(
+                LYR_NMT_LINES, workspace_out, out_fc_names[OUT_LINES], nmt_lines_fc, spatial_ref_92,
+                output_order=output_order)
             # OBIEKTY
             add_arcpy_message('Wyodrebnianie obiektow inzynieryjnych...', separator=True)
             arcpy.SelectLayerByLocation_management(LYR_NMT_LINES, "INTERSECT", clip_area_fc)
             arcpy.SelectLayerByAttribute_management(LYR_NMT_LINES, "SUBSET_SELECTION", f""""{FLD_LAYER}" = 'o'""")
-            arcpy.CopyFeatures_management(LYR_NMT_LINES, out_fc_names[OUT_BRIDGES])
-    # otherwise, project data
+            copy_lines(
+                LYR_NMT_LINES, workspace_out, out_fc_names[OUT_BRIDGES], nmt_lines_fc, spatial_ref_92,
+                output_order=output_order)
+    # otherwise, project data:
+    # wsadowa reprojekcja tablic x, y przy zapisie (jeden transformator dla pary ukladow)
+    elif transformer is not None:
+        add_arcpy_message('Zapisywanie do katalogu docelowego + reprojekcja wsadowa...', separator=True)
+        copy_polygons(nmt_envelopes_fc, workspace_out, out_fc_names[OUT_ENVELOPES], spatial_ref_out, transformer)
+        # PUNKTY
+        if import_points:
+            add_arcpy_message('# punkty...', separator=False)
+            write_points(
+                point_store, clip_area_mask, workspace_out, out_fc_names[OUT_POINTS], nmt_points_temp_fc,
+                spatial_ref_out, transformer, order_indices)
+        # POLILINIE
+        if import_lines:
+            add_arcpy_message('# linie...', separator=False)
+            copy_lines(
+                LYR_NMT_LINES, workspace_out, out_fc_names[OUT_LINES], nmt_lines_fc, spatial_ref_out, transformer,
+                output_order)
+            # OBIEKTY
+            add_arcpy_message('Wyodrebnianie obiektow inzynieryjnych...', separator=True)
+            arcpy.SelectLayerByLocation_management(LYR_NMT_LINES, "INTERSECT", clip_area_fc)
+            arcpy.SelectLayerByAttribute_management(LYR_NMT_LINES, "SUBSET_SELECTION", f""""{FLD_LAYER}" = 'o'""")
+            copy_lines(
+                LYR_NMT_LINES, workspace_out, out_fc_names[OUT_BRIDGES], nmt_lines_fc, spatial_ref_out, transformer,
+                output_order)
+    # uklad nieobslugiwany przez crs_transform
     else:
         add_arcpy_message('Zapisywanie do katalogu docelowego + reprojekcja...', separator=True)
         arcpy.Project_management(nmt_envelopes_fc, out_fc_names[OUT_ENVELOPES], spatial_ref_out)
         # PUNKTY
         if import_points:
             add_arcpy_message('# punkty...', separator=False)
-            arcpy.Project_management(LYR_NMT_POINTS, out_fc_names[OUT_POINTS], spatial_ref_out)
+            write_points(
+                point_store, clip_area_mask, MEM_WORKSPACE, MEM_NMT_POINTS, nmt_points_temp_fc, spatial_ref_92,
+                order=order_indices)
+            arcpy.Project_management(nmt_points_fc, out_fc_names[OUT_POINTS], spatial_ref_out)
+            arcpy.Delete_management(nmt_points_fc)
         # POLILINIE
         if import_lines:
             add_arcpy_message('# linie...', separator=False)
@@ -679,9 +1414,13 @@ def extract_shp_from_tbd(
             # OBIEKTY
             add_arcpy_message('Wyodrebnianie obiektow inzynieryjnych...', separator=True)
             arcpy.SelectLayerByLocation_management(LYR_NMT_LINES, 'INTERSECT', clip_area_fc)
-            arcpy.SelectLayerByAttribute_management(LYR_NMT_LINES, 'SUBSET_SELECTION', '"TYP" = \'o\'')
+            arcpy.SelectLayerByAttribute_management(LYR_NMT_LINES, "SUBSET_SELECTION", f""""{FLD_LAYER}" = 'o'""")
             arcpy.Project_management(LYR_NMT_LINES, out_fc_names[OUT_BRIDGES], spatial_ref_out)
 
+    if point_order:
+        point_order.close()
+    arcpy.Delete_management(nmt_points_temp_fc)
+
     add_arcpy_message("Zakończono powodzeniem", True)
     return
 
@@ -697,10 +1436,29 @@ if __name__ == '__main__':
         prefix_out = "xEVRF_2km_pionowe_poziome"
         spatial_ref_out = arcpy.SpatialReference(2180)
         clip_area_in = r"<shapefile with area of interest>"
+        # optional, sheet outlines are decoded from the indexes
         nmt_index_area_in = r"<shapefile with NMT indexes>"
         import_points = True
         import_lines = True
         export_raw_data = True
+        max_workers = 1
+        cache_folder = None
+        cache_max_size_mb = None
+        checkpoint_folder = None
+        thin_cell_size = None
+        thin_z_tolerance = None
+        simplify_xy_tolerance = None
+        simplify_z_tolerance = None
+        dem_path = None
+        dem_cell_size = DEM_CELL_SIZE
+        dem_statistic = nmt_dem.STAT_MEAN
+        error_report_path = None
+        prefetch_sheets = nmt_sheets.PREFETCH_SHEETS
+        prefetch_max_memory_mb = None
+        catalog_path = None
+        output_order = None
+        quantize_coordinates = False
+        trace_path = None
     else:
         # Tool parameter accessed with GetParameter or GetParameterAsText
         tbd_folder_in = arcpy.GetParameterAsText(0)
@@ -712,6 +1470,35 @@ if __name__ == '__main__':
         import_points = arcpy.GetParameter(6)
         import_lines = arcpy.GetParameter(7)
         export_raw_data = arcpy.GetParameter(8)
+        max_workers = int(utils.get_optional_parameter(9, 1))
+        # folder cache sparsowanych plikow ASC (nmt_cache); wpis rozpoznawany po sciezce, rozmiarze,
+        # dacie modyfikacji i skrocie tylko pierwszego i ostatniego 1 MB pliku - plik zmieniony w srodku
+        # z zachowanym rozmiarem i data nie zostanie wykryty (python nmt_cache.py invalidate ...)
+        cache_folder = utils.get_optional_parameter(10, None, as_text=True)
+        cache_max_size_mb = utils.get_optional_parameter(11, None)
+        checkpoint_folder = utils.get_optional_parameter(12, None, as_text=True)
+        thin_cell_size = utils.get_optional_parameter(13, None)
+        thin_z_tolerance = utils.get_optional_parameter(14, None)
+        # uproszczenie linii gdy podana jest ktorakolwiek tolerancja; bez tolerancji XY (= 0)
+        # usuwane sa tylko wierzcholki lezace w XY na cieciwie, o Z odchylonym mniej niz tolerancja Z
+        simplify_xy_tolerance = utils.get_optional_parameter(15, None)
+        simplify_z_tolerance = utils.get_optional_parameter(16, None)
+        dem_path = utils.get_optional_parameter(17, None, as_text=True)
+        dem_cell_size = utils.get_optional_parameter(18, DEM_CELL_SIZE)
+        dem_statistic = utils.get_optional_parameter(19, nmt_dem.STAT_MEAN, as_text=True)
+        # sciezka pliku .json ze sladem etapow (format Chrome trace)
+        trace_path = utils.get_optional_parameter(20, None, as_text=True)
+        # sciezka pliku .json z raportem blednych linii plikow ASC
+        error_report_path = utils.get_optional_parameter(21, None, as_text=True)
+        # liczba godel odczytywanych z wyprzedzeniem i limit ich pamieci
+        prefetch_sheets = int(utils.get_optional_parameter(22, nmt_sheets.PREFETCH_SHEETS))
+        prefetch_max_memory_mb = utils.get_optional_parameter(23, None)
+        # plik katalogu SQLite plikow ASC (nmt_catalog), zamiast przeszukiwania calego folderu
+        catalog_path = utils.get_optional_parameter(24, None, as_text=True)
+        # kolejnosc zapisu wynikow: HILBERT, MORTON lub pusta (kolejnosc godel)
+        output_order = utils.get_optional_parameter(25, None, as_text=True)
+        # wspolrzedne danych posrednich jako int32 w centymetrach (bezstratnie)
+        quantize_coordinates = bool(utils.get_optional_parameter(26, False))
 
     extract_shp_from_tbd(
         tbd_folder_in,
@@ -722,5 +1509,24 @@ if __name__ == '__main__':
         nmt_index_area_in,
         import_points, 
         import_lines,
-        export_raw_data)
+        export_raw_data,
+        max_workers,
+        cache_folder=cache_folder,
+        cache_max_size_mb=cache_max_size_mb,
+        checkpoint_folder=checkpoint_folder,
+        thin_cell_size=thin_cell_size,
+        thin_z_tolerance=thin_z_tolerance,
+        simplify_xy_tolerance=simplify_xy_tolerance,
+        simplify_z_tolerance=simplify_z_tolerance,
+        dem_path=dem_path,
+        dem_cell_size=dem_cell_size,
+        dem_statistic=dem_statistic,
+        error_report_path=error_report_path,
+        prefetch_sheets=prefetch_sheets,
+        prefetch_max_memory_mb=prefetch_max_memory_mb,
+        catalog_path=catalog_path,
+        output_order=output_order,
+        quantize_coordinates=quantize_coordinates)
+
+    utils.report_instrumentation(trace_path)
     
\ No newline at end of file
@@ -0,0 +1,204 @@
+"""
+Space-filling curve ordering of NMT outputs (does not need arcpy).
+
+Features written in the order of a Hilbert or Morton (Z-order) curve are
+close on disk when they are close in space, which speeds up spatial index
+builds and window queries over the output (e.g. SoundPLAN triangulation).
+
+Curve keys are computed vectorized on a 2^CURVE_BITS x 2^CURVE_BITS grid
+over the bounds of the data. Keys of up to max_memory_mb are sorted in
+memory, more keys are sorted by an external merge sort: sorted runs are
+written to memory-mapped files in a temporary folder and merged block by
+block.
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+CURVE_HILBERT = "HILBERT"
+CURVE_MORTON = "MORTON"
+CURVES = [CURVE_HILBERT, CURVE_MORTON]
+
+# cells of the curve grid per axis: 2^16 (about 10 m over the whole of Poland)
+CURVE_BITS = 16
+# keys and point indices are packed into one uint64: key << 32 | index
+INDEX_BITS = 32
+MAX_SORT_MEMORY_MB = 1024
+# points of the keys computed at once
+KEY_CHUNK_SIZE = 1024 * 1024
+
+
+def get_grid_coordinates(x, y, bounds, bits=CURVE_BITS):
+    """Integer cell coordinates (0 .. 2^bits - 1) of the points in the bounds."""
+    x_min, y_min, x_max, y_max = bounds
+    size = 1 << bits
+    scale_x = size / max(x_max - x_min, 1e-9)
+    scale_y = size / max(y_max - y_min, 1e-9)
+    ix = np.clip(np.floor((np.asarray(x) - x_min) * scale_x), 0, size - 1).astype(np.uint64)
+    iy = np.clip(np.floor((np.asarray(y) - y_min) * scale_y), 0, size - 1).astype(np.uint64)
+    return ix, iy
+
+def _spread_bits(values):
+    """Inserts a zero bit after every bit of the 16-bit values."""
+    values = values & np.uint64(0xFFFF)
+    values = (values | (values << np.uint64(8))) & np.uint64(0x00FF00FF)
+    values = (values | (values << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    values = (values | (values << np.uint64(2))) & np.uint64(0x33333333)
+    values = (values | (values << np.uint64(1))) & np.uint64(0x55555555)
+    return values
+
+def get_morton_keys(ix, iy):
+    """Morton (Z-order) keys of 16-bit cell coordinates: interleaved bits."""
+    return _spread_bits(ix) | (_spread_bits(iy) << np.uint64(1))
+
+def get_hilbert_keys(ix, iy, bits=CURVE_BITS):
+    """Hilbert curve keys of cell coordinates (0 .. 2^bits - 1), all points at once."""
+    x = np.asarray(ix, dtype=np.int64).copy()
+    y = np.asarray(iy, dtype=np.int64).copy()
+    keys = np.zeros(len(x), dtype=np.uint64)
+    last = (1 << bits) - 1
+    s = 1 << (bits - 1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += np.uint64(s * s) * ((3 * rx.astype(np.uint64)) ^ ry.astype(np.uint64))
+        # rotate the quadrant
+        flip = ~ry & rx
+        x = np.where(flip, last - x, x)
+        y = np.where(flip, last - y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s >>= 1
+    return keys
+
+def get_curve_keys(x, y, bounds, curve=CURVE_HILBERT, bits=CURVE_BITS):
+    """Keys of the points on the curve over the bounds (x_min, y_min, x_max, y_max)."""
+    curve = curve.upper()
+    if curve not in CURVES:
+        raise ValueError(f"Unknown curve: {curve}")
+
+    ix, iy = get_grid_coordinates(x, y, bounds, bits)
+    if curve == CURVE_MORTON:
+        return get_morton_keys(ix, iy)
+    return get_hilbert_keys(ix, iy, bits)
+
+def get_bounds(x, y, mask=None):
+    """(x_min, y_min, x_max, y_max) of the points (in the mask) or None if there are none."""
+    if mask is None:
+        mask = np.ones(len(x), dtype=bool)
+    if not np.any(mask):
+        return None
+    return (
+        float(np.min(x, where=mask, initial=np.inf)),
+        float(np.min(y, where=mask, initial=np.inf)),
+        float(np.max(x, where=mask, initial=-np.inf)),
+        float(np.max(y, where=mask, initial=-np.inf)))
+
+def _iter_packed_chunks(x, y, bounds, curve, mask, chunk_size):
+    """Yields uint64 arrays of key << INDEX_BITS | index of the points (in the mask)."""
+    for start in range(0, len(x), chunk_size):
+        indices = np.arange(start, min(start + chunk_size, len(x)), dtype=np.uint64)
+        if mask is not None:
+            indices = indices[mask[start:start + chunk_size]]
+        if len(indices) == 0:
+            continue
+        selection = indices.astype(np.int64)
+        keys = get_curve_keys(x[selection], y[selection], bounds, curve)
+        yield (keys << np.uint64(INDEX_BITS)) | indices
+
+def _merge_runs(runs, output, block_size):
+    """
+    K-way merge of sorted memory-mapped runs into output, block by block:
+    everything not greater than the smallest last key of the loaded blocks
+    is final and is written at once.
+    """
+    positions = [0] * len(runs)
+    written = 0
+    while True:
+        blocks = [run[position:position + block_size] for run, position in zip(runs, positions)]
+        active = [i for i, block in enumerate(blocks) if len(block)]
+        if not active:
+            break
+
+        # runs with more data after the loaded block limit what can be written
+        limits = [blocks[i][-1] for i in active if positions[i] + len(blocks[i]) < len(runs[i])]
+        limit = min(limits) if limits else None
+
+        selected = []
+        for i in active:
+            block = blocks[i]
+            count = len(block) if limit is None else int(np.searchsorted(block, limit, side="right"))
+            selected.append(block[:count])
+            positions[i] += count
+        merged = np.sort(np.concatenate(selected))
+        output[written:written + len(merged)] = merged
+        written += len(merged)
+
+class CurveOrder:
+    '''
+    Indices of the points (in the mask) sorted by the curve key, ties keep
+    the original order. If sorting needs more than max_memory_mb, the
+    external merge sort is used and the indices are a memory-mapped array
+    backed by a file in a temporary folder, removed by close().
+    '''
+    def __init__(self, x, y, curve=CURVE_HILBERT, mask=None, max_memory_mb=MAX_SORT_MEMORY_MB, temp_folder=None):
+        x = np.asarray(x)
+        y = np.asarray(y)
+        if len(x) >= 1 << INDEX_BITS:
+            raise OverflowError(f"More than {1 << INDEX_BITS} points to order")
+
+        self.curve = curve.upper()
+        self.temp_folder = None
+        self.bounds = get_bounds(x, y, mask)
+        count = len(x) if mask is None else int(np.count_nonzero(mask))
+        # packed keys, their sorted copy and the indices
+        max_bytes = int(max_memory_mb * 1024 * 1024) if max_memory_mb else None
+        self.is_external = max_bytes is not None and 3 * 8 * count > max_bytes
+
+        if self.bounds is None:
+            self.indices = np.empty(0, dtype=np.int64)
+        elif not self.is_external:
+            packed = np.concatenate(list(_iter_packed_chunks(x, y, self.bounds, self.curve, mask, KEY_CHUNK_SIZE)))
+            packed.sort()
+            self.indices = (packed & np.uint64((1 << INDEX_BITS) - 1)).astype(np.int64)
+        else:
+            self.temp_folder = tempfile.mkdtemp(prefix="nmt_order_", dir=temp_folder)
+            try:
+                self.indices = self._sort_external(x, y, mask, count, max_bytes)
+            except BaseException:
+                self.close()
+                raise
+
+    def __len__(self):
+        return len(self.indices)
+
+    def _sort_external(self, x, y, mask, count, max_bytes):
+        run_size = max(KEY_CHUNK_SIZE, max_bytes // (3 * 8))
+        runs = []
+        for packed in _iter_packed_chunks(x, y, self.bounds, self.curve, mask, run_size):
+            packed.sort()
+            run_path = os.path.join(self.temp_folder, f"run_{len(runs)}.dat")
+            run = np.memmap(run_path, dtype=np.uint64, mode="w+", shape=len(packed))
+            run[:] = packed
+            run.flush()
+            runs.append(run)
+
+        merged = np.memmap(os.path.join(self.temp_folder, "merged.dat"), dtype=np.uint64, mode="w+", shape=count)
+        block_size = max(1024, max_bytes // (2 * 8 * (len(runs) + 1)))
+        _merge_runs(runs, merged, block_size)
+        del runs
+
+        # indices in place of the packed keys
+        indices = merged.view(np.int64)
+        for start in range(0, count, run_size):
+            indices[start:start + run_size] = merged[start:start + run_size] & np.uint64((1 << INDEX_BITS) - 1)
+        indices.flush()
+        return indices
+
+    def close(self):
+        """Releases the indices and removes the files of the external sort."""
+        self.indices = None
+        if self.temp_folder:
+            shutil.rmtree(self.temp_folder, ignore_errors=True)
+            self.temp_folder = None
@@ -0,0 +1,101 @@
+"""
+Quantized integer coordinates of NMT points (does not need arcpy).
+
+NMT coordinates and heights are given in centimetres, so x, y and z can
+be kept as int32 offsets in centimetres from an origin (whole metres
+below the minimum of the data, one per sheet or file) instead of float64:
+half of the memory, cache and worker-to-parent transfer volume.
+
+Decoding is exact: (origin + code) / SCALE is the double nearest to the
+decimal value, the same double as the one parsed from the ASC text. Data
+with a finer precision (or out of the int32 range) is not encoded and is
+kept as float64.
+"""
+import numpy as np
+
+# codes per metre (centimetres)
+SCALE = 100
+CODE_DTYPE = np.int32
+MIN_CODE = int(np.iinfo(CODE_DTYPE).min)
+MAX_CODE = int(np.iinfo(CODE_DTYPE).max)
+
+
+def get_origin(values):
+    """Origin in codes (whole metres below the minimum) of the values, 0 if there are none."""
+    if len(values) == 0:
+        return 0
+    minimum = float(np.min(values))
+    if not np.isfinite(minimum):
+        return 0
+    return int(np.floor(minimum)) * SCALE
+
+def encode(values, origin=None):
+    """
+    int32 codes of the values relative to origin (get_origin of the values
+    if None) or None if the values are not exactly decodable.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if origin is None:
+        origin = get_origin(values)
+    codes = np.rint(values * SCALE)
+    codes -= origin
+    # also false for NaN
+    if len(codes) and not (MIN_CODE <= codes.min() and codes.max() <= MAX_CODE):
+        return None
+    codes = codes.astype(CODE_DTYPE)
+    if not np.array_equal(decode(codes, origin), values):
+        return None
+    return codes
+
+def decode(codes, origin):
+    """float64 values of the codes relative to origin."""
+    values = np.asarray(codes, dtype=np.float64) + origin
+    values /= SCALE
+    return values
+
+def encode_chunks(chunks):
+    """
+    (origin, [codes]) of the chunks of one coordinate in their common
+    origin or None if any chunk is not exactly decodable.
+    """
+    origin = min((get_origin(chunk) for chunk in chunks if len(chunk)), default=0)
+    codes = [encode(chunk, origin) for chunk in chunks]
+    if any(chunk_codes is None for chunk_codes in codes):
+        return None
+    return origin, codes
+
+class QuantizedXYZ:
+    '''x, y, z codes with the origin of every coordinate'''
+    def __init__(self, origin, x, y, z):
+        self.origin = tuple(origin)
+        self.x = x
+        self.y = y
+        self.z = z
+
+    @property
+    def nbytes(self):
+        return self.x.nbytes + self.y.nbytes + self.z.nbytes
+
+    def decode(self):
+        """(x, y, z) as float64 arrays."""
+        return tuple(decode(codes, origin) for codes, origin in zip((self.x, self.y, self.z), self.origin))
+
+def encode_xyz(x, y, z):
+    """QuantizedXYZ of the coordinates or None if any of them is not exactly decodable."""
+    origin = []
+    codes = []
+    for values in (x, y, z):
+        values = np.asarray(values, dtype=np.float64)
+        values_origin = get_origin(values)
+        values_codes = encode(values, values_origin)
+        if values_codes is None:
+            return None
+        origin.append(values_origin)
+        codes.append(values_codes)
+    return QuantizedXYZ(origin, *codes)
+
+def decode_xyz(values):
+    """(x, y, z) of a QuantizedXYZ, other values (an (x, y, z) tuple) are returned as they are."""
+    if isinstance(values, QuantizedXYZ):
+        return values.decode()
+    return values
@@ -0,0 +1,371 @@
+"""
+Reading of the NMT map sheets (godla), serially or in worker processes.
+
+A sheet is read into a compact SheetData object (arrays and parsed line
+blocks), so it can be sent from a worker process back to the parent,
+which writes the data in a deterministic order. A quantized sheet is
+sent with the coordinates encoded as int32 centimetres (nmt_quantize).
+"""
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+import nmt_asc
+import nmt_cache
+import nmt_quantize
+
+# sheets read ahead by the background thread when reading in one process
+PREFETCH_SHEETS = 1
+
+
+def get_asc_files_dict(tbd_folder):
+    """Paths of all .asc files in the folder tree by the file name without extension ("<index>_<sign>")."""
+    asc_files_dict = {}
+    for root, _, files in os.walk(tbd_folder):
+        for file in files:
+            if(file.lower().endswith(".asc")):
+                file_no_extension = file.split(".")[0]
+                asc_files_dict[file_no_extension] = os.path.join(root, file)
+    return asc_files_dict
+
+class SheetData:
+    '''
+    Parsed data of one map sheet. A parsed file is kept as the chunks of
+    the reader (several entries of the same sign and path), so the file
+    is never held twice in memory to join them.
+    '''
+    def __init__(self, index, quantize=False):
+        self.index = index
+        # coordinates pickled as nmt_quantize.QuantizedXYZ (if exact)
+        self.quantize = quantize
+        # (sign, x, y, z), one or more per file
+        self.points = []
+        # (sign, path, nmt_asc.LineData), one or more per file
+        self.lines = []
+        # (x_min, y_min, x_max, y_max) of all points and vertices
+        self.bounds = None
+        self.converted_files = []
+        self.missing_files = []
+        # malformed lines counted per file, with only the first examples
+        self.errors = nmt_asc.ParseErrors()
+
+    def is_empty(self):
+        return self.bounds is None
+
+    @property
+    def nbytes(self):
+        """Size of the point and vertex arrays."""
+        size = sum(np.asarray(x).nbytes * 3 for _, x, _, _ in self.points)
+        for _, _, line_data in self.lines:
+            size += np.asarray(line_data.x).nbytes * 3 + np.asarray(line_data.offsets).nbytes
+        return size
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.quantize:
+            state["points"] = [
+                (sign, nmt_quantize.encode_xyz(x, y, z) or (x, y, z)) for sign, x, y, z in self.points]
+            state["lines"] = [
+                (sign, path, nmt_quantize.encode_xyz(line_data.x, line_data.y, line_data.z)
+                 or (line_data.x, line_data.y, line_data.z), line_data.offsets, line_data.end_line_numbers)
+                for sign, path, line_data in self.lines]
+        return state
+
+    def __setstate__(self, state):
+        if state.get("quantize"):
+            state["points"] = [(sign, *nmt_quantize.decode_xyz(values)) for sign, values in state["points"]]
+            state["lines"] = [
+                (sign, path, nmt_asc.LineData(*nmt_quantize.decode_xyz(values), offsets, end_line_numbers))
+                for sign, path, values, offsets, end_line_numbers in state["lines"]]
+        self.__dict__.update(state)
+
+    def update_bounds(self, bounds):
+        if bounds is None:
+            return
+        if self.bounds is None:
+            self.bounds = bounds
+        else:
+            self.bounds = (
+                min(self.bounds[0], bounds[0]),
+                min(self.bounds[1], bounds[1]),
+                max(self.bounds[2], bounds[2]),
+                max(self.bounds[3], bounds[3]))
+
+def read_sheet(index, point_files, line_files, cache=None, quantize=False):
+    """
+    Reads all ASC files of the sheet.
+    point_files and line_files are lists of (sign, path).
+    If cache (nmt_cache.ParseCache) is given, parsed files are taken from it.
+    With quantize the sheet is sent from a worker process as int32 centimetres.
+    """
+    sheet = SheetData(index, quantize)
+
+    for sign, path in point_files:
+        if not os.path.exists(path):
+            sheet.missing_files.append(path)
+            continue
+
+        if cache is not None:
+            chunks = [cache.get_points(path, sheet.errors)]
+        else:
+            chunks = nmt_asc.iter_point_chunks(path, on_error=sheet.errors.get_handler(path))
+        for x, y, z in chunks:
+            if len(x):
+                sheet.points.append((sign, x, y, z))
+                sheet.update_bounds(nmt_asc.get_bounds(x, y))
+        sheet.converted_files.append(path)
+
+    for sign, path in line_files:
+        if not os.path.exists(path):
+            sheet.missing_files.append(path)
+            continue
+
+        if cache is not None:
+            chunks = [cache.get_lines(path, sheet.errors)]
+        else:
+            chunks = nmt_asc.iter_line_chunks(path, on_error=sheet.errors.get_handler(path))
+        for line_data in chunks:
+            if len(line_data):
+                sheet.lines.append((sign, path, line_data))
+                sheet.update_bounds(nmt_asc.get_bounds(line_data.x, line_data.y))
+        sheet.converted_files.append(path)
+
+    return sheet
+
+def _read_sheet_task(task):
+    return read_sheet(*task)
+
+class SheetPrefetcher:
+    '''
+    Reads the sheets in a background thread while the consumer processes
+    the previous ones. At most lookahead sheets are kept read ahead and,
+    if max_memory_mb is given, a next sheet is read only while the waiting
+    sheets take less memory (at least one sheet is always read ahead).
+    '''
+    def __init__(self, tasks, lookahead=PREFETCH_SHEETS, max_memory_mb=None):
+        self.lookahead = max(1, lookahead)
+        self.max_bytes = max_memory_mb * 1024 * 1024 if max_memory_mb else None
+        self._condition = threading.Condition()
+        self._queue = collections.deque()
+        self._queued_bytes = 0
+        self._done = False
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._read, args=(tasks,), name="SheetPrefetcher", daemon=True)
+        self._thread.start()
+
+    def _has_room(self):
+        if self._closed or not self._queue:
+            return True
+        if len(self._queue) >= self.lookahead:
+            return False
+        return self.max_bytes is None or self._queued_bytes < self.max_bytes
+
+    def _read(self, tasks):
+        try:
+            for task in tasks:
+                with self._condition:
+                    self._condition.wait_for(self._has_room)
+                    if self._closed:
+                        return
+                sheet = _read_sheet_task(task)
+                with self._condition:
+                    self._queue.append(sheet)
+                    self._queued_bytes += sheet.nbytes
+                    self._condition.notify_all()
+        except BaseException as error:
+            self._error = error
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+
+    def __iter__(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._done)
+                if not self._queue:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                sheet = self._queue.popleft()
+                self._queued_bytes -= sheet.nbytes
+                self._condition.notify_all()
+            yield sheet
+
+    def close(self):
+        """Stops reading (after the sheet being read) and waits for the thread."""
+        with self._condition:
+            self._closed = True
+            self._queue.clear()
+            self._condition.notify_all()
+        self._thread.join()
+
+def iter_sheets(tasks, max_workers=1, lookahead=PREFETCH_SHEETS, max_prefetch_mb=None):
+    """
+    Yields SheetData for every (index, point_files, line_files, cache[, quantize])
+    task in the order of the tasks.
+
+    With max_workers <= 1 the sheets are read by a SheetPrefetcher thread,
+    at most lookahead sheets (and about max_prefetch_mb of data) ahead of
+    the consumer; lookahead 0 reads every sheet only when it is requested.
+    With max_workers > 1 the sheets are read in a process pool, at most
+    max(lookahead, 2 * max_workers) sheets ahead of the consumer.
+    """
+    if max_workers is None or max_workers <= 1:
+        if not lookahead:
+            for task in tasks:
+                yield _read_sheet_task(task)
+            return
+
+        prefetcher = SheetPrefetcher(tasks, lookahead, max_prefetch_mb)
+        try:
+            yield from prefetcher
+        finally:
+            prefetcher.close()
+        return
+
+    max_pending = max(lookahead or 0, 2 * max_workers)
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(executor.submit(_read_sheet_task, task))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+class SheetResult:
+    '''Data of one sheet selected inside its envelope, ready to be merged'''
+    def __init__(self, index, bounds=None):
+        self.index = index
+        self.bounds = bounds
+        # (sign, x, y, z)
+        self.points = []
+        # (wkb, sign, warnings)
+        self.lines = []
+
+    def is_empty(self):
+        return self.bounds is None
+
+class SheetCheckpoint:
+    '''
+    Results of the completed sheets stored in a folder, with a manifest
+    of the completed sheets and fingerprints of their ASC files.
+
+    A completed sheet is appended to a journal (one JSON line), the
+    manifest is rewritten from it only every journal_size sheets, so a
+    long run does not rewrite the whole manifest after every sheet.
+    '''
+    MANIFEST = "manifest.json"
+    JOURNAL = "manifest.journal"
+    JOURNAL_SIZE = 1000
+
+    def __init__(self, folder, journal_size=JOURNAL_SIZE):
+        self.folder = folder
+        self.journal_size = journal_size
+        os.makedirs(folder, exist_ok=True)
+        self.manifest_path = os.path.join(folder, self.MANIFEST)
+        self.journal_path = os.path.join(folder, self.JOURNAL)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                self.manifest = json.load(manifest_file)
+        self.journal_count = self._replay_journal()
+
+    def _replay_journal(self):
+        """Adds the journal entries to the manifest, returns their number."""
+        if not os.path.exists(self.journal_path):
+            return 0
+        count = 0
+        with open(self.journal_path) as journal_file:
+            for line in journal_file:
+                try:
+                    index, fingerprint = json.loads(line)
+                except ValueError:
+                    # last line cut by an interrupted run
+                    continue
+                self.manifest[index] = fingerprint
+                count += 1
+        return count
+
+    def write_manifest(self):
+        """Rewrites the manifest with all completed sheets and empties the journal."""
+        manifest_temp_path = self.manifest_path + ".tmp"
+        with open(manifest_temp_path, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=1)
+        os.replace(manifest_temp_path, self.manifest_path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal_count = 0
+
+    def get_fingerprint(self, task, options=""):
+        """Fingerprint of the sheet task: all its ASC files and the processing options."""
+        index, point_files, line_files = task[:3]
+        fingerprint = hashlib.sha1(f"{index}|{options}".encode())
+        for sign, path in point_files + line_files:
+            file_fingerprint = nmt_cache.get_fingerprint(path) if os.path.exists(path) else "missing"
+            fingerprint.update(f"|{sign}:{file_fingerprint}".encode())
+        return fingerprint.hexdigest()
+
+    def get_result_path(self, index):
+        return os.path.join(self.folder, f"{index}{nmt_cache.CACHE_EXTENSION}")
+
+    def is_complete(self, index, fingerprint):
+        return self.manifest.get(index) == fingerprint and os.path.exists(self.get_result_path(index))
+
+    def load(self, index, fingerprint):
+        """Returns SheetResult of the completed sheet or None."""
+        if not self.is_complete(index, fingerprint):
+            return None
+
+        try:
+            columns, metadata = nmt_cache.read_columns(self.get_result_path(index))
+        except (OSError, ValueError):
+            # damaged result, the sheet has to be processed again
+            return None
+        result = SheetResult(index, tuple(metadata["bounds"]) if metadata["bounds"] else None)
+
+        point_signs = metadata["point_signs"]
+        point_offsets = columns["point_offsets"].tolist()
+        for sign, start, end in zip(point_signs, point_offsets[:-1], point_offsets[1:]):
+            result.points.append((sign, columns["x"][start:end], columns["y"][start:end], columns["z"][start:end]))
+
+        wkb = columns["line_wkb"]
+        wkb_offsets = columns["line_wkb_offsets"].tolist()
+        for i, (sign, warnings) in enumerate(zip(metadata["line_signs"], metadata["line_warnings"])):
+            result.lines.append((wkb[wkb_offsets[i]:wkb_offsets[i + 1]].tobytes(), sign, warnings))
+
+        return result
+
+    def save(self, result, fingerprint):
+        """Stores the sheet result and marks the sheet as completed."""
+        point_lengths = [len(x) for _, x, _, _ in result.points]
+        wkb_lengths = [len(wkb) for wkb, _, _ in result.lines]
+        columns = {
+            "x": np.concatenate([np.empty(0)] + [np.asarray(x) for _, x, _, _ in result.points]),
+            "y": np.concatenate([np.empty(0)] + [np.asarray(y) for _, _, y, _ in result.points]),
+            "z": np.concatenate([np.empty(0)] + [np.asarray(z) for _, _, _, z in result.points]),
+            "point_offsets": np.cumsum([0] + point_lengths),
+            "line_wkb": np.frombuffer(b"".join(wkb for wkb, _, _ in result.lines), dtype=np.uint8),
+            "line_wkb_offsets": np.cumsum([0] + wkb_lengths)}
+        metadata = {
+            "index": result.index,
+            "bounds": result.bounds,
+            "point_signs": [sign for sign, _, _, _ in result.points],
+            "line_signs": [sign for _, sign, _ in result.lines],
+            "line_warnings": [warnings for _, _, warnings in result.lines]}
+        nmt_cache.write_columns(self.get_result_path(result.index), columns, metadata)
+
+        self.manifest[result.index] = fingerprint
+        with open(self.journal_path, "a") as journal_file:
+            journal_file.write(json.dumps([result.index, fingerprint]) + "\n")
+        self.journal_count += 1
+        if self.journal_count >= self.journal_size:
+            self.write_manifest()
@@ -0,0 +1,242 @@
+"""
+Compact columnar store of NMT points (does not need arcpy).
+
+Every point takes 8 bytes per coordinate, 1 byte for the layer sign
+(WARSTWA) and 2 bytes for the sheet (GODLO); the sign and sheet texts are
+kept once in lookup lists. Columns grow in chunks, selections are boolean
+masks over the columns.
+
+A quantized store keeps the coordinates as int32 centimetres from an
+origin of every sheet (nmt_quantize), 4 bytes per coordinate; x, y and z
+are decoded on every access, or once per stage inside decoded(). Points
+that cannot be encoded exactly turn the store into a float64 one, the
+sheet of those points is kept in dequantized_sheet.
+"""
+import contextlib
+
+import numpy as np
+
+import nmt_quantize
+
+# initial capacity and the minimal growth of the columns
+CHUNK_SIZE = 1024 * 1024
+MAX_SIGNS = np.iinfo(np.uint8).max + 1
+MAX_SHEETS = np.iinfo(np.uint16).max + 1
+
+
+class PointStore:
+    '''Columns x, y, z, sign code and sheet id of the points'''
+    def __init__(self, capacity=CHUNK_SIZE, quantized=False):
+        self._size = 0
+        self.quantized = quantized
+        dtype = nmt_quantize.CODE_DTYPE if quantized else np.float64
+        self._x = np.empty(capacity, dtype=dtype)
+        self._y = np.empty(capacity, dtype=dtype)
+        self._z = np.empty(capacity, dtype=dtype)
+        self._sign_codes = np.empty(capacity, dtype=np.uint8)
+        self._sheet_ids = np.empty(capacity, dtype=np.uint16)
+        # code/id -> text and back
+        self.signs = []
+        self.sheets = []
+        self._sign_lookup = {}
+        self._sheet_lookup = {}
+        # sheet id -> (x, y, z) origin of the quantized coordinates, None before the first points
+        self._origins = []
+        # sheet of the points which turned a quantized store into a float64 one
+        self.dequantized_sheet = None
+        # axis -> decoded column inside decoded(), None outside
+        self._decoded = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def x(self):
+        return self._get_column(0)
+
+    @property
+    def y(self):
+        return self._get_column(1)
+
+    @property
+    def z(self):
+        return self._get_column(2)
+
+    @property
+    def sign_codes(self):
+        return self._sign_codes[:self._size]
+
+    @property
+    def sheet_ids(self):
+        return self._sheet_ids[:self._size]
+
+    @property
+    def nbytes(self):
+        return self._size * (3 * self._x.itemsize + 1 + 2)
+
+    @contextlib.contextmanager
+    def decoded(self):
+        """
+        Within the block the coordinates of a quantized store are decoded once
+        and kept (8 bytes per coordinate) until the points change, instead of
+        being decoded on every access.
+        """
+        self._decoded = {}
+        try:
+            yield self
+        finally:
+            self._decoded = None
+
+    def _get_column(self, axis, selection=slice(None)):
+        """Coordinates of the axis (0 - x, 1 - y, 2 - z), decoded if the store is quantized."""
+        if not self.quantized:
+            return (self._x, self._y, self._z)[axis][:self._size][selection]
+        if self._decoded is not None:
+            if axis not in self._decoded:
+                self._decoded[axis] = self._decode_column(axis, slice(None))
+            return self._decoded[axis][selection]
+        return self._decode_column(axis, selection)
+
+    def _decode_column(self, axis, selection):
+        codes = (self._x, self._y, self._z)[axis][:self._size][selection]
+        origins = np.array([origin or (0, 0, 0) for origin in self._origins], dtype=np.float64)
+        values = origins[self.sheet_ids[selection], axis]
+        values += codes
+        values /= nmt_quantize.SCALE
+        return values
+
+    def _clear_decoded(self):
+        if self._decoded is not None:
+            self._decoded = {}
+
+    def _dequantize(self, sheet_id):
+        """Turns the coordinate columns into float64 ones because of the points of the sheet."""
+        capacity = len(self._x)
+        for axis, name in enumerate(("_x", "_y", "_z")):
+            column = np.empty(capacity)
+            column[:self._size] = self._decode_column(axis, slice(None))
+            setattr(self, name, column)
+        self.quantized = False
+        self.dequantized_sheet = self.sheets[sheet_id]
+        self._clear_decoded()
+
+    def get_sign_code(self, sign):
+        if sign not in self._sign_lookup:
+            if len(self.signs) >= MAX_SIGNS:
+                raise OverflowError(f"More than {MAX_SIGNS} point signs")
+            self._sign_lookup[sign] = len(self.signs)
+            self.signs.append(sign)
+        return self._sign_lookup[sign]
+
+    def get_sheet_id(self, sheet):
+        if sheet not in self._sheet_lookup:
+            if len(self.sheets) >= MAX_SHEETS:
+                raise OverflowError(f"More than {MAX_SHEETS} sheets")
+            self._sheet_lookup[sheet] = len(self.sheets)
+            self.sheets.append(sheet)
+            self._origins.append(None)
+        return self._sheet_lookup[sheet]
+
+    def _reserve(self, size):
+        capacity = len(self._x)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, CHUNK_SIZE)
+        for name in ("_x", "_y", "_z", "_sign_codes", "_sheet_ids"):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+
+    def append(self, x, y, z, sign, sheet):
+        """Appends arrays of points of one sign and sheet."""
+        count = len(x)
+        sign_code = self.get_sign_code(sign)
+        sheet_id = self.get_sheet_id(sheet)
+        if self.quantized and count:
+            x, y, z = self._encode(x, y, z, sheet_id)
+
+        start = self._size
+        self._reserve(start + count)
+        end = start + count
+        self._x[start:end] = x
+        self._y[start:end] = y
+        self._z[start:end] = z
+        self._sign_codes[start:end] = sign_code
+        self._sheet_ids[start:end] = sheet_id
+        self._size = end
+        self._clear_decoded()
+
+    def _encode(self, x, y, z, sheet_id):
+        """Codes of the points in the origin of the sheet, or the points if the store had to be dequantized."""
+        origin = self._origins[sheet_id]
+        if origin is None:
+            origin = tuple(nmt_quantize.get_origin(values) for values in (x, y, z))
+        codes = [nmt_quantize.encode(values, values_origin) for values, values_origin in zip((x, y, z), origin)]
+        if any(axis_codes is None for axis_codes in codes):
+            self._dequantize(sheet_id)
+            return x, y, z
+        self._origins[sheet_id] = origin
+        return codes
+
+    def get_sign_mask(self, signs):
+        """Mask of the points with one of the signs."""
+        codes = [self._sign_lookup[sign] for sign in signs if sign in self._sign_lookup]
+        return np.isin(self.sign_codes, codes)
+
+    def compress(self, mask):
+        """Keeps only the points in the mask (in place)."""
+        count = int(np.count_nonzero(mask))
+        for name in ("_x", "_y", "_z", "_sign_codes", "_sheet_ids"):
+            column = getattr(self, name)
+            column[:count] = column[:self._size][mask]
+        self._size = count
+        self._clear_decoded()
+
+    def select(self, mask):
+        """New store with the points in the mask."""
+        count = int(np.count_nonzero(mask))
+        store = PointStore(max(1, count), self.quantized)
+        store.signs = list(self.signs)
+        store.sheets = list(self.sheets)
+        store._sign_lookup = dict(self._sign_lookup)
+        store._sheet_lookup = dict(self._sheet_lookup)
+        store._origins = list(self._origins)
+        store.dequantized_sheet = self.dequantized_sheet
+        store._size = count
+        for name in ("_x", "_y", "_z", "_sign_codes", "_sheet_ids"):
+            getattr(store, name)[:count] = getattr(self, name)[:self._size][mask]
+        return store
+
+    def iter_batches(self, batch_size, mask=None, order=None):
+        """
+        Yields (x, y, z, signs, sheets) batches of the points (in the mask),
+        signs and sheets as lists of texts. If order (array of point indices,
+        e.g. nmt_order.CurveOrder.indices) is given, the points are yielded
+        in its order; it is read in batches, so it can be memory-mapped.
+        """
+        if order is not None:
+            for start in range(0, len(order), batch_size):
+                selection = np.asarray(order[start:start + batch_size])
+                if mask is not None:
+                    selection = selection[mask[selection]]
+                if len(selection):
+                    yield self._get_batch(selection)
+            return
+
+        indices = np.flatnonzero(mask) if mask is not None else None
+        count = len(indices) if indices is not None else self._size
+        for start in range(0, count, batch_size):
+            if indices is None:
+                selection = slice(start, start + batch_size)
+            else:
+                selection = indices[start:start + batch_size]
+            yield self._get_batch(selection)
+
+    def _get_batch(self, selection):
+        return (
+            self._get_column(0, selection),
+            self._get_column(1, selection),
+            self._get_column(2, selection),
+            [self.signs[code] for code in self.sign_codes[selection].tolist()],
+            [self.sheets[sheet_id] for sheet_id in self.sheet_ids[selection].tolist()])
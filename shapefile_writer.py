@@ -0,0 +1,304 @@
+"""
+Bulk shapefile writer (does not need arcpy).
+
+Writes Point, PointZ, PolyLine, PolyLineZ, Polygon and PolygonZ
+shapefiles (.shp, .shx, .dbf, .prj, .cpg) from NumPy arrays. Every call
+serializes a whole chunk of features into one buffer per file, so there
+is no per-row call as with arcpy.da.InsertCursor.
+
+Lines and polygons are ragged arrays: x, y, z of all vertices, offsets of
+the parts and the number of parts of every feature. Polygon rings must be
+closed, outer rings clockwise, holes counter-clockwise (ESRI order).
+"""
+import datetime
+import os
+
+import numpy as np
+
+SHAPE_POINT = 1
+SHAPE_POLYLINE = 3
+SHAPE_POLYGON = 5
+SHAPE_POINTZ = 11
+SHAPE_POLYLINEZ = 13
+SHAPE_POLYGONZ = 15
+
+Z_SHAPE_TYPES = (SHAPE_POINTZ, SHAPE_POLYLINEZ, SHAPE_POLYGONZ)
+POINT_SHAPE_TYPES = (SHAPE_POINT, SHAPE_POINTZ)
+
+FILE_CODE = 9994
+FILE_VERSION = 1000
+HEADER_SIZE = 100
+RECORD_HEADER_SIZE = 8
+ENCODING = "UTF-8"
+
+# DBF field types
+FIELD_TEXT = "C"
+FIELD_NUMBER = "N"
+FIELD_FLOAT = "F"
+FIELD_DATE = "D"
+FIELD_LOGICAL = "L"
+MAX_FIELD_NAME = 10
+MAX_TEXT_SIZE = 254
+
+
+class Field:
+    '''DBF field definition'''
+    def __init__(self, name, type=FIELD_TEXT, size=None, decimals=0):
+        if len(name) > MAX_FIELD_NAME:
+            raise ValueError(f"DBF field name longer than {MAX_FIELD_NAME} characters: {name}")
+        self.name = name
+        self.type = type
+        if size is None:
+            size = {FIELD_TEXT: MAX_TEXT_SIZE, FIELD_DATE: 8, FIELD_LOGICAL: 1}.get(type, 19)
+        self.size = size
+        self.decimals = decimals
+
+    def format(self, values, count):
+        """Fixed width bytes of the field for count records (a scalar value is repeated)."""
+        if np.ndim(values) == 0:
+            return np.full(count, self.format([values], 1)[0], dtype=f"S{self.size}")
+
+        if self.type in (FIELD_NUMBER, FIELD_FLOAT):
+            values = np.array([np.nan if value is None else value for value in values], dtype=float)
+            text = np.char.mod(f"%{self.size}.{self.decimals}f", values)
+            text[~np.isfinite(values)] = ""
+            text = np.char.rjust(text, self.size)
+        elif self.type == FIELD_DATE:
+            text = np.array([
+                value.strftime("%Y%m%d") if isinstance(value, (datetime.date, datetime.datetime)) else ""
+                for value in values], dtype=str)
+        elif self.type == FIELD_LOGICAL:
+            text = np.array(["?" if value is None else ("T" if value else "F") for value in values], dtype=str)
+        else:
+            text = np.array(["" if value is None else str(value) for value in values], dtype=str)
+
+        if len(text) == 0:
+            return np.empty(0, dtype=f"S{self.size}")
+        encoded = np.char.encode(text, ENCODING).astype(f"S{self.size}")
+        if self.type in (FIELD_NUMBER, FIELD_FLOAT):
+            return np.char.rjust(encoded, self.size)
+        return np.char.ljust(encoded, self.size)
+
+def _interleave(blocks, count):
+    """
+    Concatenates per feature byte blocks: blocks is a list of (bytes, lengths)
+    where bytes is a flat uint8 array of all features and lengths the number
+    of bytes of every feature. Returns the buffer and the size of every feature.
+    """
+    sizes = np.zeros(count, dtype=np.int64)
+    for _, lengths in blocks:
+        sizes += lengths
+    starts = np.cumsum(sizes) - sizes
+    buffer = np.empty(int(sizes.sum()), dtype=np.uint8)
+
+    position = starts.copy()
+    for data, lengths in blocks:
+        lengths = np.asarray(lengths, dtype=np.int64)
+        first = np.cumsum(lengths) - lengths
+        destination = np.repeat(position - first, lengths) + np.arange(int(lengths.sum()))
+        buffer[destination] = data
+        position += lengths
+    return buffer, sizes
+
+def _as_bytes(array, dtype):
+    return np.ascontiguousarray(array, dtype=dtype).view(np.uint8).ravel()
+
+class ShapefileWriter:
+    '''Writer of one shapefile, features are added in chunks of arrays'''
+    def __init__(self, path, shape_type, fields, prj=None):
+        self.path = os.path.splitext(path)[0]
+        self.shape_type = shape_type
+        self.has_z = shape_type in Z_SHAPE_TYPES
+        self.fields = fields
+        self.count = 0
+        # file length in bytes
+        self.shp_size = HEADER_SIZE
+        self.bounds = [np.inf, np.inf, -np.inf, -np.inf]
+        self.z_range = [np.inf, -np.inf]
+
+        self.shp_file = open(self.path + ".shp", "wb")
+        self.shx_file = open(self.path + ".shx", "wb")
+        self.dbf_file = open(self.path + ".dbf", "wb")
+        self.shp_file.write(b"\0" * HEADER_SIZE)
+        self.shx_file.write(b"\0" * HEADER_SIZE)
+        self.dbf_file.write(self._get_dbf_header())
+
+        if prj:
+            with open(self.path + ".prj", "w") as prj_file:
+                prj_file.write(prj)
+        with open(self.path + ".cpg", "w") as cpg_file:
+            cpg_file.write(ENCODING)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _get_dbf_header(self):
+        today = datetime.date.today()
+        record_size = 1 + sum(field.size for field in self.fields)
+        header_size = 32 + 32 * len(self.fields) + 1
+        header = bytearray(32)
+        header[0] = 3
+        header[1:4] = bytes([today.year - 1900, today.month, today.day])
+        header[4:8] = self.count.to_bytes(4, "little")
+        header[8:10] = header_size.to_bytes(2, "little")
+        header[10:12] = record_size.to_bytes(2, "little")
+        for field in self.fields:
+            descriptor = bytearray(32)
+            descriptor[0:len(field.name)] = field.name.encode("ascii")
+            descriptor[11] = ord(field.type)
+            descriptor[16] = field.size
+            descriptor[17] = field.decimals
+            header += descriptor
+        header += b"\r"
+        return bytes(header)
+
+    def _get_file_header(self, file_size):
+        header = np.zeros(1, dtype=[
+            ("code", ">i4"), ("unused", ">i4", 5), ("length", ">i4"),
+            ("version", "<i4"), ("type", "<i4"), ("bounds", "<f8", 4),
+            ("z", "<f8", 2), ("m", "<f8", 2)])
+        header["code"] = FILE_CODE
+        header["length"] = file_size // 2
+        header["version"] = FILE_VERSION
+        header["type"] = self.shape_type
+        if self.count:
+            header["bounds"] = self.bounds
+            if self.has_z:
+                header["z"] = self.z_range
+        return header.tobytes()
+
+    def _write_records(self, contents, content_sizes, records):
+        """Writes record headers + contents to .shp, the index to .shx and the attributes to .dbf."""
+        count = len(content_sizes)
+        record_headers = np.empty(count, dtype=[("number", ">i4"), ("length", ">i4")])
+        record_headers["number"] = np.arange(self.count + 1, self.count + count + 1)
+        record_headers["length"] = content_sizes // 2
+        buffer, sizes = _interleave([
+            (record_headers.view(np.uint8), np.full(count, RECORD_HEADER_SIZE)),
+            (contents, content_sizes)], count)
+
+        index = np.empty(count, dtype=[("offset", ">i4"), ("length", ">i4")])
+        index["offset"] = (self.shp_size + np.cumsum(sizes) - sizes) // 2
+        index["length"] = content_sizes // 2
+
+        self.shp_file.write(buffer.tobytes())
+        self.shx_file.write(index.tobytes())
+        self.dbf_file.write(self._get_dbf_records(records or {}, count))
+        self.shp_size += int(sizes.sum())
+        self.count += count
+
+    def _get_dbf_records(self, records, count):
+        dbf_records = np.empty(count, dtype=[("deleted", "S1")] + [
+            (f"f{i}", f"S{field.size}") for i, field in enumerate(self.fields)])
+        dbf_records["deleted"] = b" "
+        for i, field in enumerate(self.fields):
+            dbf_records[f"f{i}"] = field.format(records.get(field.name), count)
+        return dbf_records.tobytes()
+
+    def _update_bounds(self, x, y, z):
+        if len(x) == 0:
+            return
+        self.bounds = [
+            min(self.bounds[0], float(np.min(x))), min(self.bounds[1], float(np.min(y))),
+            max(self.bounds[2], float(np.max(x))), max(self.bounds[3], float(np.max(y)))]
+        if self.has_z:
+            self.z_range = [min(self.z_range[0], float(np.min(z))), max(self.z_range[1], float(np.max(z)))]
+
+    def write_points(self, x, y, z=None, records=None):
+        """Writes point features. records maps field names to arrays or scalars."""
+        if self.shape_type not in POINT_SHAPE_TYPES:
+            raise ValueError("Not a point shapefile")
+        count = len(x)
+        if count == 0:
+            return
+        z = np.zeros(count) if z is None else z
+
+        if self.has_z:
+            contents = np.zeros(count, dtype=[("type", "<i4"), ("xyzm", "<f8", 4)])
+            contents["xyzm"][:, 2] = z
+        else:
+            contents = np.zeros(count, dtype=[("type", "<i4"), ("xyzm", "<f8", 2)])
+        contents["type"] = self.shape_type
+        contents["xyzm"][:, 0] = x
+        contents["xyzm"][:, 1] = y
+
+        self._update_bounds(x, y, z)
+        self._write_records(contents.view(np.uint8), np.full(count, contents.itemsize, dtype=np.int64), records)
+
+    def write_lines(self, x, y, z, offsets, part_counts=None, records=None):
+        """
+        Writes line or polygon features. offsets are the vertex offsets of the
+        parts, part_counts the number of parts of every feature (one part per
+        feature if None).
+        """
+        if self.shape_type in POINT_SHAPE_TYPES:
+            raise ValueError("Not a line or polygon shapefile")
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        z = np.zeros(len(x)) if z is None else np.asarray(z, dtype=float)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        part_count = len(offsets) - 1
+        if part_counts is None:
+            part_counts = np.ones(part_count, dtype=np.int64)
+        part_counts = np.asarray(part_counts, dtype=np.int64)
+        count = len(part_counts)
+        if count == 0:
+            return
+
+        # parts and vertices of every feature
+        part_offsets = np.r_[0, np.cumsum(part_counts)]
+        vertex_offsets = offsets[part_offsets]
+        vertex_counts = np.diff(vertex_offsets)
+        if np.any(vertex_counts == 0):
+            raise ValueError("Features without vertices are not supported")
+        vertex_starts = vertex_offsets[:-1]
+
+        header = np.empty(count, dtype=[
+            ("type", "<i4"), ("bounds", "<f8", 4), ("parts", "<i4"), ("points", "<i4")])
+        header["type"] = self.shape_type
+        header["bounds"][:, 0] = np.minimum.reduceat(x, vertex_starts)
+        header["bounds"][:, 1] = np.minimum.reduceat(y, vertex_starts)
+        header["bounds"][:, 2] = np.maximum.reduceat(x, vertex_starts)
+        header["bounds"][:, 3] = np.maximum.reduceat(y, vertex_starts)
+        header["parts"] = part_counts
+        header["points"] = vertex_counts
+
+        # part starts relative to the first vertex of the feature
+        feature_ids = np.repeat(np.arange(count), part_counts)
+        part_starts = offsets[:-1] - vertex_starts[feature_ids]
+
+        xy = np.empty((len(x), 2), dtype="<f8")
+        xy[:, 0] = x
+        xy[:, 1] = y
+        blocks = [
+            (header.view(np.uint8), np.full(count, header.itemsize)),
+            (_as_bytes(part_starts, "<i4"), 4 * part_counts),
+            (xy.view(np.uint8).ravel(), 16 * vertex_counts)]
+        if self.has_z:
+            z_range = np.empty((count, 2), dtype="<f8")
+            z_range[:, 0] = np.minimum.reduceat(z, vertex_starts)
+            z_range[:, 1] = np.maximum.reduceat(z, vertex_starts)
+            blocks += [
+                (z_range.view(np.uint8).ravel(), np.full(count, 16)),
+                (_as_bytes(z, "<f8"), 8 * vertex_counts)]
+
+        contents, content_sizes = _interleave(blocks, count)
+        self._update_bounds(x, y, z)
+        self._write_records(contents, content_sizes, records)
+
+    def close(self):
+        """Writes the final headers and closes the files."""
+        if self.shp_file.closed:
+            return
+        self.shp_file.seek(0)
+        self.shp_file.write(self._get_file_header(self.shp_size))
+        self.shx_file.seek(0)
+        self.shx_file.write(self._get_file_header(HEADER_SIZE + 8 * self.count))
+        self.dbf_file.write(b"\x1a")
+        self.dbf_file.seek(0)
+        self.dbf_file.write(self._get_dbf_header())
+        for shape_file in (self.shp_file, self.shx_file, self.dbf_file):
+            shape_file.close()
@@ -1,4 +1,5 @@
 import arcpy
+import instrumentation
 import utils
 
 TESSELLATION_SIZE_FACTOR = 0.9
@@ -93,6 +94,7 @@ ELEV_SOURCE_NMT = "NMT_ASCII"
 # >> number of floors ('LKOND')
 FIELD_SP_FLOORS = "Floors"
 
+@instrumentation.trace()
 def soundplan_prepare_buildings(
     buildings_bubd,
     buildings_3d,
@@ -123,7 +125,8 @@ def soundplan_prepare_buildings(
         arcpy.MakeFeatureLayer_management(buildings_bubd, buildings_bubd_layer)
         arcpy.SelectLayerByLocation_management(buildings_bubd_layer, "WITHIN", buffer_in)
     
-    arcpy.Select_analysis(buildings_bubd_layer, buildings_bubd_buf_memory)
+    with instrumentation.span("Select buildings"):
+        arcpy.Select_analysis(buildings_bubd_layer, buildings_bubd_buf_memory)
     
     if use_3d:
         arcpy.AddMessage("Preparing building 3D data...")
@@ -137,23 +140,25 @@ def soundplan_prepare_buildings(
         # Prevent long geometry calculations
         fields_3d = utils.list_field_names(buildings_3d)
         if not(FIELD_X in fields_3d and FIELD_Y in fields_3d and FIELD_ZMIN in fields_3d and FIELD_ZMAX in fields_3d):
-            arcpy.CalculateGeometryAttributes_management(
+            with instrumentation.span("CalculateGeometryAttributes 3D"):
+                arcpy.CalculateGeometryAttributes_management(
+                    buildings_3d,
+                    [[FIELD_X, "CENTROID_X"],
+                    [FIELD_Y, "CENTROID_Y"],
+                    [FIELD_ZMIN, "EXTENT_MIN_Z"],
+                    [FIELD_ZMAX, "EXTENT_MAX_Z"]]
+                )
+
+        with instrumentation.span("XYTableToPoint"):
+            arcpy.XYTableToPoint_management(
                 buildings_3d,
-                [[FIELD_X, "CENTROID_X"],
-                [FIELD_Y, "CENTROID_Y"],
-                [FIELD_ZMIN, "EXTENT_MIN_Z"],
-                [FIELD_ZMAX, "EXTENT_MAX_Z"]]
+                buildings_3d_memory,
+                FIELD_X,
+                FIELD_Y,
+                FIELD_ZMIN,
+                arcpy.Describe(buildings_3d).spatialReference
             )
 
-        arcpy.XYTableToPoint_management(
-            buildings_3d,
-            buildings_3d_memory,
-            FIELD_X,
-            FIELD_Y,
-            FIELD_ZMIN,
-            arcpy.Describe(buildings_3d).spatialReference
-        )
-
         # do not use Clip on Multipach,
         # otherwise use geo selection 
         arcpy.MakeFeatureLayer_management(buildings_3d_memory, buildings_3d_layer)
@@ -188,13 +193,14 @@ def soundplan_prepare_buildings(
             arcpy.AddWarning(str(e))
 
         arcpy.AddMessage("Joining fields...")
-        arcpy.JoinField_management(
-            buildings_bubd_buf_memory,
-            FIELD_BUBD_LOKALNYID,
-            buildings_3d_buf_memory,
-            FIELD_3D_BUILDINGID,
-            f"{FIELD_3D_AKTZRODLA};{FIELD_ZMIN};{FIELD_ZMAX}"
-        )
+        with instrumentation.span("JoinField 3D"):
+            arcpy.JoinField_management(
+                buildings_bubd_buf_memory,
+                FIELD_BUBD_LOKALNYID,
+                buildings_3d_buf_memory,
+                FIELD_3D_BUILDINGID,
+                f"{FIELD_3D_AKTZRODLA};{FIELD_ZMIN};{FIELD_ZMAX}"
+            )
         
         # legacy...
         export_building_centroids_3d = False
@@ -370,13 +376,14 @@ def soundplan_prepare_buildings(
 
     if use_elev:
         arcpy.AddMessage(f"Assigning elevation from '{field_elev}' to '{FIELD_ZMIN}'")
-        arcpy.JoinField_management(
-            buildings_bubd_buf_memory,
-            FIELD_BUBD_LOKALNYID,
-            buildings_elev_buf_memory,
-            FIELD_BUBD_LOKALNYID,
-            f"{field_elev}"
-        )
+        with instrumentation.span("JoinField elevation"):
+            arcpy.JoinField_management(
+                buildings_bubd_buf_memory,
+                FIELD_BUBD_LOKALNYID,
+                buildings_elev_buf_memory,
+                FIELD_BUBD_LOKALNYID,
+                f"{field_elev}"
+            )
         arcpy.CalculateField_management(
             buildings_bubd_memory_layer,
             FIELD_ZMIN,
@@ -437,7 +444,7 @@ def soundplan_prepare_buildings(
         fields.append("SHAPE@")
 
         with arcpy.da.SearchCursor(buildings_with_holes_fc, fields) as search_cursor:
-            for row in search_cursor:
+            for row in instrumentation.iter_spans(search_cursor, "tessellation"):
 
                 arcpy.AddMessage(f"Building '{row[0]}' Tessellation...")
 
@@ -474,7 +481,8 @@ def soundplan_prepare_buildings(
             
     arcpy.AddMessage(f"Saving {buildings_out}...")
     try:
-        arcpy.Select_analysis(buildings_bubd_buf_memory, buildings_out)
+        with instrumentation.span("Select output"):
+            arcpy.Select_analysis(buildings_bubd_buf_memory, buildings_out)
     except Exception as e:
         arcpy.AddError(str(e))
 
@@ -545,6 +553,9 @@ if __name__ == '__main__':
     
     no_holes = arcpy.GetParameter(6)
 
+    # optional .json file with the stage trace (Chrome trace format)
+    trace_path = utils.get_optional_parameter(7, None, as_text=True)
+
     soundplan_prepare_buildings(
         buildings_bubd,
         buildings_3d,
@@ -554,4 +565,6 @@ if __name__ == '__main__':
         buildings_out,
         no_holes
     )
+
+    utils.report_instrumentation(trace_path)
         
\ No newline at end of file
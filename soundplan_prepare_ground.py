@@ -1,6 +1,7 @@
 from os import utime
 import arcpy
 from soundplan_prepare_buildings import FIELD_HOLES
+import instrumentation
 import utils
 
 
@@ -57,6 +58,7 @@ GROUND_ASSIGNMENT = {
     "PTNZ02": 0.2
 }
 
+@instrumentation.trace()
 def soundplan_prepare_ground(
     workspace_bdot_in, 
     clip_area_in,
@@ -93,25 +95,30 @@ def soundplan_prepare_ground(
         return
  
     arcpy.AddMessage("Merging ground layers...")
-    arcpy.Merge_management(ground_fc_list, ground_merge_fc)
+    with instrumentation.span("Merge", inputs=len(ground_fc_list)):
+        arcpy.Merge_management(ground_fc_list, ground_merge_fc)
 
     arcpy.AddMessage("Clipping ground areas...")
-    arcpy.PairwiseClip_analysis(ground_merge_fc, clip_area_in, ground_merge_clip_fc)
+    with instrumentation.span("PairwiseClip"):
+        arcpy.PairwiseClip_analysis(ground_merge_fc, clip_area_in, ground_merge_clip_fc)
     arcpy.Delete_management(ground_merge_fc)
 
     arcpy.AddMessage("Integrating ground areas...")
-    arcpy.PairwiseIntegrate_analysis(ground_merge_clip_fc, INTEGRATE_SIZE)
+    with instrumentation.span("PairwiseIntegrate"):
+        arcpy.PairwiseIntegrate_analysis(ground_merge_clip_fc, INTEGRATE_SIZE)
 
     arcpy.AddMessage("Fixing self intersections...")
-    arcpy.PairwiseIntersect_analysis(
-        ground_merge_clip_fc,
-        ground_merge_clip_intersectSelf_fc
-    )
-    arcpy.PairwiseDissolve_analysis(
-        ground_merge_clip_intersectSelf_fc,
-        ground_merge_clip_intersectSelf_disXkod_fc,
-        FIELD_PT_XKOD
-    )
+    with instrumentation.span("PairwiseIntersect self"):
+        arcpy.PairwiseIntersect_analysis(
+            ground_merge_clip_fc,
+            ground_merge_clip_intersectSelf_fc
+        )
+    with instrumentation.span("PairwiseDissolve self"):
+        arcpy.PairwiseDissolve_analysis(
+            ground_merge_clip_intersectSelf_fc,
+            ground_merge_clip_intersectSelf_disXkod_fc,
+            FIELD_PT_XKOD
+        )
     arcpy.Delete_management(ground_merge_clip_intersectSelf_fc)
 
     # Extract only features surrounding error features to speed-up geoprocessing operations
@@ -151,6 +158,7 @@ def soundplan_prepare_ground(
 
     in_fc = ground_merge_clip_errors_fc
     out_fc = ""
+    instrumentation.add_counts(overlaps=len(ids))
     for id in ids:
         select_query = f"{field_object_id} = {id}"
         arcpy.SelectLayerByAttribute_management(
@@ -184,12 +192,13 @@ def soundplan_prepare_ground(
             cursor.updateRow(row)
 
     arcpy.AddMessage("Dissolving polygons...")
-    arcpy.PairwiseDissolve_analysis(
-        ground_merge_clip_fc,
-        ground_merge_clip_disG_fc,
-        FIELD_G,
-        multi_part="SINGLE_PART" # must be singlepart to use selection by area
-    )
+    with instrumentation.span("PairwiseDissolve G"):
+        arcpy.PairwiseDissolve_analysis(
+            ground_merge_clip_fc,
+            ground_merge_clip_disG_fc,
+            FIELD_G,
+            multi_part="SINGLE_PART" # must be singlepart to use selection by area
+        )
     arcpy.CalculateGeometryAttributes_management(
         ground_merge_clip_disG_fc,
         [[FIELD_AREA, "AREA"]]
@@ -206,7 +215,8 @@ def soundplan_prepare_ground(
     arcpy.DeleteFeatures_management(ground_merge_clip_disG_lyr)
 
     arcpy.AddMessage("Filling holes...")
-    arcpy.PairwiseErase_analysis(clip_area_in, ground_merge_clip_disG_fc, holes_fc)
+    with instrumentation.span("PairwiseErase holes"):
+        arcpy.PairwiseErase_analysis(clip_area_in, ground_merge_clip_disG_fc, holes_fc)
 
     arcpy.MultipartToSinglepart_management(holes_fc, holes_single_fc)
 
@@ -217,11 +227,12 @@ def soundplan_prepare_ground(
         f"!{field_object_id}!"
     )
     
-    arcpy.PairwiseIntersect_analysis(
-        [holes_single_fc, ground_merge_clip_disG_fc],
-        holes_single_intersect_ground_fc,
-        output_type="LINE"
-    )
+    with instrumentation.span("PairwiseIntersect holes"):
+        arcpy.PairwiseIntersect_analysis(
+            [holes_single_fc, ground_merge_clip_disG_fc],
+            holes_single_intersect_ground_fc,
+            output_type="LINE"
+        )
 
     arcpy.CalculateField_management(
         holes_single_intersect_ground_fc,
@@ -279,12 +290,13 @@ def soundplan_prepare_ground(
 
     arcpy.AddMessage(f"Saving ground areas to: {ground_out}...")
     
-    arcpy.PairwiseDissolve_analysis(
-        ground_merge_clip_disG_fc,
-        ground_out,
-        FIELD_G,
-        multi_part="SINGLE_PART"
-    )
+    with instrumentation.span("PairwiseDissolve output"):
+        arcpy.PairwiseDissolve_analysis(
+            ground_merge_clip_disG_fc,
+            ground_out,
+            FIELD_G,
+            multi_part="SINGLE_PART"
+        )
 
     if check_output_topology:
         arcpy.AddMessage("Checking output topology...")
@@ -338,10 +350,15 @@ if __name__ == '__main__':
     if not check_output_topology:
         check_output_topology = True
 
+    # optional .json file with the stage trace (Chrome trace format)
+    trace_path = utils.get_optional_parameter(5, None, as_text=True)
+
     soundplan_prepare_ground(
         workspace_bdot_in, 
         clip_area_in,
         min_hole_area_in,
         ground_out,
         check_output_topology
-    )
\ No newline at end of file
+    )
+
+    utils.report_instrumentation(trace_path)
@@ -1,18 +1,23 @@
 import arcpy
+import instrumentation
+import utils
 
 def calculate_new_field(fc, field_name, field_type, expression=""):
     try:
         try:
-            arcpy.AddField_management(fc, field_name, field_type)
+            with instrumentation.span(f"AddField {field_name}"):
+                arcpy.AddField_management(fc, field_name, field_type)
         except Exception as e:
             arcpy.AddWarning(f"Add field '{field_name}' failed!")
             arcpy.AddWarning(e)
 
-        arcpy.CalculateField_management(fc, field_name, expression, "PYTHON_9.3")
+        with instrumentation.span(f"CalculateField {field_name}"):
+            arcpy.CalculateField_management(fc, field_name, expression, "PYTHON_9.3")
     except Exception as e:
         arcpy.AddWarning(f"Calculate field '{field_name}' failed!")
         arcpy.AddWarning(e)
         
+@instrumentation.trace()
 def suondplan_add_road_properties(
     road_in_fc,
     field_name,
@@ -29,7 +34,8 @@ def suondplan_add_road_properties(
 ):
     # work in memory
     road_mem_fc = "in_memory\\road"
-    arcpy.CopyFeatures_management(road_in_fc, road_mem_fc)
+    with instrumentation.span("CopyFeatures input"):
+        arcpy.CopyFeatures_management(road_in_fc, road_mem_fc)
     
     road_lyr = "road_lyr"
     arcpy.MakeFeatureLayer_management(road_mem_fc, road_lyr)
@@ -119,7 +125,8 @@ def suondplan_add_road_properties(
     calculate_new_field(road_mem_fc, "AirTemp", "SHORT", 10)
 
     arcpy.AddMessage(f"Saving {road_out_fc}...")
-    arcpy.CopyFeatures_management(road_mem_fc, road_out_fc)
+    with instrumentation.span("CopyFeatures output"):
+        arcpy.CopyFeatures_management(road_mem_fc, road_out_fc)
     arcpy.AddMessage("Cleaning...")
     arcpy.Delete_management(road_mem_fc)
 
@@ -143,6 +150,8 @@ if __name__ == "__main__":
     bridge_thickness = arcpy.GetParameter(9)
     surface_id = arcpy.GetParameter(10)
     road_out_fc = arcpy.GetParameterAsText(11)
+    # optional .json file with the stage trace (Chrome trace format)
+    trace_path = utils.get_optional_parameter(12, None, as_text=True)
     
     suondplan_add_road_properties(
         road_in_fc,
@@ -158,4 +167,5 @@ if __name__ == "__main__":
         surface_id,
         road_out_fc
     )
-    
\ No newline at end of file
+
+    utils.report_instrumentation(trace_path)
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import nmt_asc
+
+
+def parse_reference(data):
+    """The original line-by-line parser (blank lines are skipped without an error)."""
+    x, y, z, errors = [], [], [], []
+    for i, line in enumerate(data.decode().splitlines()):
+        if not line.strip():
+            continue
+        try:
+            x_i, y_i, z_i = nmt_asc.parse_xyz_line(line)
+        except (ValueError, IndexError):
+            errors.append(i + 1)
+            continue
+        x.append(x_i)
+        y.append(y_i)
+        z.append(z_i)
+    return x, y, z, errors
+
+def parse(data):
+    errors = []
+    x, y, z = nmt_asc.parse_points(data, lambda line_number, line: errors.append(line_number))
+    return x.tolist(), y.tolist(), z.tolist(), errors
+
+def get_grid_text(row_count, seed=0):
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.uniform(0, 1000000, (row_count, 3)), 2)
+    return "".join(f"{a:.2f} {b:.2f} {c:.2f}\n" for a, b, c in values.tolist())
+
+CASES = {
+    "well_formed": b"5600000.10 400000.20 101.30\n5600001.10 400001.20 102.30\n",
+    "crlf": b"1 2 3\r\n4 5 6\r\n",
+    "four_columns": b"1 2 3 4\n5 6\n",
+    "ragged": b"1 2 3\n4 5\n6 7 8 9\n",
+    "ragged_same_total": b"1 2\n3 4 5 6\n7 8 9\n",
+    "blank": b"1 2 3\n\n4 5 6\n   \n7 8 9\n",
+    "comma_decimal": b"1,5 2,5 3,5\n4.0 5.0 6.0\n",
+    "trailing_garbage": b"1 2 3\n4 5 6 abc\n7 8 9x\n",
+    "no_final_newline": b"1 2 3\n4 5 6",
+    "empty": b"",
+}
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_parse_points_matches_reference(name):
+    assert parse(CASES[name]) == parse_reference(CASES[name])
+
+def test_parse_points_ragged_rows_are_errors():
+    assert parse(b"1 2 3 4\n5 6\n") == ([2.0], [1.0], [3.0], [2])
+    assert parse(b"1 2 3\n4 5\n6 7 8 9\n") == ([2.0, 7.0], [1.0, 6.0], [3.0, 8.0], [2])
+
+def test_parse_points_split_matches_reference():
+    lines = get_grid_text(1000).splitlines(keepends=True)
+    lines[10] = "1 2\n"
+    lines[500] = "1,0 2,0 3,0\n"
+    lines[700] = "4 5 6 7 8\n"
+    data = "".join(lines).encode()
+    assert parse(data) == parse_reference(data)
+
+def test_iter_point_chunks_matches_reference(tmp_path):
+    lines = get_grid_text(5000, seed=1).splitlines(keepends=True)
+    lines[1234] = "garbage\n"
+    lines[4000] = "\n"
+    data = "".join(lines).encode()
+    path = tmp_path / "N-34-139-A-c-1-1_p.asc"
+    path.write_bytes(data)
+
+    errors = []
+    x, y, z = nmt_asc.concatenate_chunks(nmt_asc.iter_point_chunks(
+        str(path), chunk_size=4096, on_error=lambda line_number, line: errors.append(line_number)))
+    assert (x.tolist(), y.tolist(), z.tolist(), errors) == parse_reference(data)
+
+def test_parse_lines_ragged_vertex():
+    data = b"Start\n1 2 3\n4 5\n6 7 8\nEnd\nStart\n1 1 1\n2 2 2\nEnd\n"
+    errors = []
+    line_data = nmt_asc.parse_lines(data, lambda line_number, line: errors.append(line_number))
+    assert errors == [3]
+    assert line_data.offsets.tolist() == [0, 2, 4]
+    assert line_data.x.tolist() == [2.0, 7.0, 1.0, 2.0]
+    assert line_data.end_line_numbers.tolist() == [5, 9]
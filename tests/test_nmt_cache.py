@@ -0,0 +1,96 @@
+import functools
+
+import numpy as np
+import pytest
+
+import nmt_asc
+import nmt_cache
+import nmt_sheets
+
+
+def write_point_file(path, row_count, seed=0):
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.uniform(0, 1000000, (row_count, 3)), 2)
+    path.write_text("".join(f"{a:.2f} {b:.2f} {c:.2f}\n" for a, b, c in values.tolist()))
+    return path.read_bytes()
+
+def write_line_file(path, line_count, seed=0):
+    rng = np.random.default_rng(seed)
+    blocks = []
+    for _ in range(line_count):
+        values = np.round(rng.uniform(0, 1000000, (int(rng.integers(1, 6)), 3)), 2)
+        blocks.append("Start\n" + "".join(f"{a:.2f} {b:.2f} {c:.2f}\n" for a, b, c in values.tolist()) + "End\n")
+    path.write_text("".join(blocks))
+    return path.read_bytes()
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """Files read in many chunks."""
+    monkeypatch.setattr(nmt_asc, "iter_point_chunks", functools.partial(nmt_asc.iter_point_chunks, chunk_size=1024))
+    monkeypatch.setattr(nmt_asc, "iter_line_chunks", functools.partial(nmt_asc.iter_line_chunks, chunk_size=1024))
+
+def test_write_columns_chunks(tmp_path):
+    path = str(tmp_path / "columns.nmtc")
+    chunks = [np.arange(3.0), np.empty(0), np.arange(5.0)]
+    nmt_cache.write_columns(path, {"x": chunks, "empty": [], "offsets": np.array([0, 2, 8])}, {"a": 1})
+    columns, metadata = nmt_cache.read_columns(path)
+    assert columns["x"].tolist() == np.concatenate(chunks).tolist()
+    assert len(columns["empty"]) == 0
+    assert columns["offsets"].tolist() == [0, 2, 8]
+    assert metadata == {"a": 1}
+
+@pytest.mark.parametrize("quantize", [False, True])
+def test_cache_points_match_parser(tmp_path, small_chunks, quantize):
+    data = write_point_file(tmp_path / "A_p.asc", 500)
+    cache = nmt_cache.ParseCache(str(tmp_path / "cache"), quantize=quantize)
+    expected = nmt_asc.parse_points(data)
+    for _ in range(2):
+        x, y, z = cache.get_points(str(tmp_path / "A_p.asc"))
+        for values, expected_values in zip((x, y, z), expected):
+            assert np.array_equal(values, expected_values)
+
+@pytest.mark.parametrize("quantize", [False, True])
+def test_cache_lines_match_parser(tmp_path, small_chunks, quantize):
+    data = write_line_file(tmp_path / "A_s.asc", 200)
+    cache = nmt_cache.ParseCache(str(tmp_path / "cache"), quantize=quantize)
+    expected = nmt_asc.parse_lines(data)
+    for _ in range(2):
+        line_data = cache.get_lines(str(tmp_path / "A_s.asc"))
+        for name in nmt_cache.LINE_COLUMNS:
+            assert np.array_equal(getattr(line_data, name), getattr(expected, name))
+
+def test_read_sheet_keeps_chunks(tmp_path, small_chunks):
+    point_data = write_point_file(tmp_path / "A_p.asc", 500)
+    line_data = write_line_file(tmp_path / "A_s.asc", 200)
+    sheet = nmt_sheets.read_sheet("A", [("p", str(tmp_path / "A_p.asc"))], [("s", str(tmp_path / "A_s.asc"))])
+
+    assert len(sheet.points) > 1
+    x, y, z = nmt_asc.concatenate_chunks(values for _, *values in sheet.points)
+    for values, expected_values in zip((x, y, z), nmt_asc.parse_points(point_data)):
+        assert np.array_equal(values, expected_values)
+
+    assert len(sheet.lines) > 1
+    lines = nmt_asc.concatenate_lines([line_data for _, _, line_data in sheet.lines])
+    expected = nmt_asc.parse_lines(line_data)
+    for name in nmt_cache.LINE_COLUMNS:
+        assert np.array_equal(getattr(lines, name), getattr(expected, name))
+    all_x = np.concatenate([x, lines.x])
+    all_y = np.concatenate([y, lines.y])
+    assert sheet.bounds == (all_x.min(), all_y.min(), all_x.max(), all_y.max())
+
+def test_changed_file_replaces_entry(tmp_path):
+    path = tmp_path / "A_p.asc"
+    other_path = tmp_path / "B_p.asc"
+    write_point_file(path, 10)
+    write_point_file(other_path, 10)
+    cache = nmt_cache.ParseCache(str(tmp_path / "cache"))
+    cache.get_points(str(path))
+    cache.get_points(str(other_path))
+    old_entry_path = cache.get_entry_path(str(path))
+
+    path.write_text("1.00 2.00 3.00\n")
+    x, y, z = cache.get_points(str(path))
+    assert (x.tolist(), y.tolist(), z.tolist()) == ([2.0], [1.0], [3.0])
+    entry_paths = [entry_path for entry_path, _, _ in cache.list_entries()]
+    assert old_entry_path not in entry_paths
+    assert sorted(entry_paths) == sorted([cache.get_entry_path(str(path)), cache.get_entry_path(str(other_path))])
@@ -0,0 +1,107 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import nmt_catalog
+import nmt_geometry
+import nmt_godlo
+import nmt_sheets
+
+SHEETS = ["N-34-139-A-c-1-1", "N-34-139-A-c-1-2", "N-34-139-A-c-1-3", "N-34-139-A-c-2", "N-34-139-A-d-3-4"]
+
+
+def touch(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def write_tree(root):
+    """root/a: 2 sheets, root/b/c: 2 sheets, root/x: an unrecognized sheet symbol."""
+    files = {
+        "a": [f"{SHEETS[0]}_p.asc", f"{SHEETS[0]}_s.asc", f"{SHEETS[1]}_p.ASC", "readme.txt"],
+        os.path.join("b", "c"): [f"{SHEETS[2]}_p.asc", f"{SHEETS[3]}_p.asc"],
+        "b": [f"{SHEETS[4]}_s.asc"],
+        "x": ["unknown_p.asc"]}
+    for directory, names in files.items():
+        os.makedirs(root / directory, exist_ok=True)
+        for name in names:
+            (root / directory / name).write_text("1 2 3\n")
+
+@pytest.fixture(params=[True, False], ids=["rtree", "columns"])
+def catalog(request, tmp_path):
+    with nmt_catalog.Catalog(str(tmp_path / "catalog.sqlite")) as catalog:
+        if request.param:
+            if not catalog.has_rtree:
+                pytest.skip("SQLite without the R-tree module")
+        else:
+            catalog.has_rtree = False
+        yield catalog
+
+def test_update_incremental(tmp_path, catalog):
+    root = tmp_path / "tbd"
+    write_tree(root)
+    assert catalog.update(str(root)) == (5, 0, 0)
+    assert catalog.get_asc_files_dict(str(root)) == nmt_sheets.get_asc_files_dict(str(root))
+    assert catalog.update(str(root)) == (0, 5, 0)
+
+    # a new file changes the modification time of its directory only
+    a_mtime = os.stat(root / "a").st_mtime_ns
+    (root / "a" / f"{SHEETS[1]}_s.asc").write_text("1 2 3\n")
+    touch(root / "a", a_mtime + 10 ** 9)
+    assert catalog.update(str(root)) == (1, 4, 0)
+    assert f"{SHEETS[1]}_s" in catalog.get_asc_files_dict(str(root))
+
+    # a removed subtree
+    b_mtime = os.stat(root / "b").st_mtime_ns
+    shutil.rmtree(root / "b" / "c")
+    touch(root / "b", b_mtime + 10 ** 9)
+    assert catalog.update(str(root)) == (1, 3, 1)
+    assert catalog.get_asc_files_dict(str(root)) == nmt_sheets.get_asc_files_dict(str(root))
+    assert f"{SHEETS[2]}_p" not in catalog.get_asc_files_dict(str(root))
+
+    # the removed root
+    shutil.rmtree(root)
+    assert catalog.update(str(root)) == (0, 0, 4)
+    assert catalog.get_asc_files_dict(str(root)) == {}
+
+def test_file_changed_in_place_keeps_directory(tmp_path, catalog):
+    root = tmp_path / "tbd"
+    write_tree(root)
+    catalog.update(str(root))
+    a_mtime = os.stat(root / "a").st_mtime_ns
+    (root / "a" / f"{SHEETS[0]}_p.asc").write_text("1 2 3\n4 5 6\n")
+    touch(root / "a", a_mtime)
+    # the directory is not listed again, the fingerprints of nmt_cache detect the change
+    assert catalog.update(str(root)) == (0, 5, 0)
+
+def test_query_bounds(tmp_path, catalog):
+    root = tmp_path / "tbd"
+    write_tree(root)
+    catalog.update(str(root))
+    files = nmt_sheets.get_asc_files_dict(str(root))
+    sheet_bounds = {sheet: nmt_godlo.get_sheet_bounds(sheet) for sheet in SHEETS}
+
+    rng = np.random.default_rng(5)
+    x_min, y_min = np.min([bounds[:2] for bounds in sheet_bounds.values()], axis=0) - 1000
+    x_max, y_max = np.max([bounds[2:] for bounds in sheet_bounds.values()], axis=0) + 1000
+    queries = [
+        # inside one sheet, away from its neighbours
+        tuple(np.add(sheet_bounds[SHEETS[0]], (100, 100, -100, -100))),
+        # outside of all sheets
+        (0.0, 0.0, 10.0, 10.0)]
+    for _ in range(50):
+        x = np.sort(rng.uniform(x_min, x_max, 2))
+        y = np.sort(rng.uniform(y_min, y_max, 2))
+        queries.append((x[0], y[0], x[1], y[1]))
+
+    for query in queries:
+        expected = {
+            name: path for name, path in files.items()
+            if name == "unknown_p" or nmt_geometry.bounds_intersect(sheet_bounds[name.split("_")[0]], query)}
+        assert catalog.get_asc_files_dict(str(root), query) == expected
+
+    assert set(catalog.get_asc_files_dict(str(root), queries[0])) == {
+        f"{SHEETS[0]}_p", f"{SHEETS[0]}_s", "unknown_p"}
+    # files of unrecognized sheets are always selected
+    assert set(catalog.get_asc_files_dict(str(root), queries[1])) == {"unknown_p"}
+    assert [sheet_bounds for path, sheet, *_, sheet_bounds in catalog.get_files(str(root), queries[1])] == [None]
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+import nmt_dem
+
+
+def grid_reference(grid, batches):
+    """(statistic of every cell computed point by point, NODATA in empty cells; number of points in the grid)."""
+    cells = {}
+    for x, y, z in batches:
+        for px, py, pz in zip(x, y, z):
+            column = int(np.floor((px - grid.x_min) / grid.cell_size))
+            row = int(np.floor((grid.y_max - py) / grid.cell_size))
+            if 0 <= column < grid.columns and 0 <= row < grid.rows:
+                cells.setdefault((row, column), []).append(pz)
+
+    expected = np.full((grid.rows, grid.columns), nmt_dem.NODATA)
+    for (row, column), values in cells.items():
+        if grid.statistic == nmt_dem.STAT_MEAN:
+            expected[row, column] = np.mean(values)
+        elif grid.statistic == nmt_dem.STAT_MIN:
+            expected[row, column] = np.float32(min(values))
+        else:
+            expected[row, column] = np.float32(max(values))
+    return expected.astype(np.float32), sum(len(values) for values in cells.values())
+
+def get_batches(seed, count=3, size=400):
+    rng = np.random.default_rng(seed)
+    batches = []
+    for _ in range(count):
+        # some points outside the bounds of the grid
+        x = rng.uniform(-2, 22, size)
+        y = rng.uniform(-2, 12, size)
+        z = np.round(rng.uniform(100, 110, size), 2)
+        batches.append((x, y, z))
+    return batches
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(nmt_dem, "ROW_BLOCK_SIZE", 3)
+
+@pytest.mark.parametrize("statistic", nmt_dem.STATISTICS)
+@pytest.mark.parametrize("seed", range(5))
+def test_grid_matches_reference(tmp_path, small_blocks, statistic, seed):
+    grid = nmt_dem.DemGrid((0.5, 0.5, 20.0, 10.0), 1.5, statistic, str(tmp_path))
+    try:
+        batches = get_batches(seed)
+        added = sum(grid.add_points(x, y, z) for x, y, z in batches)
+        expected, expected_added = grid_reference(grid, batches)
+        result = np.concatenate(list(grid.iter_row_blocks()))
+        assert added == expected_added
+        assert result.shape == (grid.rows, grid.columns)
+        assert np.allclose(result, expected, rtol=0, atol=1e-4)
+        assert np.array_equal(result == nmt_dem.NODATA, expected == nmt_dem.NODATA)
+    finally:
+        grid.close()
+
+def test_grid_snapped_to_cell_size(tmp_path):
+    grid = nmt_dem.DemGrid((0.5, 0.7, 20.0, 10.0), 2.0, temp_folder=str(tmp_path))
+    try:
+        assert (grid.x_min, grid.y_min, grid.columns, grid.rows, grid.y_max) == (0.0, 0.0, 10, 5, 10.0)
+    finally:
+        grid.close()
+
+def test_written_grids(tmp_path, small_blocks):
+    grid = nmt_dem.DemGrid((0.0, 0.0, 8.0, 8.0), 1.0, temp_folder=str(tmp_path))
+    try:
+        batches = get_batches(0)
+        for x, y, z in batches:
+            grid.add_points(x, y, z)
+        expected, _ = grid_reference(grid, batches)
+
+        grid.write(str(tmp_path / "dem.asc"))
+        with open(tmp_path / "dem.asc") as asc_file:
+            header = [next(asc_file).split() for _ in range(6)]
+            values = np.loadtxt(asc_file)
+        assert dict(header)["ncols"] == "8" and dict(header)["nrows"] == "8"
+        assert np.allclose(values, expected, rtol=0, atol=0.005)
+
+        grid.write(str(tmp_path / "dem.flt"))
+        values = np.fromfile(tmp_path / "dem.flt", dtype="<f4").reshape(grid.rows, grid.columns)
+        assert np.allclose(values, expected, rtol=0, atol=1e-4)
+        assert (tmp_path / "dem.hdr").exists()
+
+        with pytest.raises(ValueError):
+            grid.write(str(tmp_path / "dem.tif"))
+    finally:
+        grid.close()
+
+@pytest.mark.parametrize("cell_size", [0, -1.0])
+def test_invalid_cell_size(tmp_path, cell_size):
+    with pytest.raises(ValueError):
+        nmt_dem.DemGrid((0.0, 0.0, 8.0, 8.0), cell_size, temp_folder=str(tmp_path))
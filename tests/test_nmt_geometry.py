@@ -0,0 +1,575 @@
+import numpy as np
+import pytest
+
+import nmt_geometry
+
+
+def unique_points_reference(x, y, tolerance):
+    """A point is removed if an earlier kept point is at most tolerance away."""
+    kept = []
+    for j in range(len(x)):
+        if not any(np.hypot(x[j] - x[i], y[j] - y[i]) <= tolerance for i in kept):
+            kept.append(j)
+    mask = np.zeros(len(x), dtype=bool)
+    mask[kept] = True
+    return mask
+
+def test_unique_points_across_cell_border():
+    # 1.0024 and 1.0026 fall into different cells of a 0.005 grid
+    x = np.array([0.0, 1.0024, 1.0026, 2.0])
+    y = np.zeros(4)
+    assert nmt_geometry.get_unique_points_mask(x, y, 0.005).tolist() == [True, True, False, True]
+
+def test_unique_points_keeps_first():
+    x = np.array([5.0, 1.0, 5.0, 1.0, 1.0])
+    y = np.array([5.0, 1.0, 5.0, 1.0, 2.0])
+    assert nmt_geometry.get_unique_points_mask(x, y, 0.005).tolist() == [True, True, False, False, True]
+
+def test_unique_points_chain():
+    # the third point is close to the second one only, which is removed
+    x = np.array([0.0, 0.004, 0.008])
+    assert nmt_geometry.get_unique_points_mask(x, np.zeros(3), 0.005).tolist() == [True, False, True]
+
+@pytest.mark.parametrize("seed", range(20))
+def test_unique_points_match_reference(seed):
+    rng = np.random.default_rng(seed)
+    count = int(rng.integers(1, 300))
+    x = np.round(rng.uniform(0, 0.1, count), 3)
+    y = np.round(rng.uniform(0, 0.1, count), 3)
+    tolerance = float(rng.choice([0.005, 0.01, 0.02]))
+    assert np.array_equal(
+        nmt_geometry.get_unique_points_mask(x, y, tolerance), unique_points_reference(x, y, tolerance))
+
+def test_close_point_pairs_match_reference():
+    rng = np.random.default_rng(1)
+    x = rng.uniform(0, 1, 400)
+    y = rng.uniform(0, 1, 400)
+    first, second = nmt_geometry.get_close_point_pairs(x, y, 0.03)
+    distances = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+    expected = set(zip(*np.nonzero(np.triu(distances <= 0.03, 1))))
+    assert set(zip(first.tolist(), second.tolist())) == expected
+
+def thinning_reference(x, y, z, cell_size, z_tolerance, keep):
+    """Cell by cell: a flat cell keeps its point closest to the middle of the Z range (the first on ties)."""
+    cells = {}
+    for i in range(len(x)):
+        cell = (int(np.floor((x[i] - x.min()) / cell_size)), int(np.floor((y[i] - y.min()) / cell_size)))
+        cells.setdefault(cell, []).append(i)
+
+    mask = np.array(keep, dtype=bool)
+    max_deviation = 0.0
+    for indices in cells.values():
+        cell_z = [z[i] for i in indices]
+        if max(cell_z) - min(cell_z) > z_tolerance:
+            mask[indices] = True
+            continue
+        middle = (min(cell_z) + max(cell_z)) / 2
+        representative = min(indices, key=lambda i: (abs(z[i] - middle), i))
+        mask[representative] = True
+        for i in indices:
+            if not mask[i]:
+                max_deviation = max(max_deviation, abs(z[i] - z[representative]))
+    return mask, max_deviation
+
+@pytest.mark.parametrize("seed", range(10))
+def test_thinning_mask_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    count = 500
+    x = rng.uniform(0, 10, count)
+    y = rng.uniform(0, 10, count)
+    z = np.round(rng.uniform(0, 0.5, count), 2)
+    keep = rng.random(count) < 0.05
+    mask, max_deviation = nmt_geometry.get_thinning_mask(x, y, z, 1.0, 0.3, keep)
+    expected_mask, expected_deviation = thinning_reference(x, y, z, 1.0, 0.3, keep)
+    assert np.array_equal(mask, expected_mask)
+    assert max_deviation == pytest.approx(expected_deviation)
+
+def test_thinning_mask_keeps_steep_cells():
+    x = np.array([0.1, 0.2, 0.3, 1.1, 1.2])
+    y = np.zeros(5)
+    z = np.array([10.0, 10.1, 10.2, 10.0, 15.0])
+    mask, max_deviation = nmt_geometry.get_thinning_mask(x, y, z, 1.0, 0.5)
+    assert mask.tolist() == [False, True, False, True, True]
+    assert max_deviation == pytest.approx(0.1)
+
+def simplify_reference(points, xy_tolerance, z_tolerance):
+    """
+    Recursive 3D Douglas-Peucker of one line: indices of the kept vertices.
+    Deviations over a zero tolerance are infinite errors, the largest of them
+    splits the interval.
+    """
+    def ratio(deviation, tolerance):
+        if tolerance is None:
+            return 0.0, 0.0
+        if tolerance <= 0:
+            return (np.inf, deviation) if deviation > 0 else (0.0, 0.0)
+        return deviation / tolerance, 0.0
+
+    if xy_tolerance is None:
+        xy_tolerance = 0.0
+
+    def split(start, end):
+        (ax, ay, az), (bx, by, bz) = points[start], points[end]
+        dx, dy, dz = bx - ax, by - ay, bz - az
+        length_2 = dx * dx + dy * dy
+        best, best_error = None, (-1.0, 0.0)
+        for i in range(start + 1, end):
+            px, py = points[i][0] - ax, points[i][1] - ay
+            t = min(max((px * dx + py * dy) / length_2, 0.0), 1.0) if length_2 > 0 else 0.0
+            xy_error, xy_deviation = ratio(np.hypot(px - t * dx, py - t * dy), xy_tolerance)
+            z_error, z_deviation = ratio(abs(points[i][2] - az - t * dz), z_tolerance)
+            error = (max(xy_error, z_error), xy_deviation + z_deviation if max(xy_error, z_error) == np.inf else 0.0)
+            if error > best_error:
+                best, best_error = i, error
+        if best is None or best_error[0] <= 1.0:
+            return []
+        return split(start, best) + [best] + split(best, end)
+
+    if len(points) == 0:
+        return []
+    if len(points) == 1:
+        return [0]
+    return [0] + split(0, len(points) - 1) + [len(points) - 1]
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("xy_tolerance, z_tolerance", [
+    (1.5, None), (1.5, 0.0), (1.5, 0.5), (None, 0.5), (0.0, 0.0)])
+def test_simplified_mask_matches_recursive_reference(seed, xy_tolerance, z_tolerance):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, 40, 12)
+    offsets = np.r_[0, np.cumsum(counts)]
+    x = np.cumsum(rng.normal(0, 1, offsets[-1]))
+    y = np.cumsum(rng.normal(0, 1, offsets[-1]))
+    # rounded steps give repeated vertices and ties of the deviation
+    z = np.round(np.cumsum(rng.normal(0, 0.5, offsets[-1])), 1)
+    if xy_tolerance is None:
+        # straight runs in XY, only they can be simplified without an XY tolerance
+        x = np.round(x)
+        y = np.where(rng.random(offsets[-1]) < 0.7, 0.0, y)
+    mask = nmt_geometry.get_simplified_mask(x, y, z, offsets, xy_tolerance, z_tolerance)
+
+    expected = np.zeros(len(x), dtype=bool)
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        points = list(zip(x[start:end], y[start:end], z[start:end]))
+        expected[start + np.array(simplify_reference(points, xy_tolerance, z_tolerance), dtype=np.int64)] = True
+    assert np.array_equal(mask, expected)
+
+def test_simplified_mask_keeps_z_break_of_straight_line():
+    x = np.arange(5.0)
+    y = np.zeros(5)
+    z = np.array([0.0, 0.0, 2.0, 0.0, 0.0])
+    offsets = np.array([0, 5])
+    assert nmt_geometry.get_simplified_mask(x, y, z, offsets, 1.0).tolist() == [True, False, False, False, True]
+    assert nmt_geometry.get_simplified_mask(x, y, z, offsets, 1.0, 1.0).tolist() == [True, False, True, False, True]
+
+def test_simplified_mask_z_only_keeps_xy_shape():
+    # straight in XY from vertex 0 to 3, a corner at 3, a Z break at 1
+    x = np.array([0.0, 1.0, 2.0, 3.0, 3.0, 3.0])
+    y = np.array([0.0, 0.0, 0.0, 0.0, 0.1, 5.0])
+    z = np.array([0.0, 2.0, 0.2, 0.0, 0.0, 0.0])
+    offsets = np.array([0, 6])
+    mask = nmt_geometry.get_simplified_mask(x, y, z, offsets, None, 1.0)
+    assert mask.tolist() == [True, True, False, True, False, True]
+    assert np.array_equal(mask, nmt_geometry.get_simplified_mask(x, y, z, offsets, 0.0, 1.0))
+
+def clip_reference(points, bounds):
+    """
+    Parts of one line inside the rectangle: every segment is cut at its
+    crossings with the edge lines and the pieces with the middle inside are kept.
+    """
+    x_min, y_min, x_max, y_max = bounds
+
+    def is_inside(px, py):
+        return x_min <= px <= x_max and y_min <= py <= y_max
+
+    def get_point(start, end, t):
+        return tuple(a + t * (b - a) for a, b in zip(start, end))
+
+    parts = []
+    previous_end = None
+    for start, end in zip(points[:-1], points[1:]):
+        dx, dy = end[0] - start[0], end[1] - start[1]
+        if dx == 0 and dy == 0:
+            pieces = [(0.0, 1.0)] if is_inside(*start[:2]) else []
+        else:
+            ts = {0.0, 1.0}
+            for edge, origin, delta in ((x_min, start[0], dx), (x_max, start[0], dx), (y_min, start[1], dy), (y_max, start[1], dy)):
+                if delta != 0 and 0 < (edge - origin) / delta < 1:
+                    ts.add((edge - origin) / delta)
+            ts = sorted(ts)
+            inside = [(a, b) for a, b in zip(ts[:-1], ts[1:]) if is_inside(*get_point(start, end, (a + b) / 2)[:2])]
+            # the rectangle is convex: one interval at most
+            pieces = [(inside[0][0], inside[-1][1])] if inside else []
+
+        for t0, t1 in pieces:
+            if not (previous_end == 1.0 and t0 == 0.0):
+                parts.append([get_point(start, end, t0)])
+            parts[-1].append(get_point(start, end, t1))
+        previous_end = pieces[-1][1] if pieces else None
+    return parts
+
+def get_clipped_parts(x, y, z, part_offsets, part_counts):
+    parts = [list(zip(x[start:end], y[start:end], z[start:end])) for start, end in zip(part_offsets[:-1], part_offsets[1:])]
+    line_offsets = np.r_[0, np.cumsum(part_counts)]
+    return [parts[start:end] for start, end in zip(line_offsets[:-1], line_offsets[1:])]
+
+@pytest.mark.parametrize("seed", range(20))
+def test_clip_lines_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, 30, 15)
+    offsets = np.r_[0, np.cumsum(counts)]
+    # integer steps (zero ones too): vertices and segments on the boundary
+    x = np.cumsum(rng.integers(-3, 4, offsets[-1])).astype(float)
+    y = np.cumsum(rng.integers(-3, 4, offsets[-1])).astype(float)
+    z = rng.uniform(100, 110, offsets[-1])
+    bounds = (-5.0, -4.0, 6.0, 5.0)
+    clipped = nmt_geometry.clip_lines_to_bounds(x, y, z, offsets, bounds)
+    assert clipped[3][-1] == len(clipped[0])
+
+    for start, end, parts in zip(offsets[:-1], offsets[1:], get_clipped_parts(*clipped)):
+        expected = clip_reference(list(zip(x[start:end], y[start:end], z[start:end])), bounds)
+        assert [len(part) for part in parts] == [len(part) for part in expected]
+        for part, expected_part in zip(parts, expected):
+            assert np.allclose(part, expected_part, rtol=0, atol=1e-9)
+            assert all(bounds[0] <= px <= bounds[2] and bounds[1] <= py <= bounds[3] for px, py, _ in part)
+
+def test_clip_lines_tolerance_and_split():
+    # in, out through the right edge, in again, out
+    x = np.array([0.0, 2.0, 2.0, 0.0, 0.0])
+    y = np.array([0.0, 0.0, 1.0, 1.0, 3.0])
+    z = np.array([0.0, 2.0, 3.0, 5.0, 7.0])
+    offsets = np.array([0, 5])
+    clipped_x, clipped_y, clipped_z, part_offsets, part_counts = nmt_geometry.clip_lines_to_bounds(
+        x, y, z, offsets, (0.0, 0.0, 1.0, 2.0))
+    assert part_counts.tolist() == [2]
+    assert part_offsets.tolist() == [0, 2, 5]
+    assert clipped_x.tolist() == [0.0, 1.0, 1.0, 0.0, 0.0]
+    assert clipped_y.tolist() == [0.0, 0.0, 1.0, 1.0, 2.0]
+    assert clipped_z.tolist() == [0.0, 1.0, 4.0, 5.0, 6.0]
+
+    # the tolerance widens the rectangle
+    part_counts = nmt_geometry.clip_lines_to_bounds(x, y, z, offsets, (0.0, 0.0, 1.0, 2.0), 1.0)[4]
+    assert part_counts.tolist() == [1]
+
+def contains_reference(x, y, rings):
+    """Ray casting (even-odd) of every point against all edges of the rings, without the grid."""
+    edges = np.concatenate([np.column_stack((ring, np.roll(ring, -1, axis=0))) for ring in rings])
+    ax, ay, bx, by = edges.T
+    px = np.asarray(x)[:, None]
+    py = np.asarray(y)[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crosses = ((ay > py) != (by > py)) & (px < (bx - ax) * (py - ay) / (by - ay) + ax)
+    return np.count_nonzero(crosses, axis=1) % 2 == 1
+
+def get_star(rng, center_x, center_y, radius, count, clockwise=True):
+    """Non-convex ring: vertices at random radii around the center."""
+    angles = np.sort(rng.uniform(0, 2 * np.pi, count))
+    if clockwise:
+        angles = angles[::-1]
+    radii = radius * rng.uniform(0.3, 1.0, count)
+    return np.column_stack((center_x + radii * np.cos(angles), center_y + radii * np.sin(angles)))
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("max_cells", [16, nmt_geometry.MAX_POLYGON_CELLS])
+def test_polygon_grid_matches_ray_casting(seed, max_cells):
+    rng = np.random.default_rng(seed)
+    # outer ring with a hole and a second part, the hole inside the inner radius of the star
+    rings = [get_star(rng, 0, 0, 100, 60), get_star(rng, 0, 0, 25, 20, clockwise=False), get_star(rng, 150, 40, 30, 12)]
+    x = rng.uniform(-120, 200, 5000)
+    y = rng.uniform(-120, 120, 5000)
+    mask = nmt_geometry.PolygonGrid(rings, max_cells).contains(x, y)
+    expected = contains_reference(x, y, rings)
+    assert np.array_equal(mask, expected)
+    assert 0 < np.count_nonzero(mask) < len(x)
+
+def test_points_in_polygons_mask(seed=0):
+    rng = np.random.default_rng(seed)
+    polygons = [
+        [get_star(rng, 0, 0, 50, 30), get_star(rng, 0, 0, 10, 8, clockwise=False)],
+        [get_star(rng, 40, 40, 30, 20)],
+        [np.array([[200.0, 200.0], [200.0, 210.0], [210.0, 210.0], [210.0, 200.0]])]]
+    x = rng.uniform(-60, 220, 5000)
+    y = rng.uniform(-60, 220, 5000)
+    mask = nmt_geometry.get_points_in_polygons_mask(x, y, polygons)
+    expected = np.any([contains_reference(x, y, rings) for rings in polygons], axis=0)
+    assert np.array_equal(mask, expected)
+
+def test_sheet_outline_rectangle():
+    outline = nmt_geometry.SheetOutline([[(0.0, 0.0), (0.0, 10.0), (20.0, 10.0), (20.0, 0.0), (0.0, 0.0)]], 0.005)
+    assert outline.is_rectangle
+    assert outline.bounds == (0.0, 0.0, 20.0, 10.0)
+    assert outline.get_key() == str(outline.bounds)
+    # a vertex 1 cm off the corner is within the tolerance strip, 1 m is not
+    assert nmt_geometry.is_rectangle([[(0.0, 0.0), (0.0, 10.0), (20.0, 10.0), (20.0, 0.01)]], 0.005)
+    assert not nmt_geometry.is_rectangle([[(0.0, 0.0), (0.0, 10.0), (20.0, 10.0), (20.0, 1.0)]], 0.005)
+    # a hole or a second part
+    assert not nmt_geometry.is_rectangle([[(0, 0), (0, 10), (20, 10), (20, 0)], [(1, 1), (2, 1), (2, 2)]], 0.005)
+
+def test_sheet_outline_of_geographic_sheet():
+    import nmt_godlo
+    outlines = [
+        nmt_geometry.SheetOutline([nmt_godlo.get_sheet_outline(symbol)], 0.005)
+        for symbol in ("N-34-139-A-c-1-1", "N-34-139-A-c-1-2", "N-34-139-A-c-1-3")]
+    assert not any(outline.is_rectangle for outline in outlines)
+    # bounding boxes of neighbouring sheets overlap by tens of metres
+    assert outlines[0].bounds[2] - outlines[1].bounds[0] > 50
+    assert outlines[2].bounds[3] - outlines[0].bounds[1] > 50
+    assert len(set(outline.get_key() for outline in outlines)) == 3
+
+def get_neighbour_outlines():
+    import nmt_godlo
+    return [
+        nmt_geometry.SheetOutline([nmt_godlo.get_sheet_outline(symbol)], 0.005)
+        for symbol in ("N-34-139-A-c-1-1", "N-34-139-A-c-1-2", "N-34-139-A-c-1-3", "N-34-139-A-c-1-4")]
+
+def test_sheet_outline_points_mask_matches_reference():
+    rng = np.random.default_rng(0)
+    outline = get_neighbour_outlines()[0]
+    x_min, y_min, x_max, y_max = outline.bounds
+    x = rng.uniform(x_min - 100, x_max + 100, 20000)
+    y = rng.uniform(y_min - 100, y_max + 100, 20000)
+    # points close to the edges: vertices moved by up to 2 cm
+    ring = outline.rings[0]
+    x = np.r_[x, ring[:, 0] + rng.uniform(-0.02, 0.02, len(ring))]
+    y = np.r_[y, ring[:, 1] + rng.uniform(-0.02, 0.02, len(ring))]
+
+    mask = outline.get_points_mask(x, y, 0.01)
+    ax, ay, bx, by = nmt_geometry.get_ring_edges(outline.rings)
+    distances = np.min([nmt_geometry._point_segment_distance(x, y, *edge) for edge in zip(ax, ay, bx, by)], axis=0)
+    expected = contains_reference(x, y, outline.rings) | (distances <= 0.01)
+    assert np.array_equal(mask, expected)
+    assert np.count_nonzero(nmt_geometry.get_in_bounds_mask(x, y, outline.bounds) & ~mask) > 100
+
+def test_neighbour_sheets_share_no_points():
+    outlines = get_neighbour_outlines()
+    x_min = min(outline.bounds[0] for outline in outlines)
+    y_min = min(outline.bounds[1] for outline in outlines)
+    x_max = max(outline.bounds[2] for outline in outlines)
+    y_max = max(outline.bounds[3] for outline in outlines)
+    # a 10 m grid of points (another grid phase than the sheet edges)
+    x, y = np.meshgrid(np.arange(x_min + 3.3, x_max, 10.0), np.arange(y_min + 7.7, y_max, 10.0))
+    x, y = x.ravel(), y.ravel()
+    counts = np.sum([outline.get_points_mask(x, y, 0.005) for outline in outlines], axis=0)
+    inside_any = np.any([contains_reference(x, y, outline.rings) for outline in outlines], axis=0)
+    near_edges = np.any([nmt_geometry.get_near_rings_mask(x, y, outline.rings, 0.005) for outline in outlines], axis=0)
+    # every point of the 4 sheets (not on a shared edge) in exactly one of them, not so with the bounding boxes
+    assert np.all(counts[inside_any & ~near_edges] == 1)
+    assert np.all(counts[~inside_any & ~near_edges] == 0)
+    boxes = np.sum([nmt_geometry.get_in_bounds_mask(x, y, outline.bounds, 0.005) for outline in outlines], axis=0)
+    assert np.count_nonzero(boxes[inside_any] > 1) > 1000
+
+def get_random_lines(rng, scale=3):
+    counts = rng.integers(0, 30, 15)
+    offsets = np.r_[0, np.cumsum(counts)]
+    x = np.cumsum(rng.integers(-scale, scale + 1, offsets[-1])).astype(float)
+    y = np.cumsum(rng.integers(-scale, scale + 1, offsets[-1])).astype(float)
+    z = rng.uniform(100, 110, offsets[-1])
+    return x, y, z, offsets
+
+@pytest.mark.parametrize("seed", range(20))
+def test_clip_lines_to_rectangle_polygon_matches_bounds(seed):
+    x, y, z, offsets = get_random_lines(np.random.default_rng(seed))
+    bounds = (-5.0, -4.0, 6.0, 5.0)
+    ring = [(-5.0, -4.0), (-5.0, 5.0), (6.0, 5.0), (6.0, -4.0)]
+    expected = nmt_geometry.clip_lines_to_bounds(x, y, z, offsets, bounds)
+    # segments along the edges are kept by the tolerance
+    clipped = nmt_geometry.clip_lines_to_polygon(x, y, z, offsets, [ring], 1e-9)
+    assert np.array_equal(clipped[4], expected[4])
+    assert np.array_equal(clipped[3], expected[3])
+    for values, expected_values in zip(clipped[:3], expected[:3]):
+        assert np.allclose(values, expected_values, rtol=0, atol=1e-9)
+
+def clip_polygon_reference(points, rings):
+    """clip_reference with the crossings of all edges of the rings and ray casting of the piece middles."""
+    edges = [edge for ring in rings for edge in zip(ring, np.roll(ring, -1, axis=0))]
+    parts = []
+    previous_end = None
+    for start, end in zip(points[:-1], points[1:]):
+        dx, dy = end[0] - start[0], end[1] - start[1]
+        ts = {0.0, 1.0}
+        for (ax, ay), (bx, by) in edges:
+            ex, ey = bx - ax, by - ay
+            denominator = dx * ey - dy * ex
+            if denominator == 0:
+                continue
+            t = ((ax - start[0]) * ey - (ay - start[1]) * ex) / denominator
+            u = ((ax - start[0]) * dy - (ay - start[1]) * dx) / denominator
+            if 0 < t < 1 and 0 <= u <= 1:
+                ts.add(t)
+        ts = sorted(ts)
+        inside = [
+            (a, b) for a, b in zip(ts[:-1], ts[1:])
+            if contains_reference([start[0] + (a + b) / 2 * dx], [start[1] + (a + b) / 2 * dy], rings)[0]]
+        pieces = []
+        for a, b in inside:
+            if pieces and pieces[-1][1] == a:
+                pieces[-1] = (pieces[-1][0], b)
+            else:
+                pieces.append((a, b))
+
+        for t0, t1 in pieces:
+            if not (previous_end == 1.0 and t0 == 0.0):
+                parts.append([tuple(a + t0 * (b - a) for a, b in zip(start, end))])
+            parts[-1].append(tuple(a + t1 * (b - a) for a, b in zip(start, end)))
+        previous_end = pieces[-1][1] if pieces else None
+    return parts
+
+@pytest.mark.parametrize("seed", range(10))
+def test_clip_lines_to_polygon_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    x, y, z, offsets = get_random_lines(rng, 10)
+    x += rng.uniform(-0.5, 0.5, len(x))
+    y += rng.uniform(-0.5, 0.5, len(y))
+    rings = [get_star(rng, 0, 0, 40, 20), get_star(rng, 0, 0, 8, 6, clockwise=False)]
+    clipped = nmt_geometry.clip_lines_to_polygon(x, y, z, offsets, rings)
+    assert clipped[3][-1] == len(clipped[0])
+
+    cut_count = 0
+    for start, end, parts in zip(offsets[:-1], offsets[1:], get_clipped_parts(*clipped)):
+        expected = clip_polygon_reference(list(zip(x[start:end], y[start:end], z[start:end])), rings)
+        assert [len(part) for part in parts] == [len(part) for part in expected]
+        for part, expected_part in zip(parts, expected):
+            assert np.allclose(part, expected_part, rtol=0, atol=1e-9)
+        cut_count += len(parts)
+    assert cut_count > 0
+
+def test_clip_lines_to_sheet_outline():
+    outline = get_neighbour_outlines()[0]
+    x_min, y_min, x_max, y_max = outline.bounds
+    # a line across the sheet along its middle row, from box edge to box edge
+    y_middle = (y_min + y_max) / 2
+    x = np.linspace(x_min, x_max, 101)
+    y = np.full(101, y_middle)
+    z = np.linspace(0.0, 100.0, 101)
+    clipped_x, _, clipped_z, part_offsets, part_counts = outline.clip_lines(x, y, z, np.array([0, 101]), 0.005)
+    assert part_counts.tolist() == [1]
+    # the ends are cut at the real (sloped) sheet edges, inside the box
+    inside = contains_reference(x, y, outline.rings)
+    assert x_min < clipped_x[0] < x[inside][0] and x[inside][-1] < clipped_x[-1] < x_max
+    assert np.allclose(np.interp(clipped_x[[0, -1]], x, z), clipped_z[[0, -1]])
+    assert np.array_equal(clipped_x[1:-1], x[inside])
+
+def get_sheet_envelopes():
+    """Grid of 100 x 80 sheets, one split into 4 (T-junctions), one missing."""
+    envelopes = []
+    for column in range(4):
+        for row in range(3):
+            x_min, y_min = 1000.0 + 100 * column, 2000.0 + 80 * row
+            if (column, row) == (3, 2):
+                continue
+            if (column, row) == (1, 1):
+                for sub_x in (0, 50):
+                    for sub_y in (0, 40):
+                        envelopes.append((x_min + sub_x, y_min + sub_y, x_min + sub_x + 50, y_min + sub_y + 40))
+            else:
+                envelopes.append((x_min, y_min, x_min + 100, y_min + 80))
+    return np.array(envelopes)
+
+def seams_reference(envelopes):
+    """Shared edges of every pair of sheets (Intersect_analysis LINE), as (x0, y0, x1, y1) segments."""
+    seams = []
+    for i, a in enumerate(envelopes):
+        for b in envelopes[i + 1:]:
+            for a_edge, b_edge in ((a[2], b[0]), (b[2], a[0])):
+                if a_edge == b_edge and min(a[3], b[3]) > max(a[1], b[1]):
+                    seams.append((a_edge, max(a[1], b[1]), a_edge, min(a[3], b[3])))
+            for a_edge, b_edge in ((a[3], b[1]), (b[3], a[1])):
+                if a_edge == b_edge and min(a[2], b[2]) > max(a[0], b[0]):
+                    seams.append((max(a[0], b[0]), a_edge, min(a[2], b[2]), a_edge))
+    return seams
+
+def seam_distance(px, py, seam):
+    x0, y0, x1, y1 = seam
+    return np.hypot(px - np.clip(px, x0, x1), py - np.clip(py, y0, y1))
+
+def classify_reference(x0, y0, x1, y1, seams, distance):
+    """(near, within the dissolved buffer of the seams) of one segment, by dense sampling."""
+    t = np.linspace(0.0, 1.0, 2001)
+    px = x0 + t * (x1 - x0)
+    py = y0 + t * (y1 - y0)
+    distances = np.min([seam_distance(px, py, seam) for seam in seams], axis=0)
+    return distances.min() <= distance, bool(np.all(distances <= distance))
+
+def get_seam_lines(seed, count=60):
+    """Random walks around the seams, some of them along a seam."""
+    rng = np.random.default_rng(seed)
+    envelopes = get_sheet_envelopes()
+    lines = []
+    for _ in range(count):
+        vertex_count = rng.integers(2, 12)
+        if rng.random() < 0.3:
+            y = 2080.0 + rng.uniform(-1.5, 1.5)
+            x = np.sort(rng.uniform(1000, 1400, vertex_count))
+            lines.append(np.column_stack((x, np.full(vertex_count, y) + rng.normal(0, 0.3, vertex_count))))
+        else:
+            start = rng.uniform(envelopes[:, :2].min(axis=0), envelopes[:, 2:].max(axis=0))
+            lines.append(start + np.cumsum(rng.normal(0, 4, (vertex_count, 2)), axis=0))
+    offsets = np.r_[0, np.cumsum([len(line) for line in lines])]
+    vertices = np.concatenate(lines)
+    return vertices[:, 0], vertices[:, 1], offsets
+
+def test_find_sheet_seams_matches_shared_edges():
+    envelopes = get_sheet_envelopes()
+    vertical, horizontal = nmt_geometry.find_sheet_seams(envelopes, 0.005)
+    seams = seams_reference(envelopes)
+
+    # merged seams cover exactly the shared edges, without gaps
+    for merged, edges in (
+            (vertical, [(x0, y0, y1) for x0, y0, x1, y1 in seams if x0 == x1]),
+            (horizontal, [(y0, x0, x1) for x0, y0, x1, y1 in seams if y0 == y1])):
+        assert sum(hi - lo for _, lo, hi in merged.tolist()) == sum(hi - lo for _, lo, hi in edges)
+        for c, lo, hi in edges:
+            assert any(c == mc and mlo <= lo and hi <= mhi for mc, mlo, mhi in merged.tolist())
+    assert sorted(set(vertical[:, 0].tolist())) == [1100.0, 1150.0, 1200.0, 1300.0]
+    assert sorted(set(horizontal[:, 0].tolist())) == [2080.0, 2120.0, 2160.0]
+    # no seams along the edges of the missing sheet
+    assert [hi for c, lo, hi in horizontal.tolist() if c == 2160.0] == [1300.0]
+    assert [hi for c, lo, hi in vertical.tolist() if c == 1300.0] == [2160.0]
+
+def test_classify_seam_segments_across_a_corner():
+    """Both ends lie in the buffers of different seams, the middle in both of them."""
+    envelopes = get_sheet_envelopes()
+    seams = nmt_geometry.find_sheet_seams(envelopes, 0.005)
+    x = np.array([1099.9, 1098.0, 1099.9, 1090.0])
+    y = np.array([2078.9, 2079.2, 2078.5, 2080.2])
+    _, near, within = nmt_geometry.classify_seam_segments(x, y, [0, 2, 4], seams, 1.0)
+    assert near.tolist() == [True, True]
+    assert within.tolist() == [True, False]
+
+@pytest.mark.parametrize("seed", range(5))
+def test_classify_seam_segments_matches_reference(seed):
+    x, y, offsets = get_seam_lines(seed)
+    envelopes = get_sheet_envelopes()
+    seams = nmt_geometry.find_sheet_seams(envelopes, 0.005)
+    segment_starts, near, within = nmt_geometry.classify_seam_segments(x, y, offsets, seams, 1.0)
+    reference_seams = seams_reference(envelopes)
+    expected = [
+        classify_reference(x[i], y[i], x[i + 1], y[i + 1], reference_seams, 1.0) for i in segment_starts.tolist()]
+    assert near.tolist() == [near for near, _ in expected]
+    assert within.tolist() == [within for _, within in expected]
+    assert np.any(near) and np.any(within)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_split_lines_on_seams_matches_splitted_output(seed):
+    """Lines near the seams are replaced by their 2-vertex segments outside the dissolved seam buffer."""
+    x, y, offsets = get_seam_lines(seed)
+    envelopes = get_sheet_envelopes()
+    # parts of one feature: lines 2k and 2k + 1
+    line_groups = np.arange(len(offsets) - 1) // 2
+    keep_lines, segment_starts, segment_line_ids = nmt_geometry.split_lines_on_seams(
+        x, y, offsets, envelopes, 1.0, 0.005, line_groups)
+
+    reference_seams = seams_reference(envelopes)
+    classified = {}
+    for line, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+        for i in range(start, end - 1):
+            classified[i] = (line, classify_reference(x[i], y[i], x[i + 1], y[i + 1], reference_seams, 1.0))
+    near_groups = set(line_groups[line] for line, (near, _) in classified.values() if near)
+    expected_keep = [group not in near_groups for group in line_groups]
+    expected_segments = [
+        (i, line) for i, (line, (_, within)) in sorted(classified.items())
+        if line_groups[line] in near_groups and not within]
+
+    assert keep_lines.tolist() == expected_keep
+    assert list(zip(segment_starts.tolist(), segment_line_ids.tolist())) == expected_segments
+    assert not all(expected_keep) and any(expected_keep)
@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+import crs_transform
+import nmt_godlo
+
+
+def get_points(count=200, seed=0):
+    """Geographic points over Poland."""
+    rng = random.Random(seed)
+    return [(rng.uniform(14.1, 24.1), rng.uniform(49.0, 54.8)) for _ in range(count)]
+
+@pytest.mark.parametrize("scale", nmt_godlo.SCALES)
+def test_decode_encode_round_trip(scale):
+    for lon, lat in get_points():
+        symbol = nmt_godlo.encode(lon, lat, scale)
+        decoded_scale, (lon_min, lat_min, lon_max, lat_max) = nmt_godlo.decode(symbol)
+        assert decoded_scale == scale
+        assert lon_min <= lon <= lon_max and lat_min <= lat <= lat_max
+        unified = "".join(symbol.split("-")).lower()
+        assert nmt_godlo.decode(unified) == nmt_godlo.decode(symbol)
+
+@pytest.mark.parametrize("scale", [nmt_godlo.SCALE_5K, nmt_godlo.SCALE_2K, nmt_godlo.SCALE_500])
+def test_sheet_bounds_contain_point(scale):
+    for lon, lat in get_points(50, seed=1):
+        x, y = crs_transform.EPSG_2180.forward(lon, lat)
+        x_min, y_min, x_max, y_max = nmt_godlo.get_sheet_bounds(nmt_godlo.encode(lon, lat, scale))
+        assert x_min <= x <= x_max and y_min <= y <= y_max
+
+def test_sheet_sizes():
+    # 1:5 000 - 1'52.5" x 1'15", 1:2 000 - 37.5" x 25", 1:1 000 and 1:500 - halves
+    sizes = {
+        "N-34-139-A-c-1-1": (112.5, 75.0),
+        "N-34-139-A-c-1-1-9": (37.5, 25.0),
+        "N-34-139-A-c-1-1-9-4": (18.75, 12.5),
+        "N-34-139-A-c-1-1-9-4-3": (9.375, 6.25)}
+    for symbol, (width, height) in sizes.items():
+        _, (lon_min, lat_min, lon_max, lat_max) = nmt_godlo.decode(symbol)
+        assert (lon_max - lon_min) * 3600 == pytest.approx(width)
+        assert (lat_max - lat_min) * 3600 == pytest.approx(height)
+
+def test_2k_parts_row_by_row():
+    _, (lon_min, lat_min, lon_max, lat_max) = nmt_godlo.decode("N-34-139-A-c-1-1")
+    _, first = nmt_godlo.decode("N-34-139-A-c-1-1-1")
+    _, last = nmt_godlo.decode("N-34-139-A-c-1-1-9")
+    assert first[0] == pytest.approx(lon_min) and first[3] == pytest.approx(lat_max)
+    assert last[2] == pytest.approx(lon_max) and last[1] == pytest.approx(lat_min)
+
+@pytest.mark.parametrize("symbol", [
+    "N-34-139-A-c-1-1-0",
+    "N-34-139-A-c-1-1-10",
+    "N-34-139-A-c-1-1-9-5",
+    "N-34-139-A-c-1-5",
+    "N-34-139-A-c-1-1-9-4-3-1",
+    "n34139ac1195"])
+def test_decode_invalid(symbol):
+    with pytest.raises(ValueError):
+        nmt_godlo.decode(symbol)
@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pytest
+
+import nmt_order
+
+
+def hilbert_reference(n, x, y):
+    """Classic xy2d: distance of the cell along the Hilbert curve over an n x n grid."""
+    d = 0
+    s = n // 2
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = n - 1 - x
+                y = n - 1 - y
+            x, y = y, x
+        s //= 2
+    return d
+
+def morton_reference(x, y):
+    key = 0
+    for bit in range(16):
+        key |= ((x >> bit) & 1) << (2 * bit) | ((y >> bit) & 1) << (2 * bit + 1)
+    return key
+
+def test_hilbert_keys_match_reference():
+    rng = np.random.default_rng(0)
+    ix = rng.integers(0, 1 << nmt_order.CURVE_BITS, 2000)
+    iy = rng.integers(0, 1 << nmt_order.CURVE_BITS, 2000)
+    keys = nmt_order.get_hilbert_keys(ix.astype(np.uint64), iy.astype(np.uint64))
+    n = 1 << nmt_order.CURVE_BITS
+    assert keys.tolist() == [hilbert_reference(n, int(x), int(y)) for x, y in zip(ix, iy)]
+
+def test_hilbert_curve_is_continuous():
+    bits = 4
+    ix, iy = np.meshgrid(np.arange(1 << bits), np.arange(1 << bits))
+    keys = nmt_order.get_hilbert_keys(ix.ravel(), iy.ravel(), bits)
+    # every cell once, neighbouring keys in neighbouring cells
+    assert np.array_equal(np.sort(keys), np.arange(1 << 2 * bits))
+    order = np.argsort(keys)
+    steps = np.abs(np.diff(ix.ravel()[order])) + np.abs(np.diff(iy.ravel()[order]))
+    assert np.all(steps == 1)
+
+def test_morton_keys_match_reference():
+    rng = np.random.default_rng(1)
+    ix = rng.integers(0, 1 << 16, 2000)
+    iy = rng.integers(0, 1 << 16, 2000)
+    keys = nmt_order.get_morton_keys(ix.astype(np.uint64), iy.astype(np.uint64))
+    assert keys.tolist() == [morton_reference(int(x), int(y)) for x, y in zip(ix, iy)]
+
+def get_points(count=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    # coarse coordinates: many points share a key
+    x = np.round(rng.uniform(500000, 501000, count), -1)
+    y = np.round(rng.uniform(250000, 250500, count), -1)
+    return x, y
+
+@pytest.mark.parametrize("curve", nmt_order.CURVES)
+@pytest.mark.parametrize("use_mask", [False, True])
+def test_external_sort_matches_in_memory_sort(tmp_path, monkeypatch, curve, use_mask):
+    monkeypatch.setattr(nmt_order, "KEY_CHUNK_SIZE", 1000)
+    x, y = get_points()
+    mask = np.random.default_rng(2).random(len(x)) < 0.7 if use_mask else None
+
+    # reference: stable sort of the keys of the selected points
+    selected = np.arange(len(x)) if mask is None else np.flatnonzero(mask)
+    keys = nmt_order.get_curve_keys(x[selected], y[selected], nmt_order.get_bounds(x, y, mask), curve)
+    expected = selected[np.argsort(keys, kind="stable")]
+
+    in_memory = nmt_order.CurveOrder(x, y, curve, mask)
+    assert not in_memory.is_external
+    assert np.array_equal(in_memory.indices, expected)
+
+    # runs of about 2000 keys merged in blocks of 1024
+    external = nmt_order.CurveOrder(x, y, curve, mask, max_memory_mb=0.05, temp_folder=str(tmp_path))
+    try:
+        assert external.is_external
+        assert len([name for name in os.listdir(external.temp_folder) if name.startswith("run_")]) > 5
+        assert np.array_equal(external.indices, expected)
+    finally:
+        external.close()
+    assert os.listdir(tmp_path) == []
+
+def test_empty_order():
+    x, y = get_points(100)
+    order = nmt_order.CurveOrder(x, y, mask=np.zeros(len(x), dtype=bool))
+    assert order.bounds is None and len(order) == 0
+    with pytest.raises(ValueError):
+        nmt_order.CurveOrder(x, y, "PEANO")
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import nmt_quantize
+
+
+def get_centimetre_values(count=10000, seed=0):
+    """Values parsed from ASC text with 2 decimals, as in the NMT files."""
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(-10000000, 90000000, count)
+    return np.array([float(f"{code // 100}.{code % 100:02d}") for code in codes.tolist()])
+
+@pytest.mark.parametrize("seed", range(3))
+def test_encode_decode_is_exact(seed):
+    values = get_centimetre_values(seed=seed)
+    origin = nmt_quantize.get_origin(values)
+    codes = nmt_quantize.encode(values)
+    assert codes is not None and codes.dtype == nmt_quantize.CODE_DTYPE
+    assert np.array_equal(nmt_quantize.decode(codes, origin), values)
+    assert codes.min() >= 0
+
+@pytest.mark.parametrize("values", [
+    [100.001, 100.0],
+    [0.0, np.nan],
+    [0.0, np.inf],
+    [0.0, 30000000.0]])
+def test_encode_rejects_values_not_exactly_decodable(values):
+    assert nmt_quantize.encode(values) is None
+    assert nmt_quantize.encode_xyz(values, [0.0, 0.0], [0.0, 0.0]) is None
+
+def test_encode_chunks_common_origin():
+    chunks = [np.array([105.25, 107.5]), np.array([], dtype=float), np.array([99.99])]
+    origin, codes = nmt_quantize.encode_chunks(chunks)
+    assert origin == 9900
+    assert [nmt_quantize.decode(chunk_codes, origin).tolist() for chunk_codes in codes] == [
+        [105.25, 107.5], [], [99.99]]
+    assert nmt_quantize.encode_chunks([np.array([1.0]), np.array([1.005])]) is None
+
+def test_quantized_xyz_round_trip():
+    x, y, z = (get_centimetre_values(100, seed) for seed in range(3))
+    quantized = nmt_quantize.encode_xyz(x, y, z)
+    assert quantized.nbytes == 3 * 4 * len(x)
+    assert all(np.array_equal(decoded, values) for decoded, values in zip(nmt_quantize.decode_xyz(quantized), (x, y, z)))
+    assert nmt_quantize.decode_xyz((x, y, z)) == (x, y, z)
@@ -0,0 +1,186 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import nmt_sheets
+
+
+def get_result(index):
+    result = nmt_sheets.SheetResult(index, (0.0, 0.0, 1.0, 1.0))
+    result.points.append(("p", np.array([0.5]), np.array([0.25]), np.array([10.0])))
+    result.lines.append((b"wkb", "s", ""))
+    return result
+
+def test_checkpoint_journal(tmp_path):
+    checkpoint = nmt_sheets.SheetCheckpoint(str(tmp_path), journal_size=3)
+    for i in range(4):
+        checkpoint.save(get_result(f"sheet{i}"), f"fingerprint{i}")
+
+    # 3 sheets compacted into the manifest, the 4th one only in the journal
+    assert checkpoint.journal_count == 1
+    reopened = nmt_sheets.SheetCheckpoint(str(tmp_path))
+    assert reopened.manifest == {f"sheet{i}": f"fingerprint{i}" for i in range(4)}
+    result = reopened.load("sheet3", "fingerprint3")
+    assert result.points[0][1].tolist() == [0.5]
+    assert result.lines == [(b"wkb", "s", "")]
+    assert reopened.load("sheet3", "other") is None
+
+def test_checkpoint_cut_journal_line(tmp_path):
+    checkpoint = nmt_sheets.SheetCheckpoint(str(tmp_path))
+    checkpoint.save(get_result("sheet0"), "fingerprint0")
+    with open(checkpoint.journal_path, "a") as journal_file:
+        journal_file.write('["sheet1", "finger')
+    assert nmt_sheets.SheetCheckpoint(str(tmp_path)).manifest == {"sheet0": "fingerprint0"}
+
+def test_checkpoint_damaged_result(tmp_path):
+    checkpoint = nmt_sheets.SheetCheckpoint(str(tmp_path))
+    checkpoint.save(get_result("sheet0"), "fingerprint0")
+    with open(checkpoint.get_result_path("sheet0"), "wb") as result_file:
+        result_file.write(b"damaged")
+    assert checkpoint.is_complete("sheet0", "fingerprint0")
+    assert checkpoint.load("sheet0", "fingerprint0") is None
+
+def write_sheet_files(folder, index, rng):
+    """Point and line ASC files of a synthetic sheet, coordinates in centimetres."""
+    points = np.round(rng.uniform(0, 1000, (int(rng.integers(1, 300)), 3)), 2)
+    point_path = folder / f"{index}_p.asc"
+    point_path.write_text("".join(f"{y:.2f} {x:.2f} {z:.2f}\n" for x, y, z in points))
+
+    line_text = []
+    for _ in range(int(rng.integers(1, 20))):
+        vertices = np.round(rng.uniform(0, 1000, (int(rng.integers(2, 8)), 3)), 2)
+        line_text.append("Start\n" + "".join(f"{y:.2f} {x:.2f} {z:.2f}\n" for x, y, z in vertices) + "End\n")
+    line_path = folder / f"{index}_s.asc"
+    line_path.write_text("".join(line_text))
+    return [("p", str(point_path))], [("s", str(line_path))]
+
+def get_sheet_tasks(folder, count=7, quantize=False):
+    rng = np.random.default_rng(3)
+    tasks = []
+    for i in range(count):
+        point_files, line_files = write_sheet_files(folder, f"sheet{i}", rng)
+        if i == 2:
+            # missing file is reported, not raised
+            point_files.append(("p", str(folder / "missing_p.asc")))
+        tasks.append((f"sheet{i}", point_files, line_files, None, quantize))
+    return tasks
+
+def get_sheet_arrays(sheet):
+    points = [(sign, x.tolist(), y.tolist(), z.tolist()) for sign, x, y, z in sheet.points]
+    lines = [
+        (sign, path, line_data.x.tolist(), line_data.y.tolist(), line_data.z.tolist(), line_data.offsets.tolist())
+        for sign, path, line_data in sheet.lines]
+    return sheet.index, points, lines, sheet.bounds, sheet.converted_files, sheet.missing_files
+
+@pytest.mark.parametrize("quantize", [False, True])
+def test_iter_sheets_same_in_workers(tmp_path, quantize):
+    tasks = get_sheet_tasks(tmp_path, quantize=quantize)
+    expected = [get_sheet_arrays(sheet) for sheet in nmt_sheets.iter_sheets(tasks, max_workers=1, lookahead=0)]
+    assert [index for index, *_ in expected] == [f"sheet{i}" for i in range(len(tasks))]
+    assert expected[2][-1] == [str(tmp_path / "missing_p.asc")]
+
+    for max_workers, lookahead in ((1, 1), (1, 3), (2, 0), (2, 1)):
+        sheets = nmt_sheets.iter_sheets(tasks, max_workers=max_workers, lookahead=lookahead)
+        assert [get_sheet_arrays(sheet) for sheet in sheets] == expected
+
+
+class FakeReader:
+    '''Replaces the reading of a sheet, every sheet has about sheet_mb of points'''
+    def __init__(self, sheet_mb=1.0, fail_at=None):
+        self.size = int(sheet_mb * 1024 * 1024 / 24) + 1
+        self.fail_at = fail_at
+        self.read = []
+        self.lock = threading.Lock()
+
+    def __call__(self, task):
+        index = task[0]
+        if index == self.fail_at:
+            raise ValueError(f"damaged {index}")
+        sheet = nmt_sheets.SheetData(index)
+        sheet.points.append(("p", np.zeros(self.size), np.zeros(self.size), np.zeros(self.size)))
+        with self.lock:
+            self.read.append(index)
+        return sheet
+
+    def wait_for_count(self, count, timeout=5.0):
+        """Waits until count sheets are read and checks that no more are read meanwhile."""
+        deadline = time.monotonic() + timeout
+        while len(self.read) < count and time.monotonic() < deadline:
+            time.sleep(0.005)
+        time.sleep(0.1)
+        return len(self.read)
+
+def get_fake_tasks(count):
+    return [(f"sheet{i}", [], [], None) for i in range(count)]
+
+def test_prefetcher_order(monkeypatch):
+    reader = FakeReader(sheet_mb=0.01)
+    monkeypatch.setattr(nmt_sheets, "_read_sheet_task", reader)
+    prefetcher = nmt_sheets.SheetPrefetcher(get_fake_tasks(20), lookahead=3)
+    assert [sheet.index for sheet in prefetcher] == [f"sheet{i}" for i in range(20)]
+    prefetcher.close()
+
+def test_prefetcher_lookahead(monkeypatch):
+    reader = FakeReader(sheet_mb=0.01)
+    monkeypatch.setattr(nmt_sheets, "_read_sheet_task", reader)
+    prefetcher = nmt_sheets.SheetPrefetcher(get_fake_tasks(10), lookahead=3)
+    sheets = iter(prefetcher)
+    assert reader.wait_for_count(3) == 3
+    next(sheets)
+    assert reader.wait_for_count(4) == 4
+    prefetcher.close()
+
+def test_prefetcher_max_memory(monkeypatch):
+    reader = FakeReader(sheet_mb=1.0)
+    monkeypatch.setattr(nmt_sheets, "_read_sheet_task", reader)
+    prefetcher = nmt_sheets.SheetPrefetcher(get_fake_tasks(10), lookahead=8, max_memory_mb=2.5)
+    sheets = iter(prefetcher)
+    # the 3rd sheet is read while 2 MB wait, the 4th one only after a sheet is taken
+    assert reader.wait_for_count(3) == 3
+    assert prefetcher._queued_bytes > 2.5 * 1024 * 1024
+    next(sheets)
+    assert reader.wait_for_count(4) == 4
+    prefetcher.close()
+
+def test_prefetcher_max_memory_reads_one_sheet_ahead(monkeypatch):
+    reader = FakeReader(sheet_mb=4.0)
+    monkeypatch.setattr(nmt_sheets, "_read_sheet_task", reader)
+    prefetcher = nmt_sheets.SheetPrefetcher(get_fake_tasks(5), lookahead=8, max_memory_mb=1)
+    assert reader.wait_for_count(1) == 1
+    assert [sheet.index for sheet in prefetcher] == [f"sheet{i}" for i in range(5)]
+    prefetcher.close()
+
+def test_prefetcher_error_reaches_consumer(monkeypatch):
+    reader = FakeReader(sheet_mb=0.01, fail_at="sheet3")
+    monkeypatch.setattr(nmt_sheets, "_read_sheet_task", reader)
+    prefetcher = nmt_sheets.SheetPrefetcher(get_fake_tasks(6), lookahead=2)
+    indices = []
+    with pytest.raises(ValueError, match="damaged sheet3"):
+        for sheet in prefetcher:
+            indices.append(sheet.index)
+    # the sheets read before the error are still delivered
+    assert indices == ["sheet0", "sheet1", "sheet2"]
+    prefetcher.close()
+    assert reader.read == ["sheet0", "sheet1", "sheet2"]
+
+def test_prefetcher_close_stops_thread(monkeypatch):
+    reader = FakeReader(sheet_mb=0.01)
+    monkeypatch.setattr(nmt_sheets, "_read_sheet_task", reader)
+    prefetcher = nmt_sheets.SheetPrefetcher(get_fake_tasks(100), lookahead=2)
+    next(iter(prefetcher))
+    # the thread waits for room in the queue, close wakes it up
+    assert reader.wait_for_count(3) == 3
+    prefetcher.close()
+    assert not prefetcher._thread.is_alive()
+    assert len(reader.read) == 3
+
+def test_iter_sheets_closes_prefetcher(monkeypatch):
+    reader = FakeReader(sheet_mb=0.01)
+    monkeypatch.setattr(nmt_sheets, "_read_sheet_task", reader)
+    sheets = nmt_sheets.iter_sheets(get_fake_tasks(100), max_workers=1, lookahead=2)
+    assert next(sheets).index == "sheet0"
+    sheets.close()
+    assert not any(thread.name == "SheetPrefetcher" for thread in threading.enumerate())
+    assert len(reader.read) <= 3
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import nmt_store
+
+
+def get_points(count, seed):
+    rng = np.random.default_rng(seed)
+    return tuple(np.round(rng.uniform(offset, offset + 1000, count), 2) for offset in (500000, 250000, 100))
+
+def fill_store(store, sheet_count=3, count=500):
+    expected = []
+    for sheet in range(sheet_count):
+        x, y, z = get_points(count, sheet)
+        store.append(x, y, z, "p", f"sheet{sheet}")
+        expected.append((x, y, z))
+    return tuple(np.concatenate(values) for values in zip(*expected))
+
+def test_quantized_store_is_exact():
+    store = nmt_store.PointStore(16, quantized=True)
+    x, y, z = fill_store(store)
+    assert store.quantized and store.dequantized_sheet is None
+    assert np.array_equal(store.x, x) and np.array_equal(store.y, y) and np.array_equal(store.z, z)
+    mask = z > 500
+    selection = store.select(mask)
+    assert np.array_equal(selection.z, z[mask])
+    batches = list(store.iter_batches(100, mask))
+    assert np.array_equal(np.concatenate([batch[0] for batch in batches]), x[mask])
+
+def test_fallback_to_float64_is_reported():
+    store = nmt_store.PointStore(16, quantized=True)
+    x, y, z = fill_store(store, 2)
+    # millimetres cannot be encoded
+    store.append(np.array([500000.125]), np.array([250000.0]), np.array([100.0]), "p", "sheet_mm")
+    assert not store.quantized
+    assert store.dequantized_sheet == "sheet_mm"
+    assert store.x.dtype == np.float64
+    assert np.array_equal(store.x, np.r_[x, 500000.125])
+    assert np.array_equal(store.z, np.r_[z, 100.0])
+    assert store.select(np.ones(len(store), dtype=bool)).dequantized_sheet == "sheet_mm"
+
+def test_decoded_columns_kept_within_stage(monkeypatch):
+    store = nmt_store.PointStore(16, quantized=True)
+    x, y, _ = fill_store(store)
+    decode_calls = []
+    decode_column = store._decode_column
+    monkeypatch.setattr(store, "_decode_column", lambda *args: decode_calls.append(args) or decode_column(*args))
+
+    with store.decoded():
+        assert np.shares_memory(store.x, store.x)
+        assert np.array_equal(store.y, y)
+        assert len(decode_calls) == 2
+        # the decoded columns follow changes of the points
+        mask = x > x.mean()
+        store.compress(mask)
+        assert np.array_equal(store.x, x[mask])
+        assert np.array_equal(list(store.iter_batches(100))[0][1], y[mask][:100])
+    # x and y once before and once after compress, z once for the batches
+    assert len(decode_calls) == 5
+
+    # decoded on every access outside the stage
+    store.x
+    store.x
+    assert len(decode_calls) == 7
+
+@pytest.mark.parametrize("quantized", [False, True])
+def test_float_store_decoded_stage(quantized):
+    store = nmt_store.PointStore(16, quantized=quantized)
+    x, _, _ = fill_store(store, 1)
+    with store.decoded():
+        assert np.array_equal(store.x, x)
+    assert np.array_equal(store.x, x)
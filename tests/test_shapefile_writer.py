@@ -0,0 +1,115 @@
+import datetime
+
+import numpy as np
+import pytest
+
+import shapefile_writer
+
+shapefile = pytest.importorskip("shapefile")
+
+FIELDS = [
+    shapefile_writer.Field("NAME", shapefile_writer.FIELD_TEXT, 20),
+    shapefile_writer.Field("VALUE", shapefile_writer.FIELD_NUMBER, 19, 3),
+    shapefile_writer.Field("DATE", shapefile_writer.FIELD_DATE)]
+RECORDS = {
+    "NAME": ["rzeka", "zażółć", None],
+    "VALUE": [1.5, -20.125, None],
+    "DATE": [datetime.date(2024, 1, 31), None, datetime.date(1999, 12, 1)]}
+EXPECTED_RECORDS = [
+    ["rzeka", 1.5, datetime.date(2024, 1, 31)],
+    ["zażółć", -20.125, None],
+    ["", None, datetime.date(1999, 12, 1)]]
+
+
+def read_shapefile(path):
+    with shapefile.Reader(str(path)) as reader:
+        return reader.shapeType, list(reader.bbox), list(reader.zbox), reader.shapes(), [list(record) for record in reader.records()]
+
+def test_points_z(tmp_path):
+    x = np.array([500000.25, 500010.5, 499990.0])
+    y = np.array([250000.0, 250020.75, 249995.5])
+    z = np.array([101.25, 99.5, 120.0])
+    with shapefile_writer.ShapefileWriter(str(tmp_path / "points"), shapefile_writer.SHAPE_POINTZ, FIELDS) as writer:
+        writer.write_points(x[:2], y[:2], z[:2], {name: values[:2] for name, values in RECORDS.items()})
+        writer.write_points(x[2:], y[2:], z[2:], {name: values[2:] for name, values in RECORDS.items()})
+
+    shape_type, bbox, zbox, shapes, records = read_shapefile(tmp_path / "points.shp")
+    assert shape_type == shapefile.POINTZ
+    assert bbox == [x.min(), y.min(), x.max(), y.max()]
+    assert zbox == [z.min(), z.max()]
+    assert [list(shape.points[0][:2]) for shape in shapes] == [[px, py] for px, py in zip(x, y)]
+    assert [shape.z[0] for shape in shapes] == list(z)
+    assert [shape.m[0] for shape in shapes] == [0.0] * 3
+    assert records == EXPECTED_RECORDS
+    assert (tmp_path / "points.cpg").read_text() == shapefile_writer.ENCODING
+
+def get_parts():
+    """Vertices of 3 features: 2 parts, 1 part, 3 parts."""
+    rng = np.random.default_rng(0)
+    part_counts = np.array([2, 1, 3])
+    counts = np.array([3, 2, 4, 2, 5, 3])
+    offsets = np.r_[0, np.cumsum(counts)]
+    x = np.round(rng.uniform(0, 1000, offsets[-1]), 2)
+    y = np.round(rng.uniform(0, 1000, offsets[-1]), 2)
+    z = np.round(rng.uniform(100, 200, offsets[-1]), 2)
+    return x, y, z, offsets, part_counts
+
+def assert_parts(shapes, x, y, z, offsets, part_counts):
+    part_offsets = np.r_[0, np.cumsum(part_counts)]
+    for shape, first_part, last_part in zip(shapes, part_offsets[:-1], part_offsets[1:]):
+        start, end = offsets[first_part], offsets[last_part]
+        assert list(shape.parts) == list(offsets[first_part:last_part] - start)
+        assert [list(point[:2]) for point in shape.points] == [[px, py] for px, py in zip(x[start:end], y[start:end])]
+        assert list(shape.z) == list(z[start:end])
+        assert list(shape.bbox) == [x[start:end].min(), y[start:end].min(), x[start:end].max(), y[start:end].max()]
+        # M values are not written
+        assert all(m is None for m in shape.m)
+
+def test_multipart_lines_z(tmp_path):
+    x, y, z, offsets, part_counts = get_parts()
+    with shapefile_writer.ShapefileWriter(
+            str(tmp_path / "lines.shp"), shapefile_writer.SHAPE_POLYLINEZ, FIELDS, prj="PROJCS[]") as writer:
+        writer.write_lines(x, y, z, offsets, part_counts, RECORDS)
+
+    shape_type, bbox, zbox, shapes, records = read_shapefile(tmp_path / "lines.shp")
+    assert shape_type == shapefile.POLYLINEZ
+    assert bbox == [x.min(), y.min(), x.max(), y.max()]
+    assert zbox == [z.min(), z.max()]
+    assert len(shapes) == 3
+    assert_parts(shapes, x, y, z, offsets, part_counts)
+    assert records == EXPECTED_RECORDS
+    assert (tmp_path / "lines.prj").read_text() == "PROJCS[]"
+
+def test_polygons_z(tmp_path):
+    # outer rings clockwise, the hole counter-clockwise
+    outer = [(0, 0), (0, 10), (10, 10), (10, 0), (0, 0)]
+    hole = [(2, 2), (4, 2), (4, 4), (2, 4), (2, 2)]
+    second = [(20, 0), (20, 5), (25, 5), (20, 0)]
+    rings = [outer, hole, second]
+    x = np.array([point[0] for ring in rings for point in ring], dtype=float)
+    y = np.array([point[1] for ring in rings for point in ring], dtype=float)
+    z = np.arange(len(x), dtype=float)
+    offsets = np.r_[0, np.cumsum([len(ring) for ring in rings])]
+    part_counts = np.array([2, 1])
+    with shapefile_writer.ShapefileWriter(str(tmp_path / "areas"), shapefile_writer.SHAPE_POLYGONZ, FIELDS) as writer:
+        writer.write_lines(x, y, z, offsets, part_counts, {"NAME": "las", "VALUE": 7})
+
+    shape_type, bbox, zbox, shapes, records = read_shapefile(tmp_path / "areas.shp")
+    assert shape_type == shapefile.POLYGONZ
+    assert bbox == [0.0, 0.0, 25.0, 10.0]
+    assert zbox == [0.0, len(x) - 1.0]
+    assert_parts(shapes, x, y, z, offsets, part_counts)
+    # scalar values are repeated in every record
+    assert records == [["las", 7.0, None]] * 2
+
+def test_empty_shapefile(tmp_path):
+    with shapefile_writer.ShapefileWriter(str(tmp_path / "empty"), shapefile_writer.SHAPE_POINT, FIELDS) as writer:
+        writer.write_points([], [])
+    with shapefile.Reader(str(tmp_path / "empty")) as reader:
+        assert len(reader) == 0
+        assert [field[0] for field in reader.fields[1:]] == ["NAME", "VALUE", "DATE"]
+
+def test_wrong_shape_type(tmp_path):
+    with shapefile_writer.ShapefileWriter(str(tmp_path / "points"), shapefile_writer.SHAPE_POINT, []) as writer:
+        with pytest.raises(ValueError):
+            writer.write_lines([0.0, 1.0], [0.0, 1.0], None, [0, 2])
@@ -1,6 +1,27 @@
 import arcpy
 import os
 
+import instrumentation
+
+
+def get_optional_parameter(index, default, as_text=False):
+    """
+    Tool parameter added in a newer version, it may not exist in an older toolbox.
+    Only a missing or empty value gives the default, 0 and False are kept.
+    """
+    if arcpy.GetArgumentCount() <= index:
+        return default
+    value = arcpy.GetParameterAsText(index) if as_text else arcpy.GetParameter(index)
+    return default if value is None or value == "" else value
+
+def report_instrumentation(trace_path=None):
+    """Adds the stage times as messages and writes the Chrome trace (JSON) if the path is given"""
+    arcpy.AddMessage("Stage times:")
+    for line in instrumentation.format_summary():
+        arcpy.AddMessage(line)
+    if trace_path:
+        instrumentation.write_chrome_trace(trace_path)
+        arcpy.AddMessage(f"Trace saved: {trace_path}")
 
 def set_arcpy_environment(workspace, spatial_ref):
     arcpy.env.overwriteOutput = True
@@ -44,6 +65,7 @@ def create_layer_name(fc):
 def list_field_values(fc, field):
     return [row[0] for row in arcpy.da.SearchCursor(fc, field)]
 
+@instrumentation.trace()
 def update(in_features, update_features, out_feature_class):
     workspace = "in_memory"
 